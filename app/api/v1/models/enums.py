@@ -19,6 +19,27 @@ class TaskStatus(str, Enum):
     started = 'started'
     finished = 'finished'
     failed = 'failed'
+    cancelled = 'cancelled'
+
+
+class TaskOperation(str, Enum):
+    register = 'register'
+    quality = 'quality'
+    liveness = 'liveness'
+    best_match = 'best_match'
+    match = 'match'
+    verify = 'verify'
+
+
+class TaskPriority(str, Enum):
+    interactive = 'interactive'
+    bulk = 'bulk'
+
+
+class VerifyStage(str, Enum):
+    quality = 'quality'
+    liveness = 'liveness'
+    best_match = 'best_match'
 
 
 class FileStatusType(str, Enum):
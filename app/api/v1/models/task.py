@@ -1,11 +1,16 @@
 import uuid
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 
 from pydantic import BaseModel
 from pydantic.fields import Field
 
 from api.v1.models.common import EngineIdBase
-from api.v1.models.enums import TaskStatus
+from api.v1.models.enums import (
+    TaskOperation,
+    TaskPriority,
+    TaskStatus,
+    VerifyStage,
+)
 
 
 class FaceIdBase(BaseModel):
@@ -56,6 +61,39 @@ class FaceBestMatchResult(FaceMatchResult, FaceIdBase):
     pass
 
 
+class FaceVerifyResult(BaseModel):
+    passed: bool = Field(
+        default=True,
+        title='Verification Passed',
+        description='All pipeline stages passed their thresholds'
+    )
+    stage: VerifyStage = Field(
+        default=VerifyStage.best_match,
+        title='Last Stage',
+        description='Last pipeline stage that was run'
+    )
+    quality: float = Field(
+        default=0.8,
+        title='Face Quality Score',
+        description='Face Quality Score'
+    )
+    liveness: Optional[float] = Field(
+        default=0.8,
+        title='Face Anti Spoofing Score',
+        description='Face Anti Spoofing Score (if quality passed)'
+    )
+    face_id: Optional[uuid.UUID] = Field(
+        default=uuid.uuid4(),
+        title='Face Id',
+        description='Best match face identificator (if liveness passed)',
+    )
+    score: Optional[float] = Field(
+        default=0.8,
+        title='Face Match Score',
+        description='Best match score (if liveness passed)'
+    )
+
+
 class TaskCreateRequest(EngineIdBase):
     file_hash: str = Field(
         default='8743b52063cd84097a65d1633f5c74f5', 
@@ -63,12 +101,52 @@ class TaskCreateRequest(EngineIdBase):
         description='File identificator (md5)',
         max_length=40
     )
+    priority: TaskPriority = Field(
+        default=TaskPriority.interactive,
+        title='Task Priority',
+        description='interactive tasks are served before bulk backlog'
+    )
+    timeout: Optional[float] = Field(
+        default=None,
+        title='Task Timeout',
+        description='Seconds to finish the task, after that it fails',
+        gt=0
+    )
 
 
 class TaskMatchCreateRequest(TaskCreateRequest, FaceIdBase):
     pass
 
 
+class TaskBatchItem(TaskCreateRequest):
+    operation: TaskOperation = Field(
+        default=TaskOperation.register,
+        title='Task Operation',
+        description='Task operation'
+    )
+    face_id: Optional[uuid.UUID] = Field(
+        default=None,
+        title='Face Id',
+        description='Face identificator (uuid), only for match'
+    )
+
+
+class TaskBatchRequest(BaseModel):
+    tasks: List[TaskBatchItem] = Field(
+        default=[TaskBatchItem()],
+        title='Tasks',
+        description='Tasks to create'
+    )
+
+
+class TaskBatchResponse(BaseModel):
+    task_ids: List[uuid.UUID] = Field(
+        default=[uuid.uuid4()],
+        title='Task Ids',
+        description='Task identificators (uuid) in the request order',
+    )
+
+
 class TaskResponse(BaseModel):
     status: TaskStatus = Field(
         default=TaskStatus.finished,
@@ -83,6 +161,7 @@ class TaskResponse(BaseModel):
             FaceAntiSpoofResult,
             FaceBestMatchResult,
             FaceMatchResult,
+            FaceVerifyResult,
             FailedResult,
         ]
     ] = Field(
@@ -90,6 +169,11 @@ class TaskResponse(BaseModel):
         title='Task Result',
         description='Task result',
     )
+    timings: Optional[Dict[str, float]] = Field(
+        default=None,
+        title='Task Timings',
+        description='Seconds spent in each stage, if requested',
+    )
 
 
 class TaskCreateResponse(BaseModel):
@@ -98,3 +182,35 @@ class TaskCreateResponse(BaseModel):
         title='Task Id', 
         description='Task identificator (uuid)',
     )
+
+
+class TaskListRequest(BaseModel):
+    task_ids: List[uuid.UUID] = Field(
+        default=[uuid.uuid4()],
+        title='Task Ids',
+        description='Task identificators (uuid)',
+    )
+    since: Optional[float] = Field(
+        default=None,
+        title='Changed Since',
+        description='Only tasks updated since this time, '
+                    'pass time of the previous response'
+    )
+
+
+class TaskListResponse(BaseModel):
+    time: float = Field(
+        default=0.0,
+        title='Poll Time',
+        description='Pass as since in the next request'
+    )
+    tasks: Dict[str, TaskResponse] = Field(
+        default={},
+        title='Tasks',
+        description='Task info by task id, only changed tasks with since'
+    )
+    missing: List[uuid.UUID] = Field(
+        default=[],
+        title='Missing Tasks',
+        description='Unknown or expired tasks'
+    )
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from api.v1.routes import engine, face, file, ping, task, token, user
+from api.v1.routes import engine, face, file, metrics, ping, task, token, user
 
 router = APIRouter()
 router.include_router(ping.router, tags=['ping'])
@@ -10,3 +10,4 @@ router.include_router(engine.router, tags=['engine'])
 router.include_router(file.router, tags=['file'])
 router.include_router(task.router, tags=['task'])
 router.include_router(face.router, tags=['face'])
+router.include_router(metrics.router, tags=['metrics'])
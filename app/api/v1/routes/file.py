@@ -1,29 +1,42 @@
 import logging
+import uuid
+from typing import Optional
 
-from fastapi import APIRouter, File, Query
+from fastapi import APIRouter, File, Form, Query
 from fastapi.params import Depends
 
 from api.v1.models.file import UploadFileResponse, UploadFileStatusResponse
+from core.config import get_config
+from core.db.definition import get_db
 from core.jwt.token import BearerForm
 from core.services import file_service as service
+from core.services import task_service
 
 router = APIRouter()
 logger = logging.getLogger('file_api')
+db = get_db()
 
 
 @router.post('/file', response_model=UploadFileResponse)
 def upload_file(
         data: bytes = File(...),
+        engine_id: Optional[uuid.UUID] = Form(None),
+        sess=Depends(db.get_session),
         _=Depends(BearerForm())
 ) -> UploadFileResponse:
     """Upload file.
 
     - input:
         - data: file
+        - engine_id: optional, engine to precompute quality and liveness
     - output:
         - UploadFileResponse: response with file hash and exired time
     """
     file_hash, exp = service.upload_file(data=data)
+    if engine_id is not None and get_config().precompute_on_upload:
+        task_service.precompute_results(
+            sess=sess, engine_id=engine_id, file_hash=file_hash
+        )
     return UploadFileResponse(
         file_hash=file_hash,
         exp=exp
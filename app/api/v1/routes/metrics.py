@@ -0,0 +1,22 @@
+import logging
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core.metrics import get_registry
+
+router = APIRouter()
+logger = logging.getLogger('metrics_api')
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+def get_metrics() -> PlainTextResponse:
+    """Get service metrics in Prometheus text format.
+
+    - output:
+        - text/plain: metrics
+    """
+    return PlainTextResponse(
+        get_registry().render(),
+        media_type='text/plain; version=0.0.4'
+    )
@@ -1,17 +1,23 @@
 import logging
 import uuid
+from typing import List, Optional
 
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, Header, Query
 from fastapi.params import Depends
 
 from api.v1.models.task import (
+    TaskBatchRequest,
+    TaskBatchResponse,
     TaskCreateRequest,
     TaskCreateResponse,
+    TaskListRequest,
+    TaskListResponse,
     TaskMatchCreateRequest,
     TaskResponse,
 )
 from core.db.definition import get_db
 from core.jwt.token import BearerForm
+from core.queue.models import TaskRequest
 from core.services import task_service as service
 
 router = APIRouter()
@@ -22,40 +28,100 @@ db = get_db()
 @router.get('/task', response_model=TaskResponse)
 def get_task_result(
         uuid: uuid.UUID = uuid.uuid4(),
+        timings: bool = False,
         _=Depends(BearerForm())
 ) -> TaskResponse:
     """Get task result.
 
     - input:
         - uuid: task ID
+        - timings: add seconds spent in each stage
     - output:
         - TaskResponse: task info
     """
+    if timings:
+        result, stages = service.get_task_result_with_timings(
+            task_id=uuid
+        )
+        return TaskResponse(**result.dict(), timings=stages)
     result = service.get_task_result(
         task_id=uuid
     )
     return result
 
 
+@router.get('/tasks', response_model=TaskListResponse)
+def get_task_results(
+        uuid: List[uuid.UUID] = Query([]),
+        since: Optional[float] = None,
+        _=Depends(BearerForm())
+) -> TaskListResponse:
+    """Get results of many tasks.
+
+    - input:
+        - uuid: task IDs, repeated
+        - since: time of the previous response, only changed tasks
+    - output:
+        - TaskListResponse: task info by task ID
+    """
+    return __get_task_results(task_ids=uuid, since=since)
+
+
+@router.post('/tasks', response_model=TaskListResponse)
+def post_task_results(
+        content: TaskListRequest,
+        _=Depends(BearerForm())
+) -> TaskListResponse:
+    """Get results of many tasks.
+
+    - input:
+        - TaskListRequest: task IDs and time of the previous response
+    - output:
+        - TaskListResponse: task info by task ID
+    """
+    return __get_task_results(task_ids=content.task_ids, since=content.since)
+
+
+@router.delete('/task', response_model=TaskResponse)
+def cancel_task(
+        uuid: uuid.UUID = uuid.uuid4(),
+        _=Depends(BearerForm())
+) -> TaskResponse:
+    """Cancel queued or started task.
+
+    - input:
+        - uuid: task ID
+    - output:
+        - TaskResponse: task info
+    """
+    result = service.cancel_task(
+        task_id=uuid
+    )
+    return result
+
+
 @router.post('/task/register', response_model=TaskCreateResponse)
 def register_face(
         content: TaskCreateRequest,
-        background_tasks: BackgroundTasks,
         sess=Depends(db.get_session),
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         _=Depends(BearerForm())
 ) -> TaskCreateResponse:
     """Register face.
 
     - input:
         - FaceRequest: task params
+        - Idempotency-Key: optional, retries return the same task
     - output:
         - TaskCreateResponse: task id
     """
     task_id = service.register_face(
         sess=sess,
-        background_tasks=background_tasks,
         engine_id=content.engine_id,
-        file_hash=content.file_hash
+        file_hash=content.file_hash,
+        priority=content.priority,
+        timeout=content.timeout,
+        idempotency_key=idempotency_key
     )
     return TaskCreateResponse(
         task_id=task_id
@@ -65,22 +131,25 @@ def register_face(
 @router.post('/task/quality', response_model=TaskCreateResponse)
 def check_face_quality(
         content: TaskCreateRequest,
-        background_tasks: BackgroundTasks,
         sess=Depends(db.get_session),
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         _=Depends(BearerForm())
 ) -> TaskCreateResponse:
     """Face quality
 
     - input:
         - FaceRequest: task params
+        - Idempotency-Key: optional, retries return the same task
     - output:
         - TaskCreateResponse: task id
     """
     task_id = service.check_face_quality(
         sess=sess,
-        background_tasks=background_tasks,
         engine_id=content.engine_id,
-        file_hash=content.file_hash
+        file_hash=content.file_hash,
+        priority=content.priority,
+        timeout=content.timeout,
+        idempotency_key=idempotency_key
     )
     return TaskCreateResponse(
         task_id=task_id
@@ -90,22 +159,25 @@ def check_face_quality(
 @router.post('/task/anti_spoofing', response_model=TaskCreateResponse)
 def check_face_anti_spoofing(
         content: TaskCreateRequest,
-        background_tasks: BackgroundTasks,
         sess=Depends(db.get_session),
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         _=Depends(BearerForm())
 ) -> TaskCreateResponse:
     """Face anti spoofing
 
     - input:
         - FaceRequest: task params
+        - Idempotency-Key: optional, retries return the same task
     - output:
         - TaskCreateResponse: task id
     """
     task_id = service.check_face_anti_spoofing(
         sess=sess,
-        background_tasks=background_tasks,
         engine_id=content.engine_id,
-        file_hash=content.file_hash
+        file_hash=content.file_hash,
+        priority=content.priority,
+        timeout=content.timeout,
+        idempotency_key=idempotency_key
     )
     return TaskCreateResponse(
         task_id=task_id
@@ -115,22 +187,25 @@ def check_face_anti_spoofing(
 @router.post('/task/best_match', response_model=TaskCreateResponse)
 def best_match(
         content: TaskCreateRequest,
-        background_tasks: BackgroundTasks,
         sess=Depends(db.get_session),
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         _=Depends(BearerForm())
 ) -> TaskCreateResponse:
     """Best match
 
     - input:
         - FaceRequest: task params
+        - Idempotency-Key: optional, retries return the same task
     - output:
         - TaskCreateResponse: task id
     """
     task_id = service.best_match(
         sess=sess,
-        background_tasks=background_tasks,
         engine_id=content.engine_id,
-        file_hash=content.file_hash
+        file_hash=content.file_hash,
+        priority=content.priority,
+        timeout=content.timeout,
+        idempotency_key=idempotency_key
     )
     return TaskCreateResponse(
         task_id=task_id
@@ -140,24 +215,99 @@ def best_match(
 @router.post("/task/match", response_model=TaskCreateResponse)
 def match_with_face(
         content: TaskMatchCreateRequest,
-        background_tasks: BackgroundTasks,
         sess=Depends(db.get_session),
+        idempotency_key: Optional[str] = Header(None, max_length=255),
         _=Depends(BearerForm())
 ) -> TaskCreateResponse:
     """
     Match with face
     - input:
         - FaceRequest: task params
+        - Idempotency-Key: optional, retries return the same task
     - output:
         - TaskCreateResponse: task id
     """
     task_id = service.match_with_face(
         sess=sess,
-        background_tasks=background_tasks,
         engine_id=content.engine_id,
         file_hash=content.file_hash,
-        face_id=content.face_id
+        face_id=content.face_id,
+        priority=content.priority,
+        timeout=content.timeout,
+        idempotency_key=idempotency_key
     )
     return TaskCreateResponse(
         task_id=task_id
     )
+
+
+@router.post('/task/verify', response_model=TaskCreateResponse)
+def verify_face(
+        content: TaskCreateRequest,
+        sess=Depends(db.get_session),
+        idempotency_key: Optional[str] = Header(None, max_length=255),
+        _=Depends(BearerForm())
+) -> TaskCreateResponse:
+    """
+    Verify face: quality, anti spoofing and best match in one task
+    - input:
+        - FaceRequest: task params
+        - Idempotency-Key: optional, retries return the same task
+    - output:
+        - TaskCreateResponse: task id
+    """
+    task_id = service.verify_face(
+        sess=sess,
+        engine_id=content.engine_id,
+        file_hash=content.file_hash,
+        priority=content.priority,
+        timeout=content.timeout,
+        idempotency_key=idempotency_key
+    )
+    return TaskCreateResponse(
+        task_id=task_id
+    )
+
+
+@router.post('/task/batch', response_model=TaskBatchResponse)
+def create_tasks(
+        content: TaskBatchRequest,
+        sess=Depends(db.get_session),
+        idempotency_key: Optional[str] = Header(None, max_length=255),
+        _=Depends(BearerForm())
+) -> TaskBatchResponse:
+    """
+    Create many tasks in one request
+    - input:
+        - TaskBatchRequest: list of task params with operation
+        - Idempotency-Key: optional, retries return the same tasks
+    - output:
+        - TaskBatchResponse: task ids in the request order
+    """
+    task_ids = service.create_tasks(
+        sess=sess,
+        tasks=[TaskRequest(**task.dict()) for task in content.tasks],
+        idempotency_key=idempotency_key
+    )
+    return TaskBatchResponse(
+        task_ids=task_ids
+    )
+
+
+def __get_task_results(
+        task_ids: List[uuid.UUID],
+        since: Optional[float]
+) -> TaskListResponse:
+    time, results = service.get_task_results(task_ids=task_ids, since=since)
+    return TaskListResponse(
+        time=time,
+        tasks={
+            str(task_id): TaskResponse(**result.dict())
+            for task_id, result in results.items()
+            if result is not None
+        },
+        missing=[
+            task_id for task_id, result in results.items()
+            if result is None
+        ],
+    )
@@ -0,0 +1,78 @@
+"""
+Compares the task codec with pickle: encode and decode time per record
+and stored bytes.
+
+    $ cd app && python -m benchmarks.codec_benchmark
+"""
+import pickle
+import timeit
+import uuid
+
+from core.provider.models.enums import TaskStatus, VerifyStage
+from core.provider.models.tasks import (
+    FaceBestMatchResult,
+    FaceBestMatchTask,
+    FaceQualityResult,
+    FaceQualityTask,
+    FaceVerifyResult,
+    FaceVerifyTask,
+    FailedResult,
+    Task,
+)
+from core.queue.codec import decode_task, encode_task
+
+NUMBER = 20000
+
+TASKS = {
+    'queued': Task(status=TaskStatus.queued),
+    'failed': Task(
+        status=TaskStatus.failed,
+        result=FailedResult(message='Internal provider error'),
+    ),
+    'quality': FaceQualityTask(
+        status=TaskStatus.finished,
+        result=FaceQualityResult(score=0.9),
+    ),
+    'best_match': FaceBestMatchTask(
+        status=TaskStatus.finished,
+        result=FaceBestMatchResult(score=0.9, face_id=str(uuid.uuid4())),
+    ),
+    'verify': FaceVerifyTask(
+        status=TaskStatus.finished,
+        result=FaceVerifyResult(
+            passed=True,
+            stage=VerifyStage.best_match,
+            quality=0.9,
+            liveness=0.9,
+            face_id=str(uuid.uuid4()),
+            score=0.9,
+        ),
+    ),
+}
+
+
+def measure(fn, arg) -> float:
+    return timeit.timeit(lambda: fn(arg), number=NUMBER) / NUMBER * 1e6
+
+
+def main() -> None:
+    print(
+        f'{"record":<12}{"format":<8}{"bytes":>8}'
+        f'{"encode, us":>14}{"decode, us":>14}'
+    )
+    for name, task in TASKS.items():
+        for codec, encode, decode in (
+            ('pickle', pickle.dumps, pickle.loads),
+            ('codec', encode_task, decode_task),
+        ):
+            raw = encode(task)
+            assert decode(raw) == task
+            print(
+                f'{name:<12}{codec:<8}{len(raw):>8}'
+                f'{measure(encode, task):>14.2f}'
+                f'{measure(decode, raw):>14.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,15 @@
 from functools import lru_cache
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.openapi import docs
 from fastapi.staticfiles import StaticFiles
 
 from api.v1.routes.api import router as api_router
+from core import tracing
 from core.config import get_config
-from core.exceptions.heandlers import register_heandlers
+from core.exceptions.handlers import register_heandlers
+from core.provider.manager import get_provider_manager
+from core.services import task_service
 
 
 @lru_cache()
@@ -51,5 +54,22 @@ def get_application() -> FastAPI:
     application.include_router(api_router, prefix=prefix)
 
     register_heandlers(application)
+
+    @application.middleware('http')
+    async def trace_request(request: Request, call_next):
+        with tracing.trace(
+                request.headers.get(tracing.HEADER),
+                f'{request.method} {request.url.path}',
+                'SERVER',
+        ) as span:
+            response = await call_next(request)
+            span.tag('http.status_code', response.status_code)
+            response.headers[tracing.HEADER] = span.traceparent
+        return response
+
+    @application.on_event('shutdown')
+    def shutdown_executors():
+        task_service.drain_tasks(get_config().shutdown_grace_period)
+        get_provider_manager().close()
     
     return application
@@ -0,0 +1,117 @@
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from redis import Redis
+
+from core.config import get_config
+from core.provider.models.enums import TaskOperation
+from core.provider.models.tasks import BaseTask
+from core.queue.codec import decode_stored_task, encode_task
+
+logger = logging.getLogger('result_cache')
+
+# operations that depend only on the provider and the image bytes
+CACHED_OPERATIONS = (TaskOperation.quality, TaskOperation.liveness)
+
+
+class ResultCache:
+    """
+    Results of finished tasks keyed on provider, operation and file hash.
+    Entries expire after ttl seconds; when there are more than max_size
+    entries the oldest ones are evicted.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            name: str,
+            ttl: int,
+            max_size: int
+    ) -> None:
+        self.__redis = redis
+        self.__name = name
+        self.__ttl = ttl
+        self.__max_size = max_size
+
+    @property
+    def index_key(self) -> str:
+        return f'{self.__name}:index'
+
+    def key(
+            self,
+            provider: str,
+            operation: TaskOperation,
+            file_hash: str
+    ) -> str:
+        return f'{self.__name}:{provider}:{operation.value}:{file_hash}'
+
+    def is_cached(self, operation: TaskOperation) -> bool:
+        if self.__ttl <= 0 or self.__max_size <= 0:
+            return False
+        return operation in CACHED_OPERATIONS
+
+    def get(
+            self,
+            provider: str,
+            operation: TaskOperation,
+            file_hash: str
+    ) -> Optional[BaseTask]:
+        if not self.is_cached(operation):
+            return None
+        return decode_stored_task(
+            self.__redis.get(self.key(provider, operation, file_hash))
+        )
+
+    def get_many(
+            self,
+            keys: List[Tuple[str, TaskOperation, str]]
+    ) -> List[Optional[BaseTask]]:
+        """
+        Results for (provider, operation, file hash) keys in one MGET.
+        """
+        cached = [
+            i for i, (_, operation, _) in enumerate(keys)
+            if self.is_cached(operation)
+        ]
+        results: List[Optional[BaseTask]] = [None] * len(keys)
+        if not cached:
+            return results
+        raws = self.__redis.mget([self.key(*keys[i]) for i in cached])
+        for i, raw in zip(cached, raws):
+            results[i] = decode_stored_task(raw)
+        return results
+
+    def set(
+            self,
+            provider: str,
+            operation: TaskOperation,
+            file_hash: str,
+            result: BaseTask
+    ) -> None:
+        if not self.is_cached(operation):
+            return
+        key = self.key(provider, operation, file_hash)
+        now = time.time()
+        pipe = self.__redis.pipeline()
+        pipe.set(key, encode_task(result), ex=self.__ttl)
+        pipe.zadd(self.index_key, {key: now})
+        pipe.zremrangebyscore(self.index_key, '-inf', now - self.__ttl)
+        pipe.zcard(self.index_key)
+        size = pipe.execute()[-1]
+
+        if size > self.__max_size:
+            evicted = self.__redis.zpopmin(
+                self.index_key, size - self.__max_size
+            )
+            if evicted:
+                self.__redis.delete(*[key for key, _ in evicted])
+
+
+def create_result_cache(redis: Redis) -> ResultCache:
+    return ResultCache(
+        redis=redis,
+        name=get_config().result_cache_name,
+        ttl=get_config().result_cache_ttl,
+        max_size=get_config().result_cache_size,
+    )
@@ -1,9 +1,11 @@
 from functools import lru_cache
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 import yaml
 from pydantic import BaseSettings
 
+from core.provider.models.enums import TaskBackend, TaskPriority
+
 
 def read_yaml_settings(settings: BaseSettings) -> Dict[str, Any]:
     yaml_settings = dict()
@@ -39,6 +41,41 @@ class AppConfig(BaseSettings):
     redis_queue_exp: int = 500
 
     provider_namespace: str = 'providers'
+    orchestrator_queue_size: int = 64
+    # image bytes held by submitted tasks per process, 0 - no limit
+    payload_budget_mb: int = 0
+    match_fanout: int = 4
+    result_cache_name: str = 'result'
+    result_cache_ttl: int = 3600
+    result_cache_size: int = 10000
+    # bulk quality and liveness tasks on POST /file with engine_id
+    precompute_on_upload: bool = False
+    priority_weights: Dict[TaskPriority, float] = {
+        TaskPriority.interactive: 8,
+        TaskPriority.bulk: 1,
+    }
+
+    task_backend: TaskBackend = TaskBackend.local
+    task_batch_size: int = 1000
+    queue_name: str = 'queue'
+    queue_visibility_timeout: int = 600
+    queue_max_attempts: int = 3
+    # engine affinity: pending lists per shard of engine_id, 0 - off
+    queue_shards: int = 0
+    queue_affinity_workers: int = 2
+    queue_steal_backlog: int = 4
+    single_flight_name: str = 'flight'
+    cancel_name: str = 'cancel'
+    timings_name: str = 'timings'
+    idempotency_name: str = 'idempotency'
+    idempotency_ttl: int = 86400
+    # Zipkin v2 JSON spans, one per line, no export if not set
+    trace_file: Optional[str] = None
+    worker_concurrency: int = 8
+    worker_heartbeat_interval: int = 5
+    worker_heartbeat_ttl: int = 15
+    # seconds for running tasks to finish on shutdown
+    shutdown_grace_period: float = 30
 
     class Config:
         env_file_encoding = 'utf-8'
@@ -1,9 +1,10 @@
 from functools import lru_cache
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 from core.config import get_config
+from core.tracing import trace_engine
 
 
 class DataBase:
@@ -20,6 +21,7 @@ class DataBase:
         self.__engine = create_engine(
             connection_string
         )
+        trace_engine(self.__engine)
         self.__local_session = sessionmaker(
             autocommit=False, 
             autoflush=False, 
@@ -33,6 +35,9 @@ class DataBase:
         finally:
             sess.close()
 
+    def create_session(self) -> Session:
+        return self.__local_session()
+
     def get_engine(self):
         return self.__engine
 
@@ -98,6 +98,18 @@ def get_engines(
         raise DbError('Can not get engines from db')
 
 
+def get_engines_by_ids(
+        sess: Session,
+        engine_ids: List[uuid.UUID]
+) -> List[Engine]:
+    try:
+        return sess.query(Engine).filter(
+            Engine.engine_id.in_(engine_ids)
+        ).all()
+    except Exception:
+        raise DbError('Can not get engines from db')
+
+
 def get_engines_count(sess: Session) -> int:
     try:
         return len(sess.query(Engine).all())
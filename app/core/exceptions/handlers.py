@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 
 from core.exceptions.app import AppError, InputError
 from core.exceptions.db import DbError
+from core.exceptions.orchestrator import QueueFullError
 
 
 def db_error_handler(request: Request, exc: DbError):
@@ -26,7 +27,16 @@ def app_error_handler(request: Request, exc: AppError):
     )
 
 
+def queue_full_error_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={'message': str(exc)},
+        headers={'Retry-After': '1'}
+    )
+
+
 def register_heandlers(app: FastAPI):
     app.add_exception_handler(InputError, input_error_handler)
     app.add_exception_handler(DbError, db_error_handler)
+    app.add_exception_handler(QueueFullError, queue_full_error_handler)
     app.add_exception_handler(AppError, app_error_handler)
@@ -0,0 +1,21 @@
+from core.exceptions.app import AppError
+
+
+class OrchestratorError(AppError):
+    pass
+
+
+class QueueFullError(OrchestratorError):
+    pass
+
+
+class PayloadBudgetError(QueueFullError):
+    pass
+
+
+class TaskCancelledError(OrchestratorError):
+    pass
+
+
+class DeadlineExceededError(OrchestratorError):
+    pass
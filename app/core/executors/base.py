@@ -0,0 +1,81 @@
+from typing import Any, Callable, Hashable, Optional
+
+from pydantic import BaseModel, root_validator
+
+
+class ExecutorParams(BaseModel):
+    max_workers: int = 1
+    min_workers: int = 0
+    queue_size: Optional[int]
+    # start a worker when the oldest queued job waited this long
+    scale_up_wait_ms: int = 100
+    # stop a worker above min_workers after this idle time
+    idle_timeout_ms: int = 30000
+
+    @root_validator
+    def check_workers(cls, values):
+        max_workers = values.get('max_workers')
+        min_workers = values.get('min_workers')
+        if max_workers is None or max_workers < 1:
+            raise ValueError('max_workers must be positive')
+        if min_workers is None or not 0 <= min_workers <= max_workers:
+            raise ValueError('min_workers must be in [0, max_workers]')
+        queue_size = values.get('queue_size')
+        if queue_size is not None and queue_size < 1:
+            raise ValueError('queue_size must be positive')
+        if values.get('scale_up_wait_ms', 0) < 1:
+            raise ValueError('scale_up_wait_ms must be positive')
+        if values.get('idle_timeout_ms', 0) < 1:
+            raise ValueError('idle_timeout_ms must be positive')
+        return values
+
+
+class IExecutor:
+    """Base executor class. Runs orchestrator jobs for a single provider."""
+
+    def submit(
+            self,
+            job: Callable[[], Any],
+            flow: Optional[Hashable] = None,
+            weight: float = 1
+    ) -> None:
+        """
+        Put job into the executor queue. Backlogged flows share the
+        workers in proportion to their weights.
+        Raises QueueFullError if the job can not be accepted.
+        """
+        raise NotImplementedError()
+
+    @property
+    def is_async(self) -> bool:
+        """
+        True if jobs are coroutine functions.
+        """
+        return False
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop workers. Queued jobs are dropped.
+        """
+        raise NotImplementedError()
+
+    @property
+    def queue_size(self) -> int:
+        """
+        Maximum number of jobs waiting for a free worker.
+        """
+        raise NotImplementedError()
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of jobs waiting for a free worker.
+        """
+        raise NotImplementedError()
+
+    @property
+    def running(self) -> int:
+        """
+        Number of jobs in progress.
+        """
+        raise NotImplementedError()
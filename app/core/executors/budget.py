@@ -0,0 +1,99 @@
+import threading
+from functools import lru_cache
+from typing import Dict, Tuple
+
+from core.config import get_config
+from core.metrics import get_registry
+
+inflight_bytes = get_registry().gauge(
+    'payload_inflight_bytes',
+    'Image bytes held by submitted tasks',
+)
+rejected_payloads = get_registry().counter(
+    'payload_rejected_total',
+    'Tasks rejected because the payload budget is exhausted',
+)
+
+
+class PayloadBudget:
+    """
+    Process-wide limit of image bytes held by tasks from submit until the
+    task is done. A buffer shared by several tasks (e.g. a batch on one
+    file) is counted once. A payload larger than the whole budget is
+    admitted only when nothing else is held.
+
+    Payloads can be reserved by size before they are fetched, buffers
+    acquired under a reservation skip the budget check.
+    """
+
+    def __init__(self, limit: int) -> None:
+        # 0 - no limit
+        self.__limit = limit
+        self.__used = 0
+        # id of the buffer -> size, holders
+        self.__held: Dict[int, Tuple[int, int]] = {}
+        self.__lock = threading.Lock()
+        inflight_bytes.set(0)
+
+    @property
+    def used(self) -> int:
+        return self.__used
+
+    def reserve(self, size: int) -> bool:
+        """
+        Returns False if size bytes do not fit in the budget. A reservation
+        is held until unreserve, also after its buffers are acquired.
+        """
+        with self.__lock:
+            if not self.__fits(size):
+                rejected_payloads.inc()
+                return False
+            self.__used += size
+            used = self.__used
+        inflight_bytes.set(used)
+        return True
+
+    def unreserve(self, size: int) -> None:
+        with self.__lock:
+            self.__used -= size
+            used = self.__used
+        inflight_bytes.set(used)
+
+    def acquire(self, data: bytes, reserved: bool = False) -> bool:
+        """
+        Returns False if the payload does not fit in the budget. reserved
+        payloads always fit.
+        """
+        key = id(data)
+        with self.__lock:
+            size, holders = self.__held.get(key, (len(data), 0))
+            if holders == 0:
+                if not reserved and not self.__fits(size):
+                    rejected_payloads.inc()
+                    return False
+                self.__used += size
+            self.__held[key] = (size, holders + 1)
+            used = self.__used
+        inflight_bytes.set(used)
+        return True
+
+    def release(self, data: bytes) -> None:
+        key = id(data)
+        with self.__lock:
+            size, holders = self.__held.pop(key)
+            if holders > 1:
+                self.__held[key] = (size, holders - 1)
+            else:
+                self.__used -= size
+            used = self.__used
+        inflight_bytes.set(used)
+
+    def __fits(self, size: int) -> bool:
+        if self.__limit == 0 or self.__used == 0:
+            return True
+        return self.__used + size <= self.__limit
+
+
+@lru_cache()
+def get_payload_budget() -> PayloadBudget:
+    return PayloadBudget(get_config().payload_budget_mb * 1024 * 1024)
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import queue
+import threading
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from core.exceptions.orchestrator import QueueFullError
+from core.executors.base import IExecutor
+from core.executors.scheduler import FairQueue
+
+
+class AsyncioExecutor(IExecutor):
+    """
+    Runs coroutine jobs on a dedicated event loop thread: at most
+    max_workers jobs are awaited at the same time and at most queue_size
+    jobs wait for a free slot. Waiting jobs are started in weighted fair
+    order of their flows.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_workers: int,
+            queue_size: int
+    ) -> None:
+        self.__name = name
+        self.__max_workers = max_workers
+        self.__queue_size = queue_size
+        self.__queue = FairQueue(maxsize=queue_size)
+        self.__running = 0
+        self.__lock = threading.Lock()
+        self.__shutdown = False
+        self.__logger = logging.getLogger(f'executor.{name}')
+
+        self.__loop = asyncio.new_event_loop()
+        self.__thread = threading.Thread(
+            target=self.__loop.run_forever,
+            name=f'{name}-loop',
+            daemon=True,
+        )
+        self.__thread.start()
+
+    @property
+    def is_async(self) -> bool:
+        return True
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self.__loop
+
+    def submit(
+            self,
+            job: Callable[[], Awaitable[Any]],
+            flow: Optional[Hashable] = None,
+            weight: float = 1
+    ) -> None:
+        if self.__shutdown:
+            raise QueueFullError(f'Provider {self.__name} is shutting down')
+        try:
+            self.__queue.put_nowait(job, flow=flow, weight=weight)
+        except queue.Full:
+            self.__logger.warning(
+                'queue is full: %d jobs pending', self.__queue.qsize()
+            )
+            raise QueueFullError(f'Provider {self.__name} is overloaded')
+        self.__loop.call_soon_threadsafe(self.__dispatch)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self.__lock:
+            self.__shutdown = True
+        self.__queue.close()
+        if self.__loop.is_running():
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+        if wait:
+            self.__thread.join()
+
+    @property
+    def queue_size(self) -> int:
+        return self.__queue_size
+
+    @property
+    def pending(self) -> int:
+        return self.__queue.qsize()
+
+    @property
+    def running(self) -> int:
+        return self.__running
+
+    def __dispatch(self) -> None:
+        # runs on the loop thread only
+        while self.__running < self.__max_workers:
+            try:
+                job = self.__queue.get_nowait()
+            except queue.Empty:
+                return
+            with self.__lock:
+                self.__running += 1
+            self.__loop.create_task(self.__run(job))
+
+    async def __run(self, job: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            await job()
+        except Exception:
+            self.__logger.error('job failed', exc_info=True)
+        finally:
+            with self.__lock:
+                self.__running -= 1
+            self.__dispatch()
@@ -0,0 +1,196 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from redis import Redis
+
+from core import orchestrator
+from core.config import get_config
+from core.exceptions.orchestrator import PayloadBudgetError, QueueFullError
+from core.executors.base import ExecutorParams, IExecutor
+from core.executors.budget import get_payload_budget
+from core.executors.event_loop import AsyncioExecutor
+from core.executors.thread import ThreadExecutor
+from core.provider.interfaces import IProvider
+from core.provider.manager import get_provider_manager
+from core.provider.models.enums import OrchestratorType
+from core.queue.models import TaskEnvelope
+from core.queue.timings import TaskTimings
+
+logger = logging.getLogger('executor_manager')
+
+
+def create_executor(provider: IProvider) -> IExecutor:
+    params = ExecutorParams(**(provider.params or {}))
+    queue_size = params.queue_size or get_config().orchestrator_queue_size
+
+    if provider.orchestrator_type == OrchestratorType.asyncio:
+        return AsyncioExecutor(
+            name=provider.name,
+            max_workers=params.max_workers,
+            queue_size=queue_size,
+        )
+
+    if provider.orchestrator_type not in (
+        OrchestratorType.thread,
+        OrchestratorType.process,
+        OrchestratorType.host,
+    ):
+        logger.warning(
+            'Orchestrator %s is not supported for %s, use thread',
+            provider.orchestrator_type, provider.name
+        )
+    return ThreadExecutor(
+        name=provider.name,
+        max_workers=params.max_workers,
+        min_workers=params.min_workers,
+        queue_size=queue_size,
+        scale_up_wait=params.scale_up_wait_ms / 1000,
+        idle_timeout=params.idle_timeout_ms / 1000,
+    )
+
+
+class ExecutorManager(object):
+    def __init__(self, providers: Iterable[IProvider]):
+        self.__executors: Dict[str, IExecutor] = {}
+        # submitted tasks that are not done yet
+        self.__tasks: Dict[str, TaskEnvelope] = {}
+        self.__draining = False
+        self.__tasks_done = threading.Condition()
+
+        for provider in providers:
+            logger.info('Init executor for %s', provider.name)
+            self.__executors.update({provider.name: create_executor(provider)})
+
+    def get_executor(self, name: str) -> IExecutor:
+        assert name in self.__executors.keys(), 'No such executor'
+        return self.__executors[name]
+
+    def free_slots(self, name: str) -> int:
+        """
+        Number of jobs the executor queue can take now.
+        """
+        executor = self.get_executor(name)
+        return max(executor.queue_size - executor.pending, 0)
+
+    def submit(
+            self,
+            name: str,
+            fn: Callable[..., Any],
+            *args,
+            **kwargs
+    ) -> None:
+        self.get_executor(name).submit(functools.partial(fn, *args, **kwargs))
+
+    def submit_task(
+            self,
+            task: TaskEnvelope,
+            provider: IProvider,
+            data: bytes,
+            redis: Redis,
+            done: Optional[Callable[[], None]] = None,
+            timings: Optional[TaskTimings] = None,
+            reserved: bool = False
+    ) -> None:
+        """
+        Run orchestrator function for the task on the provider executor.
+        done is called after the task is finished or failed. timings
+        holds the stages measured before the submit.
+
+        data counts against the payload budget until the task is done.
+        Raises PayloadBudgetError if it does not fit, unless the caller
+        reserved it in the budget.
+        """
+        executor = self.get_executor(task.provider)
+        with self.__tasks_done:
+            if self.__draining:
+                raise QueueFullError('Service is shutting down')
+            self.__tasks[task.task_id] = task
+        budget = get_payload_budget()
+        if not budget.acquire(data, reserved):
+            self.__task_done(task)
+            raise PayloadBudgetError('Payload budget is exhausted')
+
+        if executor.is_async:
+            async def job() -> None:
+                try:
+                    await orchestrator.run_async(
+                        task=task, provider=provider, data=data, redis=redis,
+                        timings=timings
+                    )
+                finally:
+                    budget.release(data)
+                    try:
+                        if done is not None:
+                            loop = asyncio.get_running_loop()
+                            await loop.run_in_executor(None, done)
+                    finally:
+                        self.__task_done(task)
+        else:
+            def job() -> None:
+                try:
+                    orchestrator.run(
+                        task=task, provider=provider, data=data, redis=redis,
+                        timings=timings
+                    )
+                finally:
+                    budget.release(data)
+                    try:
+                        if done is not None:
+                            done()
+                    finally:
+                        self.__task_done(task)
+
+        try:
+            executor.submit(
+                job,
+                flow=(task.engine_id, task.priority),
+                weight=get_config().priority_weights.get(task.priority, 1),
+            )
+        except BaseException:
+            budget.release(data)
+            self.__task_done(task)
+            raise
+
+    def drain(self, grace_period: float) -> List[TaskEnvelope]:
+        """
+        Stop accepting tasks, wait up to grace_period seconds for the
+        submitted ones and shut down the executors. Returns the tasks
+        that are not done, the caller fails or requeues them.
+        """
+        deadline = time.monotonic() + grace_period
+        with self.__tasks_done:
+            self.__draining = True
+            logger.info('Drain %d tasks', len(self.__tasks))
+            while self.__tasks:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.__tasks_done.wait(timeout)
+            unfinished = list(self.__tasks.values())
+        if unfinished:
+            logger.warning(
+                '%d tasks are not done after %.1f s',
+                len(unfinished), grace_period
+            )
+        # threads of unfinished tasks can hang in engine calls
+        self.shutdown(wait=not unfinished)
+        return unfinished
+
+    def shutdown(self, wait: bool = True) -> None:
+        for executor in self.__executors.values():
+            executor.shutdown(wait=wait)
+
+    def __task_done(self, task: TaskEnvelope) -> None:
+        with self.__tasks_done:
+            self.__tasks.pop(task.task_id, None)
+            self.__tasks_done.notify_all()
+
+
+@lru_cache()
+def get_executor_manager() -> ExecutorManager:
+    return ExecutorManager(get_provider_manager().providers)
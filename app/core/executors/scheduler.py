@@ -0,0 +1,110 @@
+import heapq
+import itertools
+import queue
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class FairQueue:
+    """
+    Weighted fair queue of jobs. Jobs of one flow are served in FIFO
+    order; backlogged flows share the workers in proportion to their
+    weights, so a flow with a long backlog does not delay other flows.
+
+    Uses start-time fair queuing: a job gets the virtual finish tag
+    max(virtual time, previous tag of its flow) + 1 / weight and the job
+    with the smallest tag is served first.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.__maxsize = maxsize
+        self.__heap: List[Tuple[float, int, float, Any]] = []
+        self.__finish: Dict[Hashable, float] = {}
+        self.__virtual_time = 0.0
+        self.__counter = itertools.count()
+        # enqueue time by item number, in insertion (FIFO) order
+        self.__enqueued: Dict[int, float] = {}
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+    def put_nowait(
+            self,
+            item: Any,
+            flow: Optional[Hashable] = None,
+            weight: float = 1
+    ) -> None:
+        """
+        Raises queue.Full if the queue has maxsize items or is closed.
+        """
+        if weight <= 0:
+            raise ValueError('weight must be positive')
+        with self.__condition:
+            if self.__closed or len(self.__heap) >= self.__maxsize:
+                raise queue.Full()
+            start = max(self.__virtual_time, self.__finish.get(flow, 0.0))
+            finish = start + 1 / weight
+            self.__finish[flow] = finish
+            number = next(self.__counter)
+            self.__enqueued[number] = time.monotonic()
+            heapq.heappush(self.__heap, (finish, number, start, item))
+            self.__condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """
+        Waits for the next item. Returns None after close().
+        Raises queue.Empty if there is no item after timeout seconds.
+        """
+        with self.__condition:
+            if not self.__condition.wait_for(
+                lambda: self.__heap or self.__closed, timeout
+            ):
+                raise queue.Empty()
+            if self.__closed:
+                return None
+            return self.__pop()
+
+    def get_nowait(self) -> Any:
+        """
+        Raises queue.Empty if there are no items.
+        """
+        with self.__condition:
+            if not self.__heap:
+                raise queue.Empty()
+            return self.__pop()
+
+    def qsize(self) -> int:
+        return len(self.__heap)
+
+    def oldest_wait(self) -> float:
+        """
+        Seconds the oldest queued item has waited, 0 if there are none.
+        """
+        with self.__condition:
+            for enqueued_at in self.__enqueued.values():
+                return time.monotonic() - enqueued_at
+            return 0.0
+
+    def close(self) -> int:
+        """
+        Drop queued items and wake up waiting consumers.
+        Returns number of dropped items.
+        """
+        with self.__condition:
+            self.__closed = True
+            dropped = len(self.__heap)
+            self.__heap.clear()
+            self.__finish.clear()
+            self.__enqueued.clear()
+            self.__condition.notify_all()
+        return dropped
+
+    def __pop(self) -> Any:
+        _, number, start, item = heapq.heappop(self.__heap)
+        del self.__enqueued[number]
+        self.__virtual_time = start
+        if not self.__heap:
+            # all flows are idle, their tags are not needed anymore
+            self.__finish.clear()
+            self.__virtual_time = 0.0
+        return item
@@ -0,0 +1,191 @@
+import itertools
+import logging
+import queue
+import threading
+from typing import Any, Callable, Hashable, List, Optional
+
+from core.exceptions.orchestrator import QueueFullError
+from core.executors.base import IExecutor
+from core.executors.scheduler import FairQueue
+from core.metrics import get_registry
+
+pool_workers = get_registry().gauge(
+    'executor_workers',
+    'Worker threads of the provider pool',
+    ('provider',),
+)
+pool_scaling = get_registry().counter(
+    'executor_scaling_total',
+    'Worker pool scaling decisions',
+    ('provider', 'direction'),
+)
+
+
+class ThreadExecutor(IExecutor):
+    """
+    Bounded thread pool: at most max_workers jobs run at the same time and
+    at most queue_size jobs wait for a free worker. Waiting jobs are
+    served in weighted fair order of their flows.
+
+    The pool keeps min_workers threads. It adds a thread when the oldest
+    queued job has waited scale_up_wait seconds and no worker is idle,
+    and a thread above min_workers stops after idle_timeout seconds
+    without jobs.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_workers: int,
+            min_workers: int,
+            queue_size: int,
+            scale_up_wait: float = 0.1,
+            idle_timeout: float = 30
+    ) -> None:
+        self.__name = name
+        self.__max_workers = max_workers
+        self.__min_workers = min_workers
+        self.__scale_up_wait = scale_up_wait
+        self.__idle_timeout = idle_timeout
+        self.__queue_size = queue_size
+        self.__queue = FairQueue(maxsize=queue_size)
+        self.__threads: List[threading.Thread] = []
+        self.__numbers = itertools.count()
+        self.__idle = 0
+        self.__running = 0
+        self.__lock = threading.Lock()
+        self.__shutdown = False
+        self.__stopped = threading.Event()
+        self.__logger = logging.getLogger(f'executor.{name}')
+
+        with self.__lock:
+            for _ in range(min_workers):
+                self.__start_worker()
+        self.__scaler = threading.Thread(
+            target=self.__scale, name=f'{name}-scaler', daemon=True
+        )
+        self.__scaler.start()
+
+    def submit(
+            self,
+            job: Callable[[], Any],
+            flow: Optional[Hashable] = None,
+            weight: float = 1
+    ) -> None:
+        if self.__shutdown:
+            raise QueueFullError(f'Provider {self.__name} is shutting down')
+        try:
+            self.__queue.put_nowait(job, flow=flow, weight=weight)
+        except queue.Full:
+            self.__logger.warning(
+                'queue is full: %d jobs pending', self.__queue.qsize()
+            )
+            raise QueueFullError(f'Provider {self.__name} is overloaded')
+        self.__scale_up()
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self.__lock:
+            self.__shutdown = True
+            threads = list(self.__threads)
+        self.__stopped.set()
+        self.__queue.close()
+        if wait:
+            for thread in threads:
+                thread.join()
+            self.__scaler.join()
+
+    @property
+    def queue_size(self) -> int:
+        return self.__queue_size
+
+    @property
+    def pending(self) -> int:
+        return self.__queue.qsize()
+
+    @property
+    def running(self) -> int:
+        return self.__running
+
+    @property
+    def workers(self) -> int:
+        return len(self.__threads)
+
+    def __scale(self) -> None:
+        # jobs queued while all workers are busy are not seen by submit
+        while not self.__stopped.wait(self.__scale_up_wait):
+            self.__scale_up()
+
+    def __scale_up(self) -> None:
+        with self.__lock:
+            if self.__shutdown:
+                return
+            if len(self.__threads) >= self.__max_workers:
+                return
+            # idle workers take the queued jobs
+            if self.__queue.qsize() <= self.__idle:
+                return
+            wait = self.__queue.oldest_wait()
+            if self.__threads and wait < self.__scale_up_wait:
+                return
+            self.__start_worker()
+            workers = len(self.__threads)
+        self.__logger.info(
+            'scale up to %d workers: oldest job waited %.0f ms',
+            workers, wait * 1000
+        )
+        pool_scaling.inc(provider=self.__name, direction='up')
+
+    def __start_worker(self) -> None:
+        thread = threading.Thread(
+            target=self.__work,
+            name=f'{self.__name}-{next(self.__numbers)}',
+            daemon=True,
+        )
+        self.__threads.append(thread)
+        self.__idle += 1
+        pool_workers.set(len(self.__threads), provider=self.__name)
+        thread.start()
+
+    def __work(self) -> None:
+        while True:
+            try:
+                job = self.__queue.get(timeout=self.__idle_timeout)
+            except queue.Empty:
+                if self.__stop_idle_worker():
+                    return
+                continue
+            if job is None:
+                break
+
+            with self.__lock:
+                self.__idle -= 1
+                self.__running += 1
+            try:
+                job()
+            except Exception:
+                self.__logger.error('job failed', exc_info=True)
+            finally:
+                with self.__lock:
+                    self.__idle += 1
+                    self.__running -= 1
+
+        with self.__lock:
+            self.__remove_worker()
+
+    def __stop_idle_worker(self) -> bool:
+        with self.__lock:
+            if len(self.__threads) <= self.__min_workers:
+                return False
+            self.__remove_worker()
+            workers = len(self.__threads)
+        self.__logger.info(
+            'scale down to %d workers: idle for %.1f s',
+            workers, self.__idle_timeout
+        )
+        pool_scaling.inc(provider=self.__name, direction='down')
+        return True
+
+    def __remove_worker(self) -> None:
+        self.__idle -= 1
+        self.__threads.remove(threading.current_thread())
+        pool_workers.set(len(self.__threads), provider=self.__name)
@@ -0,0 +1,226 @@
+import threading
+from functools import lru_cache
+from typing import Dict, List, Tuple, Type, TypeVar, Union
+
+LabelValues = Tuple[str, ...]
+M = TypeVar('M', bound='Counter')
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labels: Tuple[str, ...] = ()
+    ) -> None:
+        self.__name = name
+        self.__description = description
+        self.__labels = labels
+        self.__values: Dict[LabelValues, float] = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self.__values.get(self._label_values(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [
+            f'# HELP {self.__name} {self.__description}',
+            f'# TYPE {self.__name} {self._type}',
+        ]
+        with self.__lock:
+            values = sorted(self.__values.items())
+        for key, value in values:
+            lines.append(f'{self.__name}{self._format(key)} {value}')
+        return lines
+
+    @property
+    def _type(self) -> str:
+        return 'counter'
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.__labels):
+            raise ValueError(
+                f'{self.__name} expects labels {self.__labels}'
+            )
+        return tuple(str(labels[label]) for label in self.__labels)
+
+    def _set(self, value: float, labels: Dict[str, str]) -> None:
+        key = self._label_values(labels)
+        with self.__lock:
+            self.__values[key] = value
+
+    def _format(self, key: LabelValues) -> str:
+        if not key:
+            return ''
+        pairs = ','.join(
+            f'{label}="{value}"' for label, value in zip(self.__labels, key)
+        )
+        return '{' + pairs + '}'
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down, e.g. a pool size or a state.
+    """
+
+    def set(self, value: float, **labels: str) -> None:
+        self._set(value, labels)
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    @property
+    def _type(self) -> str:
+        return 'gauge'
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+
+    DEFAULT_BUCKETS = (
+        0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+    )
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labels: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        self.__name = name
+        self.__description = description
+        self.__buckets = tuple(sorted(buckets))
+        # label values -> bucket counts, sum, count
+        self.__values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+        self.__lock = threading.Lock()
+        # formats label values, holds no values itself
+        self.__keys = Counter(name, description, labels)
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.__keys._label_values(labels)
+        with self.__lock:
+            counts, total, count = self.__values.get(
+                key, ([0] * len(self.__buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.__buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.__values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels: str) -> int:
+        key = self.__keys._label_values(labels)
+        with self.__lock:
+            return self.__values.get(key, ([], 0.0, 0))[2]
+
+    def render(self) -> List[str]:
+        lines = [
+            f'# HELP {self.__name} {self.__description}',
+            f'# TYPE {self.__name} histogram',
+        ]
+        with self.__lock:
+            values = sorted(
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self.__values.items()
+            )
+        for key, counts, total, count in values:
+            labels = self.__keys._format(key)
+            prefix = labels[:-1] + ',' if labels else '{'
+            for bound, bucket in zip(self.__buckets, counts):
+                lines.append(
+                    f'{self.__name}_bucket{prefix}le="{bound}"}} {bucket}'
+                )
+            lines.append(f'{self.__name}_bucket{prefix}le="+Inf"}} {count}')
+            lines.append(f'{self.__name}_sum{labels} {total}')
+            lines.append(f'{self.__name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """
+    Process-wide metrics in Prometheus text format.
+    """
+
+    def __init__(self) -> None:
+        self.__metrics: Dict[str, Union[Counter, Histogram]] = {}
+        self.__lock = threading.Lock()
+
+    def counter(
+            self,
+            name: str,
+            description: str,
+            labels: Tuple[str, ...] = ()
+    ) -> Counter:
+        return self.__get(Counter, name, description, labels)
+
+    def gauge(
+            self,
+            name: str,
+            description: str,
+            labels: Tuple[str, ...] = ()
+    ) -> Gauge:
+        return self.__get(Gauge, name, description, labels)
+
+    def histogram(
+            self,
+            name: str,
+            description: str,
+            labels: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = Histogram.DEFAULT_BUCKETS
+    ) -> Histogram:
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = Histogram(
+                    name, description, labels, buckets
+                )
+            metric = self.__metrics[name]
+        if not isinstance(metric, Histogram):
+            raise ValueError(f'{name} is already registered')
+        return metric
+
+    def render(self) -> str:
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def __get(
+            self,
+            metric_class: Type[M],
+            name: str,
+            description: str,
+            labels: Tuple[str, ...]
+    ) -> M:
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = metric_class(name, description, labels)
+            metric = self.__metrics[name]
+        if not isinstance(metric, metric_class):
+            raise ValueError(f'{name} is already registered')
+        return metric
+
+
+@lru_cache()
+def get_registry() -> Registry:
+    return Registry()
@@ -1,243 +1,877 @@
+import asyncio
+import contextvars
+import functools
 import logging
-import pickle
+import threading
+import time
 import uuid
-from typing import List, Union
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import (
+    Awaitable,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    Optional,
+    Union,
+)
 
 from redis import Redis
-from sqlalchemy.orm import Session
 
+from core import tracing
+from core.cache.result_cache import create_result_cache
 from core.config import get_config
+from core.db.definition import get_db
 from core.db.operations import face as db_ops
+from core.exceptions.orchestrator import (
+    DeadlineExceededError,
+    TaskCancelledError,
+)
+from core.executors.base import ExecutorParams
 from core.provider.interfaces import IProvider
+from core.provider.models.enums import (
+    TaskOperation,
+    TaskPriority,
+    TimingStage,
+    VerifyStage,
+)
 from core.provider.models.tasks import (
+    BaseTask,
     FaceMatchResult,
     FaceMatchTask,
+    FaceVerifyResult,
+    FaceVerifyTask,
     FailedResult,
     Task,
     TaskStatus,
 )
+from core.queue.context import (
+    DEADLINE_MESSAGE,
+    TaskContext,
+    check_deadline,
+    check_task,
+    check_task_async,
+    current_task,
+    task_context,
+    timed,
+)
+from core.queue.models import TaskEnvelope
+from core.queue.single_flight import SingleFlight, create_single_flight
+from core.queue.task_store import set_task_unless_cancelled
+from core.queue.timings import TaskTimings
 
 logger = logging.getLogger('orchestartor')
+# descriptor matching pools and limits by provider name
+__match_pools: Dict[str, ThreadPoolExecutor] = {}
+__match_limits: Dict[str, asyncio.Semaphore] = {}
+__match_lock = threading.Lock()
 
 
-def register_face(
-        task_id: str,
-        engine_id: uuid.UUID,
-        provider: IProvider, 
-        data: bytes, 
+def run(
+        task: TaskEnvelope,
+        provider: IProvider,
+        data: bytes,
         redis: Redis,
-        sess: Session
+        timings: Optional[TaskTimings] = None
 ) -> None:
-    redis.set(
-        name=task_id,
-        value=pickle.dumps(Task(status=TaskStatus.started)),
-        ex=get_config().redis_queue_exp,
-    )
-    logger.info('start task %s', task_id)
+    """
+    timings may hold stages measured before the run (file fetch).
+    A coalesced follower that takes over from the task runs next.
+    """
+    flight = create_single_flight(redis)
+    next_task: Optional[TaskEnvelope] = task
+    while next_task is not None:
+        next_task = __run_once(
+            flight, next_task, provider, data, redis, timings
+        )
+        # stages measured before the run belong to the first task
+        timings = None
 
-    try:
-        result = provider.register(data=data)
 
-        if result.status == TaskStatus.finished:
-            internal_id = provider.name + str(result.result.face_id)
-            face = db_ops.create_face(
-                sess=sess, 
-                engine_id=engine_id,
-                internal_id=internal_id
+async def run_async(
+        task: TaskEnvelope,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis,
+        timings: Optional[TaskTimings] = None
+) -> None:
+    flight = create_single_flight(redis)
+    next_task: Optional[TaskEnvelope] = task
+    while next_task is not None:
+        next_task = await __run_once_async(
+            flight, next_task, provider, data, redis, timings
+        )
+        timings = None
+
+
+def __run_once(
+        flight: SingleFlight,
+        task: TaskEnvelope,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis,
+        timings: Optional[TaskTimings]
+) -> Optional[TaskEnvelope]:
+    """
+    Returns the follower that leads if the task has no result to share.
+    """
+    timings = __start_timings(task, timings)
+    context = TaskContext(task.task_id, task.deadline, redis, timings)
+    with __trace(task), task_context(context):
+        if not __join(flight, task):
+            return None
+        try:
+            __dispatch(task=task, provider=provider, data=data, redis=redis)
+        finally:
+            successor = __land(flight, task)
+            timings.observe(provider.name, task.operation.value)
+    return successor
+
+
+async def __run_once_async(
+        flight: SingleFlight,
+        task: TaskEnvelope,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis,
+        timings: Optional[TaskTimings]
+) -> Optional[TaskEnvelope]:
+    timings = __start_timings(task, timings)
+    context = TaskContext(task.task_id, task.deadline, redis, timings)
+    with __trace(task), task_context(context):
+        if not await asyncio.to_thread(__join, flight, task):
+            return None
+        try:
+            await __dispatch_async(
+                task=task, provider=provider, data=data, redis=redis
             )
-            result.result.face_id = face.face_id
+        finally:
+            successor = await asyncio.to_thread(__land, flight, task)
+            timings.observe(provider.name, task.operation.value)
+    return successor
+
 
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(result),
-            ex=get_config().redis_queue_exp,
+def __dispatch(
+        task: TaskEnvelope,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    cached = __get_cached_result(task, provider, redis)
+    if cached is not None:
+        __run(task_id=task.task_id, redis=redis, call=lambda: cached)
+    elif task.operation == TaskOperation.register:
+        register_face(
+            task_id=task.task_id,
+            engine_id=task.engine_id,
+            provider=provider,
+            data=data,
+            redis=redis
         )
-        logger.info('finish task %s', task_id)
-    except Exception:
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(
-                Task(
-                    status=TaskStatus.failed,
-                    result=FailedResult(message='Internal provider error'),
-                ),
-            ),
-            ex=get_config().redis_queue_exp,
+    elif task.operation == TaskOperation.quality:
+        face_quality(
+            task_id=task.task_id,
+            provider=provider,
+            data=data,
+            file_hash=task.file_hash,
+            redis=redis
         )
-        logging.error('Internal provider error', exc_info=True)
+    elif task.operation == TaskOperation.liveness:
+        face_liveness(
+            task_id=task.task_id,
+            provider=provider,
+            data=data,
+            file_hash=task.file_hash,
+            redis=redis
+        )
+    elif task.operation == TaskOperation.best_match:
+        best_match(
+            task_id=task.task_id, provider=provider, data=data, redis=redis
+        )
+    elif task.operation == TaskOperation.match:
+        match_with_face(
+            task_id=task.task_id,
+            provider=provider,
+            data=data,
+            face_id=task.face_id,
+            redis=redis
+        )
+    elif task.operation == TaskOperation.verify:
+        verify_face(
+            task_id=task.task_id, provider=provider, data=data, redis=redis
+        )
+    else:
+        raise ValueError(f'Unknown operation {task.operation}')
+
+
+async def __dispatch_async(
+        task: TaskEnvelope,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    cached = await asyncio.to_thread(
+        __get_cached_result, task, provider, redis
+    )
+    if cached is not None:
+        # the task context is copied to the thread
+        await asyncio.to_thread(__run, task.task_id, redis, lambda: cached)
+    elif task.operation == TaskOperation.register:
+        await register_face_async(
+            task_id=task.task_id,
+            engine_id=task.engine_id,
+            provider=provider,
+            data=data,
+            redis=redis
+        )
+    elif task.operation == TaskOperation.quality:
+        await face_quality_async(
+            task_id=task.task_id,
+            provider=provider,
+            data=data,
+            file_hash=task.file_hash,
+            redis=redis
+        )
+    elif task.operation == TaskOperation.liveness:
+        await face_liveness_async(
+            task_id=task.task_id,
+            provider=provider,
+            data=data,
+            file_hash=task.file_hash,
+            redis=redis
+        )
+    elif task.operation == TaskOperation.best_match:
+        await best_match_async(
+            task_id=task.task_id, provider=provider, data=data, redis=redis
+        )
+    elif task.operation == TaskOperation.match:
+        await match_with_face_async(
+            task_id=task.task_id,
+            provider=provider,
+            data=data,
+            face_id=task.face_id,
+            redis=redis
+        )
+    elif task.operation == TaskOperation.verify:
+        await verify_face_async(
+            task_id=task.task_id, provider=provider, data=data, redis=redis
+        )
+    else:
+        raise ValueError(f'Unknown operation {task.operation}')
+
+
+def register_face(
+        task_id: str,
+        engine_id: uuid.UUID,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    __run(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.register(data=data),
+        post=functools.partial(
+            __save_face, engine_id=engine_id, provider=provider
+        ),
+    )
+
+
+async def register_face_async(
+        task_id: str,
+        engine_id: uuid.UUID,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    await __run_async(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.register_async(data=data),
+        post=functools.partial(
+            __save_face, engine_id=engine_id, provider=provider
+        ),
+    )
 
 
 def face_quality(
-        task_id: str, 
-        provider: IProvider, 
-        data: bytes, redis: Redis
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        file_hash: str,
+        redis: Redis
 ) -> None:
-    redis.set(
-        name=task_id,
-        value=pickle.dumps(Task(status=TaskStatus.started)),
-        ex=get_config().redis_queue_exp,
+    __run(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.quality(data=data),
+        post=functools.partial(
+            __cache_result,
+            provider=provider,
+            operation=TaskOperation.quality,
+            file_hash=file_hash,
+            redis=redis
+        ),
     )
-    logger.info('start task %s', task_id)
 
+
+async def face_quality_async(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        file_hash: str,
+        redis: Redis
+) -> None:
+    await __run_async(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.quality_async(data=data),
+        post=functools.partial(
+            __cache_result,
+            provider=provider,
+            operation=TaskOperation.quality,
+            file_hash=file_hash,
+            redis=redis
+        ),
+    )
+
+
+def face_liveness(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        file_hash: str,
+        redis: Redis
+) -> None:
+    __run(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.liveness(data=data),
+        post=functools.partial(
+            __cache_result,
+            provider=provider,
+            operation=TaskOperation.liveness,
+            file_hash=file_hash,
+            redis=redis
+        ),
+    )
+
+
+async def face_liveness_async(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        file_hash: str,
+        redis: Redis
+) -> None:
+    await __run_async(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.liveness_async(data=data),
+        post=functools.partial(
+            __cache_result,
+            provider=provider,
+            operation=TaskOperation.liveness,
+            file_hash=file_hash,
+            redis=redis
+        ),
+    )
+
+
+def best_match(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    __run(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.best_match(data=data),
+        post=functools.partial(__resolve_face, provider=provider),
+    )
+
+
+async def best_match_async(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    await __run_async(
+        task_id=task_id,
+        redis=redis,
+        call=lambda: provider.best_match_async(data=data),
+        post=functools.partial(__resolve_face, provider=provider),
+    )
+
+
+def match_with_face(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        face_id: uuid.UUID,
+        redis: Redis
+) -> None:
+    def call() -> BaseTask:
+        internal_ids = __get_internal_ids(provider, face_id)
+        results = __match_descriptors(provider, data, internal_ids)
+        return __get_match_result(results=results)
+
+    __run(task_id=task_id, redis=redis, call=call)
+
+
+async def match_with_face_async(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        face_id: uuid.UUID,
+        redis: Redis
+) -> None:
+    async def call() -> BaseTask:
+        # to_thread keeps the task context for timings and traces
+        internal_ids = await asyncio.to_thread(
+            __get_internal_ids, provider, face_id
+        )
+        results = await __match_descriptors_async(
+            provider, data, internal_ids
+        )
+        return __get_match_result(results=results)
+
+    await __run_async(task_id=task_id, redis=redis, call=call)
+
+
+def verify_face(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    """
+    Quality, liveness and best match of one image. Later stages are
+    skipped when the score is under the provider threshold.
+    """
+    def call() -> BaseTask:
+        quality = provider.quality(data=data)
+        if not __is_passed(quality, provider.quality_threshold):
+            return __get_verify_result(provider, quality)
+
+        check_task()
+        liveness = provider.liveness(data=data)
+        if not __is_passed(liveness, provider.anti_spoofing_threshold):
+            return __get_verify_result(provider, quality, liveness)
+
+        check_task()
+        match = __resolve_face(provider.best_match(data=data), provider)
+        return __get_verify_result(provider, quality, liveness, match)
+
+    __run(task_id=task_id, redis=redis, call=call)
+
+
+async def verify_face_async(
+        task_id: str,
+        provider: IProvider,
+        data: bytes,
+        redis: Redis
+) -> None:
+    async def call() -> BaseTask:
+        quality = await provider.quality_async(data=data)
+        if not __is_passed(quality, provider.quality_threshold):
+            return __get_verify_result(provider, quality)
+
+        await check_task_async()
+        liveness = await provider.liveness_async(data=data)
+        if not __is_passed(liveness, provider.anti_spoofing_threshold):
+            return __get_verify_result(provider, quality, liveness)
+
+        await check_task_async()
+        match = await provider.best_match_async(data=data)
+        match = await asyncio.to_thread(
+            __resolve_face, match, provider=provider
+        )
+        return __get_verify_result(provider, quality, liveness, match)
+
+    await __run_async(task_id=task_id, redis=redis, call=call)
+
+
+def __join(flight: SingleFlight, task: TaskEnvelope) -> bool:
     try:
-        result = provider.quality(data=data)
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(result),
-            ex=get_config().redis_queue_exp,
+        return flight.join(task)
+    except Exception:
+        logger.error('Can not join task %s', task.task_id, exc_info=True)
+        return True
+
+
+def __land(
+        flight: SingleFlight,
+        task: TaskEnvelope
+) -> Optional[TaskEnvelope]:
+    try:
+        return flight.land(task)
+    except Exception:
+        logger.error('Can not land task %s', task.task_id, exc_info=True)
+        return None
+
+
+def __trace(task: TaskEnvelope) -> ContextManager[tracing.Span]:
+    return tracing.trace(
+        task.traceparent, f'task {task.operation.value}', 'CONSUMER',
+        task_id=task.task_id, provider=task.provider,
+    )
+
+
+def __start_timings(
+        task: TaskEnvelope,
+        timings: Optional[TaskTimings]
+) -> TaskTimings:
+    if timings is None:
+        timings = TaskTimings()
+    if task.created_at is not None:
+        timings.add(
+            TimingStage.queue_wait, max(time.time() - task.created_at, 0.0)
         )
+    return timings
+
+
+def __run(
+        task_id: str,
+        redis: Redis,
+        call: Callable[[], BaseTask],
+        post: Optional[Callable[[BaseTask], BaseTask]] = None
+) -> None:
+    try:
+        check_deadline()
+        __set_task(redis, task_id, Task(status=TaskStatus.started))
+        logger.info('start task %s', task_id)
+
+        result = call()
+        if post is not None:
+            result = post(result)
+
+        with timed(TimingStage.result_write):
+            __set_task(redis, task_id, result, __get_timings())
         logger.info('finish task %s', task_id)
+    except TaskCancelledError:
+        logger.info('task %s is cancelled', task_id)
+    except DeadlineExceededError:
+        set_task_unless_cancelled(
+            redis, task_id, __deadline_task(), __get_timings()
+        )
+        logger.warning('task %s missed its deadline', task_id)
+    except NotImplementedError:
+        set_task_unless_cancelled(
+            redis, task_id, __not_implemented_task(), __get_timings()
+        )
+        logger.error('task %s: method is not implemented', task_id)
     except Exception:
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(
-                Task(
-                    status=TaskStatus.failed,
-                    result=FailedResult(message='Internal provider error'),
-                ),
-            ),
-            ex=get_config().redis_queue_exp,
+        set_task_unless_cancelled(
+            redis, task_id, __failed_task(), __get_timings()
         )
         logging.error('Internal provider error', exc_info=True)
 
 
-def face_liveness(
-        task_id: str, 
-        provider: IProvider, 
-        data: bytes, redis: Redis
+async def __run_async(
+        task_id: str,
+        redis: Redis,
+        call: Callable[[], Awaitable[BaseTask]],
+        post: Optional[Callable[[BaseTask], BaseTask]] = None
 ) -> None:
-    redis.set(
-        name=task_id,
-        value=pickle.dumps(Task(status=TaskStatus.started)),
-        ex=get_config().redis_queue_exp,
-    )
-    logger.info('start task %s', task_id)
-
     try:
-        result = provider.liveness(data=data)
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(result),
-            ex=get_config().redis_queue_exp,
+        check_deadline()
+        await asyncio.to_thread(
+            __set_task, redis, task_id, Task(status=TaskStatus.started)
         )
+        logger.info('start task %s', task_id)
+
+        result = await call()
+        if post is not None:
+            result = await asyncio.to_thread(post, result)
+
+        with timed(TimingStage.result_write):
+            await asyncio.to_thread(
+                __set_task, redis, task_id, result, __get_timings()
+            )
         logger.info('finish task %s', task_id)
+    except TaskCancelledError:
+        logger.info('task %s is cancelled', task_id)
+    except DeadlineExceededError:
+        await asyncio.to_thread(
+            set_task_unless_cancelled, redis, task_id, __deadline_task(),
+            __get_timings()
+        )
+        logger.warning('task %s missed its deadline', task_id)
+    except NotImplementedError:
+        await asyncio.to_thread(
+            set_task_unless_cancelled, redis, task_id,
+            __not_implemented_task(), __get_timings()
+        )
+        logger.error('task %s: method is not implemented', task_id)
     except Exception:
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(
-                Task(
-                    status=TaskStatus.failed,
-                    result=FailedResult(message='Internal provider error'),
-                ),
-            ),
-            ex=get_config().redis_queue_exp,
+        await asyncio.to_thread(
+            set_task_unless_cancelled, redis, task_id, __failed_task(),
+            __get_timings()
         )
         logging.error('Internal provider error', exc_info=True)
 
 
-def best_match(
-        task_id: str, 
-        provider: IProvider, 
-        data: bytes, 
+def __set_task(
         redis: Redis,
-        sess: Session
+        task_id: str,
+        task: BaseTask,
+        timings: Optional[TaskTimings] = None
 ) -> None:
-    redis.set(
-        name=task_id,
-        value=pickle.dumps(Task(status=TaskStatus.started)),
-        ex=get_config().redis_queue_exp,
+    # the cancel check and the write are one round trip
+    if not set_task_unless_cancelled(redis, task_id, task, timings):
+        raise TaskCancelledError(f'Task {task_id} is cancelled')
+
+
+def __get_timings() -> Optional[TaskTimings]:
+    """
+    Timings written with the final status of the current task. The write
+    of that status itself is only in the task_stage_seconds metric.
+    """
+    context = current_task()
+    return None if context is None else context.timings
+
+
+def __failed_task() -> Task:
+    return Task(
+        status=TaskStatus.failed,
+        result=FailedResult(message='Internal provider error'),
     )
-    logger.info('start task %s', task_id)
 
+
+def __get_cached_result(
+        task: TaskEnvelope,
+        provider: IProvider,
+        redis: Redis
+) -> Optional[BaseTask]:
+    """
+    Bulk tasks wait in their lane after the cache check of the enqueue,
+    an interactive task on the same file may cache the result meanwhile.
+    """
+    if task.priority != TaskPriority.bulk:
+        return None
     try:
-        result = provider.best_match(data=data)
+        return create_result_cache(redis).get(
+            provider.name, task.operation, task.file_hash
+        )
+    except Exception:
+        logger.error('Can not get result from cache', exc_info=True)
+        return None
 
-        if result.status == TaskStatus.finished:
-            internal_id = provider.name + str(result.result.face_id)
-            face = db_ops.get_face_by_internal_id(
+
+def __cache_result(
+        result: BaseTask,
+        provider: IProvider,
+        operation: TaskOperation,
+        file_hash: str,
+        redis: Redis
+) -> BaseTask:
+    if result.status == TaskStatus.finished:
+        try:
+            with timed(TimingStage.result_write):
+                create_result_cache(redis).set(
+                    provider.name, operation, file_hash, result
+                )
+        except Exception:
+            logger.error('Can not save result in cache', exc_info=True)
+    return result
+
+
+def __deadline_task() -> Task:
+    return Task(
+        status=TaskStatus.failed,
+        result=FailedResult(message=DEADLINE_MESSAGE),
+    )
+
+
+def __not_implemented_task() -> Task:
+    return Task(
+        status=TaskStatus.failed,
+        result=FailedResult(message='Method is not implemented'),
+    )
+
+
+def __save_face(
+        result: BaseTask,
+        engine_id: uuid.UUID,
+        provider: IProvider
+) -> BaseTask:
+    if result.status == TaskStatus.finished:
+        internal_id = provider.name + str(result.result.face_id)
+        with timed(TimingStage.db), get_db().create_session() as sess:
+            face = db_ops.create_face(
                 sess=sess,
+                engine_id=engine_id,
                 internal_id=internal_id
             )
-            if face is None:
-                raise Exception('No face in db')
+        result.result.face_id = face.face_id
+    return result
 
-            result.result.face_id = face.face_id
 
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(result),
-            ex=get_config().redis_queue_exp,
-        )
-        logger.info('finish task %s', task_id)
-    except Exception:
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(
-                Task(
-                    status=TaskStatus.failed,
-                    result=FailedResult(message='Internal provider error'),
-                ),
-            ),
-            ex=get_config().redis_queue_exp,
-        )
-        logging.error('Internal provider error', exc_info=True)
+def __resolve_face(result: BaseTask, provider: IProvider) -> BaseTask:
+    if result.status == TaskStatus.finished:
+        internal_id = provider.name + str(result.result.face_id)
+        with timed(TimingStage.db), get_db().create_session() as sess:
+            face = db_ops.get_face_by_internal_id(
+                sess=sess,
+                internal_id=internal_id
+            )
+        if face is None:
+            raise Exception('No face in db')
 
+        result.result.face_id = face.face_id
+    return result
 
-def match_with_face(
-        task_id: str, 
-        provider: IProvider, 
-        data: bytes, 
-        face_id: uuid.UUID, 
-        redis: Redis,
-        sess: Session
-) -> None:
-    redis.set(
-        name=task_id,
-        value=pickle.dumps(Task(status=TaskStatus.started)),
-        ex=get_config().redis_queue_exp,
-    )
-    logger.info('start task %s', task_id)
 
-    try:
+def __get_internal_ids(provider: IProvider, face_id: uuid.UUID) -> List[str]:
+    with timed(TimingStage.db), get_db().create_session() as sess:
         face = db_ops.get_face(sess=sess, face_id=face_id)
         if face is None:
             raise Exception('No sush face')
-        
-        if face.descriptors is None or len(face.descriptors) == 0:
-            raise Exception('No descriptors in face')
-        
-        results = []
-        for descriptor in face.descriptors:
-            internal_id = str(
-                descriptor.descriptor_id
-            ).replace(provider.name, '')
-            
-            res = provider.match_with_face(
-                data=data, 
+
+        descriptors = [d.descriptor_id for d in face.descriptors or []]
+
+    if len(descriptors) == 0:
+        raise Exception('No descriptors in face')
+    return [str(d).replace(provider.name, '') for d in descriptors]
+
+
+def __match_capacity(provider: IProvider) -> int:
+    return ExecutorParams(**(provider.params or {})).max_workers
+
+
+def __get_match_pool(provider: IProvider) -> ThreadPoolExecutor:
+    """
+    Descriptor calls of all match tasks of the provider share max_workers
+    threads, so the fan-out does not add engine calls over the provider
+    capacity.
+    """
+    with __match_lock:
+        pool = __match_pools.get(provider.name)
+        if pool is None:
+            pool = ThreadPoolExecutor(
+                max_workers=__match_capacity(provider),
+                thread_name_prefix=f'{provider.name}-match',
+            )
+            __match_pools[provider.name] = pool
+        return pool
+
+
+def __get_match_limit(provider: IProvider) -> asyncio.Semaphore:
+    """
+    Same as the match pool for asyncio providers. Every provider has its
+    own event loop, the semaphore is created on it.
+    """
+    with __match_lock:
+        limit = __match_limits.get(provider.name)
+        if limit is None:
+            limit = asyncio.Semaphore(__match_capacity(provider))
+            __match_limits[provider.name] = limit
+        return limit
+
+
+def __is_match(provider: IProvider, result: BaseTask) -> bool:
+    threshold = provider.match_threshold
+    if threshold is None or result.status != TaskStatus.finished:
+        return False
+    return result.result.score >= threshold
+
+
+def __match_descriptors(
+        provider: IProvider,
+        data: bytes,
+        internal_ids: List[str]
+) -> List[BaseTask]:
+    """
+    Match with at most match_fanout descriptors at the same time. Stops
+    after the first score over the provider match threshold.
+    """
+    pool = __get_match_pool(provider)
+    fanout = get_config().match_fanout
+    internal_ids = iter(internal_ids)
+    pending = set()
+    results = []
+
+    def fill() -> None:
+        while len(pending) < fanout:
+            internal_id = next(internal_ids, None)
+            if internal_id is None:
+                return
+            check_task()
+            # every call gets its own copy of the task context
+            context = contextvars.copy_context()
+            pending.add(
+                pool.submit(
+                    context.run,
+                    provider.match_with_face,
+                    data=data,
+                    internal_id=internal_id
+                )
+            )
+
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                result = future.result()
+                results.append(result)
+                if __is_match(provider, result):
+                    return results
+            fill()
+    finally:
+        for rest in pending:
+            rest.cancel()
+    return results
+
+
+async def __match_descriptors_async(
+        provider: IProvider,
+        data: bytes,
+        internal_ids: List[str]
+) -> List[BaseTask]:
+    limit = __get_match_limit(provider)
+    fanout = get_config().match_fanout
+    internal_ids = iter(internal_ids)
+    pending = set()
+    results = []
+
+    async def match(internal_id: str) -> BaseTask:
+        async with limit:
+            await check_task_async()
+            return await provider.match_with_face_async(
+                data=data,
                 internal_id=internal_id
             )
-            results.append(res)
-
-        result = __get_match_result(results=results)
-        
-        redis.set(
-            name=task_id, 
-            value=pickle.dumps(result), 
-            ex=get_config().redis_queue_exp
-        )
-        logger.info('finish task %s', task_id)
-    except Exception:
-        redis.set(
-            name=task_id,
-            value=pickle.dumps(
-                Task(
-                    status=TaskStatus.failed,
-                    result=FailedResult(message='Internal provider error'),
-                ),
-            ),
-            ex=get_config().redis_queue_exp,
-        )
-        logging.error('Internal provider error', exc_info=True)
+
+    def fill() -> None:
+        # like the thread version, no call starts after a match
+        while len(pending) < fanout:
+            internal_id = next(internal_ids, None)
+            if internal_id is None:
+                return
+            pending.add(asyncio.ensure_future(match(internal_id)))
+
+    try:
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                pending.remove(future)
+                result = future.result()
+                results.append(result)
+                if __is_match(provider, result):
+                    return results
+            fill()
+    finally:
+        for rest in pending:
+            rest.cancel()
+    return results
 
 
 def __get_match_result(
@@ -248,10 +882,54 @@ def __get_match_result(
     for res in results:
         if res.status == TaskStatus.finished:
             scores.append(res.result.score)
-    
+
     if len(scores) == 0:
         return results[0]
     return FaceMatchTask(
         status=TaskStatus.finished,
         result=FaceMatchResult(score=max(scores))
     )
+
+
+def __is_passed(result: BaseTask, threshold: float) -> bool:
+    if result.status != TaskStatus.finished:
+        return False
+    return result.result.score >= threshold
+
+
+def __get_verify_result(
+        provider: IProvider,
+        quality: BaseTask,
+        liveness: Optional[BaseTask] = None,
+        match: Optional[BaseTask] = None
+) -> BaseTask:
+    # a failed stage fails the whole pipeline
+    for result in (match, liveness, quality):
+        if result is not None and result.status != TaskStatus.finished:
+            return result
+
+    if match is not None:
+        threshold = provider.match_threshold
+        return FaceVerifyTask(
+            status=TaskStatus.finished,
+            result=FaceVerifyResult(
+                passed=threshold is None or __is_match(provider, match),
+                stage=VerifyStage.best_match,
+                quality=quality.result.score,
+                liveness=liveness.result.score,
+                face_id=str(match.result.face_id),
+                score=match.result.score,
+            )
+        )
+    return FaceVerifyTask(
+        status=TaskStatus.finished,
+        result=FaceVerifyResult(
+            passed=False,
+            stage=(
+                VerifyStage.quality if liveness is None
+                else VerifyStage.liveness
+            ),
+            quality=quality.result.score,
+            liveness=None if liveness is None else liveness.result.score,
+        )
+    )
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Callable, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from core import tracing
+from core.exceptions.orchestrator import DeadlineExceededError
+from core.provider.interfaces import IProvider
+from core.provider.models.tasks import (
+    BaseTask,
+    FaceAntiSpoofTask,
+    FaceBestMatchTask,
+    FaceQualityTask,
+    Task,
+)
+from core.provider.proxy import ProviderProxy
+from core.queue.context import remaining_time
+
+BatchCall = Callable[[List[bytes]], List[BaseTask]]
+# submit time, image, result and span of the waiting call
+BatchItem = Tuple[float, bytes, Future, Optional[tracing.Span]]
+
+
+class BatchParams(BaseModel):
+    batch_size: int = 1
+    batch_wait_ms: int = 10
+    batch_workers: int = 1
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent single-image calls into one batch call. A batch is
+    flushed when it has max_size items or its first item waited max_wait
+    seconds. Items cancelled before the flush are left out of the batch.
+
+    The batch call runs on the flusher without the context of the
+    callers, each caller's current span gets the batch_size tag.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            call: BatchCall,
+            max_size: int,
+            max_wait: float,
+            flusher: ThreadPoolExecutor
+    ) -> None:
+        self.__call = call
+        self.__max_size = max_size
+        self.__max_wait = max_wait
+        self.__flusher = flusher
+        self.__items: List[BatchItem] = []
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__logger = logging.getLogger(f'batcher.{name}')
+        self.__thread = threading.Thread(
+            target=self.__collect, name=f'{name}-batcher', daemon=True
+        )
+        self.__thread.start()
+
+    def submit(self, data: bytes) -> Future:
+        future = Future()
+        with self.__condition:
+            if self.__closed:
+                raise RuntimeError('Batcher is closed')
+            self.__items.append(
+                (time.monotonic(), data, future, tracing.current_span())
+            )
+            self.__condition.notify()
+        return future
+
+    def close(self) -> None:
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.__thread.join()
+
+    def __collect(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__items and not self.__closed:
+                    self.__condition.wait()
+                if not self.__items:
+                    return
+
+                deadline = self.__items[0][0] + self.__max_wait
+                while len(self.__items) < self.__max_size:
+                    if self.__closed:
+                        break
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self.__condition.wait(timeout)
+
+                batch = self.__items[:self.__max_size]
+                del self.__items[:self.__max_size]
+
+            self.__flusher.submit(self.__flush, batch)
+
+    def __flush(self, batch: List[BatchItem]) -> None:
+        batch = [
+            item for item in batch if item[2].set_running_or_notify_cancel()
+        ]
+        if not batch:
+            return
+        for _, _, _, span in batch:
+            if span is not None:
+                span.tag('batch_size', len(batch))
+        futures = [future for _, _, future, _ in batch]
+        try:
+            results = self.__call([data for _, data, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(
+                    f'Get {len(results)} results for {len(batch)} items'
+                )
+        except Exception as ex:
+            self.__logger.error('Batch call failed', exc_info=True)
+            for future in futures:
+                future.set_exception(ex)
+            return
+
+        self.__logger.debug('Flush batch of %d items', len(batch))
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+
+class BatchingProvider(ProviderProxy):
+    """
+    Sends concurrent quality, liveness and best match calls to the
+    provider *_batch methods. Providers without batch support fall back
+    to per-item calls in the default IProvider implementation.
+    """
+
+    def __init__(self, provider: IProvider) -> None:
+        super().__init__(provider)
+        params = BatchParams(**(provider.params or {}))
+        self.__flusher = ThreadPoolExecutor(
+            max_workers=params.batch_workers,
+            thread_name_prefix=f'{provider.name}-flush',
+        )
+        max_wait = params.batch_wait_ms / 1000
+        self.__quality = MicroBatcher(
+            f'{provider.name}.quality', provider.quality_batch,
+            params.batch_size, max_wait, self.__flusher
+        )
+        self.__liveness = MicroBatcher(
+            f'{provider.name}.liveness', provider.liveness_batch,
+            params.batch_size, max_wait, self.__flusher
+        )
+        self.__best_match = MicroBatcher(
+            f'{provider.name}.best_match', provider.best_match_batch,
+            params.batch_size, max_wait, self.__flusher
+        )
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        return self.__wait(self.__quality, 'quality', data)
+
+    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
+        return self.__wait(self.__liveness, 'liveness', data)
+
+    def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
+        return self.__wait(self.__best_match, 'best_match', data)
+
+    async def quality_async(
+            self,
+            data: bytes
+    ) -> Union[FaceQualityTask, Task]:
+        return await self.__wait_async(self.__quality, 'quality', data)
+
+    async def liveness_async(
+            self,
+            data: bytes
+    ) -> Union[FaceAntiSpoofTask, Task]:
+        return await self.__wait_async(self.__liveness, 'liveness', data)
+
+    async def best_match_async(
+            self,
+            data: bytes
+    ) -> Union[FaceBestMatchTask, Task]:
+        return await self.__wait_async(self.__best_match, 'best_match', data)
+
+    @staticmethod
+    def __wait(batcher: MicroBatcher, operation: str, data: bytes) -> BaseTask:
+        # a span per item, the batch call itself runs on the flusher
+        with tracing.span(f'batch {operation}'):
+            future = batcher.submit(data)
+            try:
+                return future.result(timeout=remaining_time())
+            except FutureTimeoutError:
+                # still waiting in the batcher, so the batch leaves it out
+                future.cancel()
+                raise DeadlineExceededError(
+                    f'Batch call {operation} missed the task deadline'
+                )
+
+    @staticmethod
+    async def __wait_async(
+            batcher: MicroBatcher,
+            operation: str,
+            data: bytes
+    ) -> BaseTask:
+        with tracing.span(f'batch {operation}'):
+            future = asyncio.wrap_future(batcher.submit(data))
+            try:
+                # a timeout cancels the batcher future as well
+                return await asyncio.wait_for(future, remaining_time())
+            except asyncio.TimeoutError:
+                raise DeadlineExceededError(
+                    f'Batch call {operation} missed the task deadline'
+                )
+
+    def close(self) -> None:
+        self.__quality.close()
+        self.__liveness.close()
+        self.__best_match.close()
+        self.__flusher.shutdown(wait=True)
+        super().close()
+
+
+def is_batching_enabled(provider: IProvider) -> bool:
+    return BatchParams(**(provider.params or {})).batch_size > 1
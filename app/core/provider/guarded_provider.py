@@ -0,0 +1,312 @@
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Awaitable, Callable, Union
+
+from pydantic import BaseModel
+
+from core.metrics import get_registry
+from core.provider.interfaces import (
+    ENGINE_ERROR_MESSAGE,
+    SEND_FAILED_MESSAGE,
+    IProvider,
+)
+from core.provider.models.enums import TimingStage
+from core.provider.models.tasks import (
+    BaseTask,
+    FaceAntiSpoofTask,
+    FaceBestMatchTask,
+    FaceMatchTask,
+    FaceQualityTask,
+    FaceRegisterTask,
+    FailedResult,
+    Task,
+    TaskStatus,
+)
+from core.provider.proxy import ProviderProxy
+from core.queue.context import timed
+
+outstanding_requests = get_registry().gauge(
+    'provider_outstanding_requests',
+    'Engine calls in progress',
+    ('provider',),
+)
+rejected_requests = get_registry().counter(
+    'provider_rejected_total',
+    'Engine calls failed fast by the limiter (overloaded) '
+    'or the circuit breaker (open)',
+    ('provider', 'reason'),
+)
+breaker_state = get_registry().gauge(
+    'provider_breaker_state',
+    'Circuit breaker state: 0 closed, 1 open, 2 half-open',
+    ('provider',),
+)
+
+
+class GuardParams(BaseModel):
+    # 0 - no limit
+    max_outstanding: int = 0
+    # consecutive failed calls that open the breaker, 0 - no breaker
+    breaker_failures: int = 5
+    breaker_open_ms: int = 30000
+    breaker_trial_calls: int = 1
+
+
+class BreakerState(int, Enum):
+    closed = 0
+    open = 1
+    half_open = 2
+
+
+class CircuitBreaker:
+    """
+    Opens after max_failures consecutive failed calls and rejects calls
+    for open_time seconds. Then it lets trial_calls calls through
+    (half-open): a success closes it, a failure opens it again.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_failures: int,
+            open_time: float,
+            trial_calls: int
+    ) -> None:
+        self.__name = name
+        self.__max_failures = max_failures
+        self.__open_time = open_time
+        self.__trial_calls = trial_calls
+        self.__state = BreakerState.closed
+        self.__failures = 0
+        self.__trials = 0
+        self.__opened_at = 0.0
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger(f'breaker.{name}')
+        breaker_state.set(self.__state.value, provider=name)
+
+    @property
+    def state(self) -> BreakerState:
+        return self.__state
+
+    def acquire(self) -> bool:
+        """
+        Returns False if the call has to be rejected.
+        """
+        with self.__lock:
+            if self.__state == BreakerState.open:
+                if time.monotonic() - self.__opened_at < self.__open_time:
+                    return False
+                self.__set_state(BreakerState.half_open)
+                self.__trials = 0
+            if self.__state == BreakerState.half_open:
+                if self.__trials >= self.__trial_calls:
+                    return False
+                self.__trials += 1
+            return True
+
+    def release(self, success: bool) -> None:
+        with self.__lock:
+            if self.__state == BreakerState.half_open:
+                self.__trials = max(self.__trials - 1, 0)
+                if success:
+                    self.__failures = 0
+                    self.__set_state(BreakerState.closed)
+                else:
+                    self.__open()
+            elif success:
+                self.__failures = 0
+            else:
+                self.__failures += 1
+                closed = self.__state == BreakerState.closed
+                if closed and self.__failures >= self.__max_failures:
+                    self.__open()
+
+    def __open(self) -> None:
+        self.__opened_at = time.monotonic()
+        self.__set_state(BreakerState.open)
+
+    def __set_state(self, state: BreakerState) -> None:
+        if state != self.__state:
+            self.__logger.warning(
+                'Circuit breaker %s -> %s', self.__state.name, state.name
+            )
+        self.__state = state
+        breaker_state.set(state.value, provider=self.__name)
+
+
+class GuardedProvider(ProviderProxy):
+    """
+    Limits the number of engine calls in progress and fails calls fast
+    while the engine is unhealthy. Rejected calls return a failed task
+    without calling the engine.
+
+    A call fails if it raises or returns a failed task with a send failure
+    or engine error message. Other failed tasks (e.g. a bad image) and
+    NotImplementedError are not engine failures and do not affect the
+    breaker.
+
+    Engine calls are timed as the provider_call stage of the task.
+    """
+
+    def __init__(self, provider: IProvider) -> None:
+        super().__init__(provider)
+        params = GuardParams(**(provider.params or {}))
+        self.__max_outstanding = params.max_outstanding
+        self.__outstanding = 0
+        self.__lock = threading.Lock()
+        self.__breaker = None
+        if params.breaker_failures > 0:
+            self.__breaker = CircuitBreaker(
+                provider.name,
+                params.breaker_failures,
+                params.breaker_open_ms / 1000,
+                params.breaker_trial_calls,
+            )
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self.__breaker
+
+    def register(self, data: bytes) -> Union[FaceRegisterTask, Task]:
+        return self.__call(lambda: self._provider.register(data=data))
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        return self.__call(lambda: self._provider.quality(data=data))
+
+    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
+        return self.__call(lambda: self._provider.liveness(data=data))
+
+    def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
+        return self.__call(lambda: self._provider.best_match(data=data))
+
+    def match_with_face(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return self.__call(
+            lambda: self._provider.match_with_face(
+                data=data, internal_id=internal_id
+            )
+        )
+
+    def remove_face(self, internal_id: str) -> Task:
+        return self.__call(
+            lambda: self._provider.remove_face(internal_id=internal_id)
+        )
+
+    async def register_async(
+            self,
+            data: bytes
+    ) -> Union[FaceRegisterTask, Task]:
+        return await self.__call_async(
+            lambda: self._provider.register_async(data=data)
+        )
+
+    async def quality_async(
+            self,
+            data: bytes
+    ) -> Union[FaceQualityTask, Task]:
+        return await self.__call_async(
+            lambda: self._provider.quality_async(data=data)
+        )
+
+    async def liveness_async(
+            self,
+            data: bytes
+    ) -> Union[FaceAntiSpoofTask, Task]:
+        return await self.__call_async(
+            lambda: self._provider.liveness_async(data=data)
+        )
+
+    async def best_match_async(
+            self,
+            data: bytes
+    ) -> Union[FaceBestMatchTask, Task]:
+        return await self.__call_async(
+            lambda: self._provider.best_match_async(data=data)
+        )
+
+    async def match_with_face_async(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return await self.__call_async(
+            lambda: self._provider.match_with_face_async(
+                data=data, internal_id=internal_id
+            )
+        )
+
+    def __call(self, call: Callable[[], BaseTask]) -> BaseTask:
+        rejected = self.__acquire()
+        if rejected is not None:
+            return rejected
+        success = False
+        try:
+            with timed(TimingStage.provider_call):
+                result = call()
+            success = not is_engine_failure(result)
+            return result
+        except NotImplementedError:
+            success = True
+            raise
+        finally:
+            self.__release(success)
+
+    async def __call_async(
+            self,
+            call: Callable[[], Awaitable[BaseTask]]
+    ) -> BaseTask:
+        rejected = self.__acquire()
+        if rejected is not None:
+            return rejected
+        success = False
+        try:
+            with timed(TimingStage.provider_call):
+                result = await call()
+            success = not is_engine_failure(result)
+            return result
+        except NotImplementedError:
+            success = True
+            raise
+        finally:
+            self.__release(success)
+
+    def __acquire(self) -> Union[Task, None]:
+        """
+        Returns a failed task if the call is rejected.
+        """
+        with self.__lock:
+            limit = self.__max_outstanding
+            if limit > 0 and self.__outstanding >= limit:
+                return self.__reject('overloaded', 'Engine is overloaded')
+            if self.__breaker is not None and not self.__breaker.acquire():
+                return self.__reject('open', 'Engine is unavailable')
+            self.__outstanding += 1
+        outstanding_requests.inc(provider=self.name)
+        return None
+
+    def __release(self, success: bool) -> None:
+        with self.__lock:
+            self.__outstanding -= 1
+        outstanding_requests.dec(provider=self.name)
+        if self.__breaker is not None:
+            self.__breaker.release(success)
+
+    def __reject(self, reason: str, message: str) -> Task:
+        rejected_requests.inc(provider=self.name, reason=reason)
+        self._log.warning('Reject engine call: %s', message.lower())
+        return Task(
+            status=TaskStatus.failed,
+            result=FailedResult(message=message)
+        )
+
+
+def is_engine_failure(result: BaseTask) -> bool:
+    if result.status != TaskStatus.failed or result.result is None:
+        return False
+    message = result.result.message
+    return message in (SEND_FAILED_MESSAGE, ENGINE_ERROR_MESSAGE)
@@ -0,0 +1,372 @@
+"""
+Runs a provider in a long-lived host process shared by all API and
+worker processes of the node. Clients call it over a Unix socket.
+
+    request:  method (uint8), meta length (uint16), data length (uint32),
+              meta (utf-8 face id), data (image bytes)
+    response: status (uint8), payload length (uint32), payload
+
+The payload of an ok response is a task record of core.queue.codec,
+otherwise it is the utf-8 error message. A connection carries one call
+at a time; method numbers are part of the format, append new methods.
+"""
+
+import fcntl
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from core.exceptions.provider import ProviderError
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.tasks import (
+    BaseTask,
+    FaceAntiSpoofTask,
+    FaceBestMatchTask,
+    FaceMatchTask,
+    FaceQualityTask,
+    FaceRegisterTask,
+    Task,
+    TaskStatus,
+)
+from core.queue.codec import decode_task, encode_task
+from core.queue.context import remaining_time
+
+METHODS: List[str] = [
+    'ping',
+    'register',
+    'quality',
+    'liveness',
+    'best_match',
+    'match_with_face',
+    'remove_face',
+]
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_NOT_IMPLEMENTED = 2
+
+_REQUEST = struct.Struct('>BHI')
+_RESPONSE = struct.Struct('>BI')
+# the host runs main.py of this checkout, wherever the client started
+_APP_DIR = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+logger = logging.getLogger('provider_host')
+
+
+class HostParams(BaseModel):
+    socket_path: Optional[str]
+    # start the host process if no host listens on the socket
+    spawn_host: bool = True
+    host_start_timeout: float = 60
+
+
+def socket_path(config: IProviderConfig, name: str) -> str:
+    params = HostParams(**(config.orchestrator.params or {}))
+    return params.socket_path or os.path.join(
+        tempfile.gettempdir(), f'face-provider-{name}.sock'
+    )
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError('Provider host closed the connection')
+        received += count
+    return bytes(buffer)
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    chunks = []
+    received = 0
+    while received < size:
+        chunk = stream.read(size - received)
+        if not chunk:
+            raise ConnectionError('Client closed the connection')
+        chunks.append(chunk)
+        received += len(chunk)
+    return b''.join(chunks)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: '_HostServer'
+
+    def handle(self) -> None:
+        while True:
+            header = self.rfile.read(_REQUEST.size)
+            if not header:
+                # the client closed the connection between calls
+                return
+            try:
+                header += _read_exactly(
+                    self.rfile, _REQUEST.size - len(header)
+                )
+                method, meta_size, data_size = _REQUEST.unpack(header)
+                meta = _read_exactly(self.rfile, meta_size)
+                data = _read_exactly(self.rfile, data_size)
+            except ConnectionError:
+                logger.warning('Drop a truncated provider call')
+                return
+            status, payload = self.server.call(method, meta, data)
+            self.wfile.write(_RESPONSE.pack(status, len(payload)) + payload)
+
+
+class _HostServer(
+        socketserver.ThreadingMixIn,
+        socketserver.UnixStreamServer
+):
+    daemon_threads = True
+
+    def __init__(self, path: str, provider: IProvider) -> None:
+        super().__init__(path, _Handler)
+        self.provider = provider
+
+    def call(
+            self,
+            method: int,
+            raw_meta: bytes,
+            data: bytes
+    ) -> Tuple[int, bytes]:
+        try:
+            name = METHODS[method]
+            meta = raw_meta.decode('utf-8')
+            if name == 'ping':
+                result = Task(status=TaskStatus.finished)
+            elif name == 'match_with_face':
+                result = self.provider.match_with_face(
+                    data=data, internal_id=meta
+                )
+            elif name == 'remove_face':
+                result = self.provider.remove_face(internal_id=meta)
+            else:
+                result = getattr(self.provider, name)(data=data)
+            return STATUS_OK, encode_task(result)
+        except NotImplementedError:
+            return STATUS_NOT_IMPLEMENTED, b''
+        except Exception as ex:
+            logger.error('Provider call %d failed', method, exc_info=True)
+            return STATUS_ERROR, str(ex).encode('utf-8')
+
+
+def run_host(provider_namespace: str) -> None:
+    """
+    Serve the provider of the namespace (e.g. providers.facenet_provider)
+    until SIGTERM. Exits at once if another host serves the socket.
+    """
+    from core.provider.loader.provider import ProviderLoader
+
+    namespace, subdir = provider_namespace.rsplit('.', 1)
+    provider_class, config = ProviderLoader(namespace).load_class(subdir)
+    # the name only, the provider is created after the lock
+    name = IProvider(config).name
+    path = socket_path(config, name)
+
+    # the lock is held while the host lives, a stale socket is removed
+    lock = open(f'{path}.lock', 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.info('Provider %s is already hosted', name)
+        return
+    if os.path.exists(path):
+        os.unlink(path)
+
+    provider = provider_class(config)
+    server = _HostServer(path, provider)
+    signal.signal(
+        signal.SIGTERM,
+        lambda *_: threading.Thread(target=server.shutdown).start()
+    )
+    logger.info('Host provider %s on %s', provider.name, path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+        provider.close()
+        lock.close()
+
+
+class HostProvider(IProvider):
+    """
+    Calls a provider running in a host process (main.py host) over a
+    Unix socket, so one provider instance serves all processes of the
+    node and a provider crash does not take them down. The host is
+    started on the first call if it is not running, a host started by
+    this client is stopped on close.
+    """
+
+    def __init__(
+            self,
+            provider_namespace: str,
+            config: IProviderConfig
+    ) -> None:
+        super().__init__(config)
+        params = HostParams(**(config.orchestrator.params or {}))
+        self.__namespace = provider_namespace
+        self.__path = socket_path(config, self.name)
+        self.__spawn_host = params.spawn_host
+        self.__start_timeout = params.host_start_timeout
+        self.__connections: 'queue.LifoQueue[socket.socket]' = (
+            queue.LifoQueue()
+        )
+        self.__spawn_lock = threading.Lock()
+        self.__host: Optional[subprocess.Popen] = None
+
+    @property
+    def socket_path(self) -> str:
+        return self.__path
+
+    def ping(self) -> bool:
+        try:
+            return self.__call('ping').status == TaskStatus.finished
+        except (OSError, ProviderError):
+            return False
+
+    def register(self, data: bytes) -> Union[FaceRegisterTask, Task]:
+        return self.__call('register', data=data)
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        return self.__call('quality', data=data)
+
+    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
+        return self.__call('liveness', data=data)
+
+    def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
+        return self.__call('best_match', data=data)
+
+    def match_with_face(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return self.__call('match_with_face', internal_id, data)
+
+    def remove_face(self, internal_id: str) -> Task:
+        return self.__call('remove_face', internal_id)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self.__connections.get_nowait().close()
+            except queue.Empty:
+                break
+        # other processes start a new host on their next call
+        with self.__spawn_lock:
+            host, self.__host = self.__host, None
+        if host is None:
+            return
+        host.terminate()
+        try:
+            host.wait(self.__start_timeout)
+        except subprocess.TimeoutExpired:
+            self._log.warning('Kill provider host on %s', self.__path)
+            host.kill()
+            host.wait()
+
+    def __call(
+            self,
+            method: str,
+            meta: str = '',
+            data: bytes = b''
+    ) -> BaseTask:
+        raw_meta = meta.encode('utf-8')
+        header = _REQUEST.pack(
+            METHODS.index(method), len(raw_meta), len(data)
+        )
+        sock, reused = self.__get_connection()
+        try:
+            sock.settimeout(remaining_time())
+            try:
+                sock.sendall(header + raw_meta)
+            except OSError:
+                if not reused:
+                    raise
+                # the host has restarted since the connection was opened,
+                # nothing was delivered yet
+                sock.close()
+                sock = self.__connect()
+                sock.settimeout(remaining_time())
+                sock.sendall(header + raw_meta)
+            sock.sendall(data)
+            status, size = _RESPONSE.unpack(
+                _recv_exactly(sock, _RESPONSE.size)
+            )
+            payload = _recv_exactly(sock, size)
+        except BaseException:
+            sock.close()
+            raise
+        self.__connections.put(sock)
+
+        if status == STATUS_NOT_IMPLEMENTED:
+            raise NotImplementedError()
+        if status != STATUS_OK:
+            raise ProviderError(payload.decode('utf-8'))
+        return decode_task(payload)
+
+    def __get_connection(self) -> Tuple[socket.socket, bool]:
+        try:
+            return self.__connections.get_nowait(), True
+        except queue.Empty:
+            return self.__connect(), False
+
+    def __connect(self) -> socket.socket:
+        try:
+            return self.__open()
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not self.__spawn_host:
+                raise
+        with self.__spawn_lock:
+            try:
+                return self.__open()
+            except (FileNotFoundError, ConnectionRefusedError):
+                pass
+            self.__spawn()
+            deadline = time.monotonic() + self.__start_timeout
+            while True:
+                try:
+                    return self.__open()
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.1)
+
+    def __open(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.__path)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def __spawn(self) -> None:
+        if self.__host is not None and self.__host.poll() is None:
+            # the host started before is still starting up
+            return
+        self._log.info('Start provider host on %s', self.__path)
+        # a new session, so signals to this process group miss the host
+        self.__host = subprocess.Popen(
+            [
+                sys.executable, os.path.join(_APP_DIR, 'main.py'),
+                'host', self.__namespace,
+            ],
+            cwd=_APP_DIR,
+            start_new_session=True,
+        )
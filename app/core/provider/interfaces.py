@@ -1,5 +1,8 @@
+import asyncio
+import contextvars
+import functools
 import logging
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
 
 from pydantic import BaseModel
 
@@ -14,6 +17,13 @@ from core.provider.models.tasks import (
     Task,
 )
 
+T = TypeVar('T')
+
+# messages of failed results caused by the engine or the network rather
+# than by the request, only these are failures for the circuit breaker
+SEND_FAILED_MESSAGE = 'Can not send request to engie'
+ENGINE_ERROR_MESSAGE = 'Get error from engine'
+
 
 class OrchestratorConfig(BaseModel):
     orchestrator_type: OrchestratorType
@@ -26,16 +36,19 @@ class IProviderConfig(BaseModel):
     description: str
     quality_threshold: float
     anti_spoofing_threshold: float
+    match_threshold: Optional[float]
     build: str
     orchestrator: OrchestratorConfig
 
 
 class IProvider:
     def __init__(self, config: IProviderConfig) -> None:
+        self.__config = config
         self.__name = f'{config.engine_type}-{config.version.major}-{config.version.minor}-{config.version.path}'
         self.__description = config.description
         self.__quality_threshold = config.quality_threshold
         self.__anti_spoofing_threshold = config.anti_spoofing_threshold
+        self.__match_threshold = config.match_threshold
         self.__build = config.build
         self.__orchestrator_type = config.orchestrator.orchestrator_type
         self.__params = config.orchestrator.params
@@ -80,6 +93,98 @@ class IProvider:
         Remove face from engine's db.
         """
 
+    def quality_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceQualityTask, Task]]:
+        """
+        Get quality of several images in one engine call.
+        Calls quality() for each item if not overridden.
+        """
+        return [self.quality(data=item) for item in data]
+
+    def liveness_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceAntiSpoofTask, Task]]:
+        """
+        Get anti-spoofing scores of several images in one engine call.
+        Calls liveness() for each item if not overridden.
+        """
+        return [self.liveness(data=item) for item in data]
+
+    def best_match_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceBestMatchTask, Task]]:
+        """
+        Get best match ids of several images in one engine call.
+        Calls best_match() for each item if not overridden.
+        """
+        return [self.best_match(data=item) for item in data]
+
+    async def register_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceRegisterTask, Task]:
+        """
+        Register face in the engine db.
+        Runs register() in the loop executor if not overridden.
+        """
+        return await self._run_sync(self.register, data=data)
+
+    async def quality_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceQualityTask, Task]:
+        """
+        Get quality of input image or video.
+        Runs quality() in the loop executor if not overridden.
+        """
+        return await self._run_sync(self.quality, data=data)
+
+    async def liveness_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceAntiSpoofTask, Task]:
+        """
+        Get anti-spoofing score.
+        Runs liveness() in the loop executor if not overridden.
+        """
+        return await self._run_sync(self.liveness, data=data)
+
+    async def best_match_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceBestMatchTask, Task]:
+        """
+        Get best match id.
+        Runs best_match() in the loop executor if not overridden.
+        """
+        return await self._run_sync(self.best_match, data=data)
+
+    async def match_with_face_async(
+            self, 
+            data: bytes, 
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        """
+        Get match score.
+        Runs match_with_face() in the loop executor if not overridden.
+        """
+        return await self._run_sync(
+            self.match_with_face, data=data, internal_id=internal_id
+        )
+
+    def close(self) -> None:
+        """
+        Release provider resources.
+        """
+
+    @property
+    def config(self) -> IProviderConfig:
+        return self.__config
+
     @property
     def name(self) -> str:
         return self.__name
@@ -88,6 +193,18 @@ class IProvider:
     def description(self) -> str:
         return self.__description
 
+    @property
+    def quality_threshold(self) -> float:
+        return self.__quality_threshold
+
+    @property
+    def anti_spoofing_threshold(self) -> float:
+        return self.__anti_spoofing_threshold
+
+    @property
+    def match_threshold(self) -> Optional[float]:
+        return self.__match_threshold
+
     @property
     def build(self) -> str:
         return self.__build
@@ -103,3 +220,11 @@ class IProvider:
     @property
     def _log(self) -> logging.Logger:
         return self.__logger
+
+    async def _run_sync(self, fn: Callable[..., T], **kwargs) -> T:
+        loop = asyncio.get_running_loop()
+        # keep the task context (deadline) in the executor thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            None, functools.partial(context.run, fn, **kwargs)
+        )
@@ -1,12 +1,15 @@
 import logging
 import os
-from typing import List
+from typing import List, Tuple, Type
 
 import yaml
 
 from core.exceptions.app import AppError
+from core.provider.host_provider import HostProvider
 from core.provider.interfaces import IProvider, IProviderConfig
 from core.provider.loader.class_loader import ClassLoader
+from core.provider.models.enums import OrchestratorType
+from core.provider.process_provider import ProcessProvider
 
 
 class ProviderLoader:
@@ -16,45 +19,22 @@ class ProviderLoader:
 
     def load(self) -> List[IProvider]:
         subdirs = os.listdir(self.namespace)
-
-        config_dict = {}
         providers = []
 
         for subdir in subdirs:
+            provider_namespace = f'{self.namespace}.{subdir}'
             try:
-                provider_namespace = f'{self.namespace}.{subdir}'
-                config_path = os.path.join(
-                    self.namespace, subdir, '.config.yaml'
-                )
-                if not os.path.exists(config_path):
-                    raise AppError(
-                        f"no \'.config.yaml\' for {provider_namespace}"
-                    )
-
-                provider_configs = ClassLoader(
-                    recurse=False
-                ).load(provider_namespace, subclasses=IProviderConfig)
-                provider_classes = ClassLoader(
-                    recurse=False
-                ).load(provider_namespace, subclasses=IProvider)
-                
-                if len(provider_configs) != 1:
-                    raise AppError(
-                        f'configs len in {provider_namespace} \
-                            1 but {len(provider_configs)}'
-                    )
-                if len(provider_classes) != 1:
-                    raise AppError(
-                        f'providers len in {provider_namespace} \
-                            1 but {len(provider_classes)}'
+                provider, provider_config = self.load_class(subdir)
+                orchestrator_type = \
+                    provider_config.orchestrator.orchestrator_type
+                if orchestrator_type == OrchestratorType.process:
+                    instance = ProcessProvider(provider, provider_config)
+                elif orchestrator_type == OrchestratorType.host:
+                    instance = HostProvider(
+                        provider_namespace, provider_config
                     )
-
-                config = provider_configs[0]
-                provider = provider_classes[0]
-
-                with open(config_path, 'r') as reader:
-                    config_dict.update(yaml.safe_load(reader))
-                instance = provider(config(**config_dict))
+                else:
+                    instance = provider(provider_config)
                 providers.append(instance)
             except Exception:
                 logging.error(
@@ -63,3 +43,39 @@ class ProviderLoader:
                 )
 
         return providers
+
+    def load_class(
+            self,
+            subdir: str
+    ) -> Tuple[Type[IProvider], IProviderConfig]:
+        """
+        Provider class and config of the namespace subdirectory.
+        """
+        provider_namespace = f'{self.namespace}.{subdir}'
+        config_path = os.path.join(self.namespace, subdir, '.config.yaml')
+        if not os.path.exists(config_path):
+            raise AppError(
+                f"no \'.config.yaml\' for {provider_namespace}"
+            )
+
+        provider_configs = ClassLoader(
+            recurse=False
+        ).load(provider_namespace, subclasses=IProviderConfig)
+        provider_classes = ClassLoader(
+            recurse=False
+        ).load(provider_namespace, subclasses=IProvider)
+        
+        if len(provider_configs) != 1:
+            raise AppError(
+                f'configs len in {provider_namespace} \
+                    1 but {len(provider_configs)}'
+            )
+        if len(provider_classes) != 1:
+            raise AppError(
+                f'providers len in {provider_namespace} \
+                    1 but {len(provider_classes)}'
+            )
+
+        with open(config_path, 'r') as reader:
+            config_dict = yaml.safe_load(reader)
+        return provider_classes[0], provider_configs[0](**config_dict)
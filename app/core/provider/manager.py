@@ -3,6 +3,11 @@ from functools import lru_cache
 from typing import List
 
 from core.config import get_config
+from core.provider.batching_provider import (
+    BatchingProvider,
+    is_batching_enabled,
+)
+from core.provider.guarded_provider import GuardedProvider
 from core.provider.interfaces import IProvider
 from core.provider.loader.provider import ProviderLoader
 
@@ -14,6 +19,9 @@ class ProviderManager(object):
 
         for provider in providers:
             logging.error('Init provider %s', provider.name)
+            if is_batching_enabled(provider):
+                provider = BatchingProvider(provider)
+            provider = GuardedProvider(provider)
             self.__providers.update({provider.name: provider})
 
     @property
@@ -28,6 +36,10 @@ class ProviderManager(object):
         assert name in self.__providers.keys(), 'No such provider'
         return self.__providers[name]
 
+    def close(self) -> None:
+        for provider in self.__providers.values():
+            provider.close()
+
 
 @lru_cache()
 def get_provider_manager() -> ProviderManager:
@@ -11,10 +11,47 @@ class TaskStatus(str, Enum):
     started = 'started'
     finished = 'finished'
     failed = 'failed'
+    cancelled = 'cancelled'
+
+
+class TaskOperation(str, Enum):
+    register = 'register'
+    quality = 'quality'
+    liveness = 'liveness'
+    best_match = 'best_match'
+    match = 'match'
+    verify = 'verify'
+
+
+class TaskPriority(str, Enum):
+    interactive = 'interactive'
+    bulk = 'bulk'
+
+
+class VerifyStage(str, Enum):
+    quality = 'quality'
+    liveness = 'liveness'
+    best_match = 'best_match'
+
+
+class TimingStage(str, Enum):
+    queue_wait = 'queue_wait'
+    file_fetch = 'file_fetch'
+    provider_call = 'provider_call'
+    db = 'db'
+    result_write = 'result_write'
+
+
+class TaskBackend(str, Enum):
+    local = 'local'
+    redis = 'redis'
 
 
 class OrchestratorType(str, Enum):
     thread = 'thread'
+    process = 'process'
+    asyncio = 'asyncio'
+    host = 'host'
     docker = 'docker'
     docker_gpu = 'docker_gpu'
 
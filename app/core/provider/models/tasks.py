@@ -2,7 +2,7 @@ from typing import Optional, Union
 
 from pydantic import BaseModel
 
-from core.provider.models.enums import TaskStatus
+from core.provider.models.enums import TaskStatus, VerifyStage
 
 
 class FailedResult(BaseModel):
@@ -46,6 +46,33 @@ class FaceBestMatchResult(BaseModel):
         super().__init__(score=score, face_id=face_id)
 
 
+class FaceVerifyResult(BaseModel):
+    passed: bool
+    stage: VerifyStage
+    quality: float
+    liveness: Optional[float]
+    face_id: Optional[str]
+    score: Optional[float]
+
+    def __init__(
+            self,
+            passed: bool,
+            stage: VerifyStage,
+            quality: float,
+            liveness: Optional[float] = None,
+            face_id: Optional[str] = None,
+            score: Optional[float] = None
+    ) -> None:
+        super().__init__(
+            passed=passed,
+            stage=stage,
+            quality=quality,
+            liveness=liveness,
+            face_id=face_id,
+            score=score
+        )
+
+
 class BaseTask(BaseModel):
     status: TaskStatus
     result: Optional[
@@ -55,7 +82,8 @@ class BaseTask(BaseModel):
             FaceQualityResult,
             FaceAntiSpoofResult,
             FaceBestMatchResult,
-            FaceMatchResult
+            FaceMatchResult,
+            FaceVerifyResult
         ]
     ]
 
@@ -69,6 +97,7 @@ class BaseTask(BaseModel):
             FaceAntiSpoofResult,
             FaceBestMatchResult,
             FaceMatchResult,
+            FaceVerifyResult,
         ] = None,
     ) -> None:
         super().__init__(status=status, result=result)
@@ -138,3 +167,14 @@ class FaceMatchTask(BaseTask):
             result: FaceMatchResult
     ) -> None:
         super().__init__(status=status, result=result)
+
+
+class FaceVerifyTask(BaseTask):
+    result: FaceVerifyResult
+
+    def __init__(
+            self, 
+            status: TaskStatus, 
+            result: FaceVerifyResult
+    ) -> None:
+        super().__init__(status=status, result=result)
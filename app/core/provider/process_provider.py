@@ -0,0 +1,250 @@
+import asyncio
+import contextlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional, Tuple, Type, Union
+
+from pydantic import BaseModel
+from redis import Redis
+
+from core import tracing
+from core.config import get_config
+from core.exceptions.orchestrator import DeadlineExceededError
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.tasks import (
+    FaceAntiSpoofTask,
+    FaceBestMatchTask,
+    FaceMatchTask,
+    FaceQualityTask,
+    FaceRegisterTask,
+    Task,
+)
+from core.queue.context import (
+    TaskContext,
+    current_task,
+    remaining_time,
+    task_context,
+)
+
+# task ID, deadline and traceparent of the calling task
+CallContext = Tuple[Optional[str], Optional[float], Optional[str]]
+
+# provider instance and task store of the current worker process
+_provider: Optional[IProvider] = None
+_redis: Optional[Redis] = None
+
+
+def _init_worker(
+        provider_class: Type[IProvider],
+        config: IProviderConfig
+) -> None:
+    global _provider, _redis
+    _provider = provider_class(config)
+    # connects on the first cancellation check
+    _redis = Redis(
+        host=get_config().redis_host,
+        port=get_config().redis_port,
+        db=get_config().redis_queue_db
+    )
+
+
+def _call(
+        method: str,
+        shm_name: Optional[str],
+        size: int,
+        kwargs: Dict[str, Any],
+        context: CallContext
+) -> Any:
+    if shm_name is not None:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            kwargs['data'] = bytes(shm.buf[:size])
+        finally:
+            # the segment is unlinked by the parent process
+            shm.close()
+
+    task_id, deadline, traceparent = context
+    with contextlib.ExitStack() as stack:
+        # the provider sees the deadline, cancellation and trace of the
+        # task as if it ran in the calling process
+        if task_id is not None:
+            stack.enter_context(
+                task_context(TaskContext(task_id, deadline, _redis))
+            )
+        if traceparent is not None:
+            stack.enter_context(
+                tracing.trace(traceparent, f'process {method}')
+            )
+        return getattr(_provider, method)(**kwargs)
+
+
+def _call_context() -> CallContext:
+    context = current_task()
+    if context is None:
+        return None, None, tracing.traceparent()
+    return context.task_id, context.deadline, tracing.traceparent()
+
+
+def _free_when_done(
+        future: Future,
+        shm: Optional[shared_memory.SharedMemory]
+) -> None:
+    """
+    Unlink the payload segment once the child can not read it anymore.
+    """
+    if shm is None:
+        return
+    if future.cancel() or future.done():
+        _free(shm)
+    else:
+        future.add_done_callback(lambda _: _free(shm))
+
+
+def _free(shm: shared_memory.SharedMemory) -> None:
+    shm.close()
+    shm.unlink()
+
+
+class ProcessProviderParams(BaseModel):
+    max_workers: int = 1
+    processes: Optional[int]
+
+
+class ProcessProvider(IProvider):
+    """
+    Hosts provider instances in a pool of worker processes. Each process
+    creates its provider once; image payloads are passed through
+    shared memory instead of the pool pipe.
+
+    A call waits for the child until the task deadline. The child keeps
+    running after the deadline, its payload is freed when it is done.
+    """
+
+    def __init__(
+            self,
+            provider_class: Type[IProvider],
+            config: IProviderConfig
+    ) -> None:
+        super().__init__(config)
+        params = ProcessProviderParams(**(config.orchestrator.params or {}))
+        self.__pool = ProcessPoolExecutor(
+            max_workers=params.processes or params.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(provider_class, config),
+        )
+
+    def register(self, data: bytes) -> Union[FaceRegisterTask, Task]:
+        return self.__call('register', data=data)
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        return self.__call('quality', data=data)
+
+    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
+        return self.__call('liveness', data=data)
+
+    def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
+        return self.__call('best_match', data=data)
+
+    def match_with_face(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return self.__call(
+            'match_with_face', data=data, internal_id=internal_id
+        )
+
+    def remove_face(self, internal_id: str) -> Task:
+        return self.__call('remove_face', internal_id=internal_id)
+
+    async def register_async(
+            self,
+            data: bytes
+    ) -> Union[FaceRegisterTask, Task]:
+        return await self.__call_async('register', data=data)
+
+    async def quality_async(
+            self,
+            data: bytes
+    ) -> Union[FaceQualityTask, Task]:
+        return await self.__call_async('quality', data=data)
+
+    async def liveness_async(
+            self,
+            data: bytes
+    ) -> Union[FaceAntiSpoofTask, Task]:
+        return await self.__call_async('liveness', data=data)
+
+    async def best_match_async(
+            self,
+            data: bytes
+    ) -> Union[FaceBestMatchTask, Task]:
+        return await self.__call_async('best_match', data=data)
+
+    async def match_with_face_async(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return await self.__call_async(
+            'match_with_face', data=data, internal_id=internal_id
+        )
+
+    def close(self) -> None:
+        self.__pool.shutdown(wait=True)
+
+    def __call(
+            self,
+            method: str,
+            data: Optional[bytes] = None,
+            **kwargs
+    ) -> Any:
+        future, shm = self.__submit(method, data, kwargs)
+        try:
+            return future.result(timeout=remaining_time())
+        except FutureTimeoutError:
+            raise DeadlineExceededError(
+                f'Provider call {method} missed the task deadline'
+            )
+        finally:
+            _free_when_done(future, shm)
+
+    async def __call_async(self, method: str, data: bytes, **kwargs) -> Any:
+        future, shm = self.__submit(method, data, kwargs)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), remaining_time()
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError(
+                f'Provider call {method} missed the task deadline'
+            )
+        finally:
+            _free_when_done(future, shm)
+
+    def __submit(
+            self,
+            method: str,
+            data: Optional[bytes],
+            kwargs: Dict[str, Any]
+    ) -> Tuple[Future, Optional[shared_memory.SharedMemory]]:
+        context = _call_context()
+        if data is None:
+            future = self.__pool.submit(
+                _call, method, None, 0, kwargs, context
+            )
+            return future, None
+
+        shm = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        try:
+            shm.buf[:len(data)] = data
+            future = self.__pool.submit(
+                _call, method, shm.name, len(data), kwargs, context
+            )
+        except BaseException:
+            _free(shm)
+            raise
+        return future, shm
@@ -0,0 +1,104 @@
+from typing import List, Union
+
+from core.provider.interfaces import IProvider
+from core.provider.models.tasks import (
+    FaceAntiSpoofTask,
+    FaceBestMatchTask,
+    FaceMatchTask,
+    FaceQualityTask,
+    FaceRegisterTask,
+    Task,
+)
+
+
+class ProviderProxy(IProvider):
+    """
+    Base class for provider wrappers. Forwards all calls to the wrapped
+    provider; subclasses override the calls they change.
+    """
+
+    def __init__(self, provider: IProvider) -> None:
+        super().__init__(provider.config)
+        self._provider = provider
+
+    @property
+    def provider(self) -> IProvider:
+        return self._provider
+
+    def register(self, data: bytes) -> Union[FaceRegisterTask, Task]:
+        return self._provider.register(data=data)
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        return self._provider.quality(data=data)
+
+    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
+        return self._provider.liveness(data=data)
+
+    def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
+        return self._provider.best_match(data=data)
+
+    def match_with_face(
+            self, 
+            data: bytes, 
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return self._provider.match_with_face(
+            data=data, internal_id=internal_id
+        )
+
+    def remove_face(self, internal_id: str) -> Task:
+        return self._provider.remove_face(internal_id=internal_id)
+
+    def quality_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceQualityTask, Task]]:
+        return self._provider.quality_batch(data=data)
+
+    def liveness_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceAntiSpoofTask, Task]]:
+        return self._provider.liveness_batch(data=data)
+
+    def best_match_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceBestMatchTask, Task]]:
+        return self._provider.best_match_batch(data=data)
+
+    async def register_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceRegisterTask, Task]:
+        return await self._provider.register_async(data=data)
+
+    async def quality_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceQualityTask, Task]:
+        return await self._provider.quality_async(data=data)
+
+    async def liveness_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceAntiSpoofTask, Task]:
+        return await self._provider.liveness_async(data=data)
+
+    async def best_match_async(
+            self, 
+            data: bytes
+    ) -> Union[FaceBestMatchTask, Task]:
+        return await self._provider.best_match_async(data=data)
+
+    async def match_with_face_async(
+            self, 
+            data: bytes, 
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return await self._provider.match_with_face_async(
+            data=data, internal_id=internal_id
+        )
+
+    def close(self) -> None:
+        self._provider.close()
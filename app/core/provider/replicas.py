@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+from core.metrics import get_registry
+
+R = TypeVar('R')
+
+# latencies kept per path for the hedge delay
+LATENCY_WINDOW = 512
+# no hedging until a path has this many latencies
+MIN_LATENCY_SAMPLES = 20
+
+hedged_requests = get_registry().counter(
+    'provider_hedged_requests_total',
+    'Second requests sent to another replica after the hedge delay',
+    ('provider',),
+)
+ejected_replicas = get_registry().counter(
+    'provider_replica_ejections_total',
+    'Replicas taken out of balancing after consecutive failures',
+    ('provider', 'replica'),
+)
+
+
+class Replica:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+
+class ReplicaSet:
+    """
+    Balances requests over replicas of an HTTP engine.
+
+    A request goes to the healthy replica with the fewest requests in
+    progress. A replica that fails eject_failures requests in a row
+    (exception or 5xx response) is skipped for eject_time seconds; if
+    all replicas are ejected they are used anyway.
+
+    With hedge=True, if there is no response after the hedge_quantile
+    latency of the path, the same request is sent to another replica
+    and the first good response wins. Only for idempotent requests.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            urls: List[str],
+            eject_failures: int,
+            eject_time: float,
+            hedge_quantile: Optional[float] = None,
+            hedge_workers: int = 32
+    ) -> None:
+        if not urls:
+            raise ValueError('No replica urls')
+        self.__name = name
+        self.__replicas = [Replica(url.rstrip('/')) for url in urls]
+        self.__eject_failures = eject_failures
+        self.__eject_time = eject_time
+        self.__hedge_quantile = hedge_quantile
+        self.__hedge_workers = hedge_workers
+        self.__pool: Optional[ThreadPoolExecutor] = None
+        self.__latencies: Dict[str, Deque[float]] = {}
+        self.__next = 0
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger(f'replicas.{name}')
+
+    @property
+    def urls(self) -> List[str]:
+        return [replica.url for replica in self.__replicas]
+
+    def call(
+            self,
+            path: str,
+            send: Callable[[str], R],
+            hedge: bool = False
+    ) -> R:
+        """
+        send gets the full url and returns a response with status_code.
+        """
+        primary = self.__pick()
+        delay = self.hedge_delay(path) if hedge else None
+        if delay is None:
+            return self.__send(primary, path, send)
+
+        first = self.__get_pool().submit(self.__send, primary, path, send)
+        done, _ = wait([first], timeout=delay)
+        second = None if done else self.__pick(exclude=primary)
+        if second is None:
+            return first.result()
+
+        hedged_requests.inc(provider=self.__name)
+        pending = {
+            first,
+            self.__get_pool().submit(self.__send, second, path, send),
+        }
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if self.__is_good(future) or not pending:
+                    return future.result()
+
+    async def call_async(
+            self,
+            path: str,
+            send: Callable[[str], Awaitable[R]],
+            hedge: bool = False
+    ) -> R:
+        primary = self.__pick()
+        delay = self.hedge_delay(path) if hedge else None
+        if delay is None:
+            return await self.__send_async(primary, path, send)
+
+        first = asyncio.ensure_future(
+            self.__send_async(primary, path, send)
+        )
+        done, _ = await asyncio.wait([first], timeout=delay)
+        second = None if done else self.__pick(exclude=primary)
+        if second is None:
+            return await first
+
+        hedged_requests.inc(provider=self.__name)
+        pending = {
+            first,
+            asyncio.ensure_future(self.__send_async(second, path, send)),
+        }
+        try:
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    if self.__is_good(future) or not pending:
+                        return future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def hedge_delay(self, path: str) -> Optional[float]:
+        """
+        The hedge_quantile latency of the path or None if hedging is off
+        or there are too few samples.
+        """
+        if self.__hedge_quantile is None or len(self.__replicas) < 2:
+            return None
+        with self.__lock:
+            latencies = sorted(self.__latencies.get(path, ()))
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        index = min(
+            int(len(latencies) * self.__hedge_quantile), len(latencies) - 1
+        )
+        return latencies[index]
+
+    def close(self) -> None:
+        if self.__pool is not None:
+            self.__pool.shutdown(wait=False)
+
+    def __pick(self, exclude: Optional[Replica] = None) -> Optional[Replica]:
+        now = time.monotonic()
+        with self.__lock:
+            # start from a rotating offset to spread ties
+            start = self.__next
+            self.__next = (self.__next + 1) % len(self.__replicas)
+            replicas = [
+                self.__replicas[(start + i) % len(self.__replicas)]
+                for i in range(len(self.__replicas))
+            ]
+            replicas = [r for r in replicas if r is not exclude]
+            healthy = [r for r in replicas if r.ejected_until <= now]
+            replicas = healthy or replicas
+            if not replicas:
+                return None
+            replica = min(replicas, key=lambda r: r.outstanding)
+            replica.outstanding += 1
+            return replica
+
+    def __send(
+            self,
+            replica: Replica,
+            path: str,
+            send: Callable[[str], R]
+    ) -> R:
+        start = time.monotonic()
+        try:
+            response = send(f'{replica.url}/{path}')
+        except Exception:
+            self.__done(replica, path, False, time.monotonic() - start)
+            raise
+        self.__done(
+            replica, path,
+            response.status_code < 500, time.monotonic() - start
+        )
+        return response
+
+    async def __send_async(
+            self,
+            replica: Replica,
+            path: str,
+            send: Callable[[str], Awaitable[R]]
+    ) -> R:
+        start = time.monotonic()
+        try:
+            response = await send(f'{replica.url}/{path}')
+        except asyncio.CancelledError:
+            # the other hedged request won, not a replica failure
+            with self.__lock:
+                replica.outstanding -= 1
+            raise
+        except Exception:
+            self.__done(replica, path, False, time.monotonic() - start)
+            raise
+        self.__done(
+            replica, path,
+            response.status_code < 500, time.monotonic() - start
+        )
+        return response
+
+    def __done(
+            self,
+            replica: Replica,
+            path: str,
+            success: bool,
+            latency: float
+    ) -> None:
+        with self.__lock:
+            replica.outstanding -= 1
+            if success:
+                replica.failures = 0
+                self.__latencies.setdefault(
+                    path, deque(maxlen=LATENCY_WINDOW)
+                ).append(latency)
+                return
+            replica.failures += 1
+            if replica.failures < self.__eject_failures:
+                return
+            replica.failures = 0
+            replica.ejected_until = time.monotonic() + self.__eject_time
+        self.__logger.warning(
+            'Eject replica %s for %.1f s', replica.url, self.__eject_time
+        )
+        ejected_replicas.inc(provider=self.__name, replica=replica.url)
+
+    def __is_good(self, future: Future) -> bool:
+        if future.exception() is not None:
+            return False
+        return future.result().status_code < 500
+
+    def __get_pool(self) -> ThreadPoolExecutor:
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = ThreadPoolExecutor(
+                    max_workers=self.__hedge_workers,
+                    thread_name_prefix=f'{self.__name}-hedge',
+                )
+            return self.__pool
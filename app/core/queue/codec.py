@@ -0,0 +1,324 @@
+"""
+Binary encoding of BaseTask records stored in Redis.
+
+    byte 0:     codec version
+    byte 1:     schema tag (task class)
+    byte 2:     task status
+    bytes 3-10: update time, unix seconds as double
+    rest:       result fields of the schema, big-endian; strings are
+            prefixed with their uint16 length, optional fields with a
+            presence flag
+
+Tags and enum positions are part of the format: append new values,
+never reorder them. Decoded records are built without pydantic validation,
+the codec only produces valid field values.
+"""
+
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+from core.provider.models.enums import TaskStatus, VerifyStage
+from core.provider.models.tasks import (
+    BaseTask,
+    FaceAntiSpoofResult,
+    FaceAntiSpoofTask,
+    FaceBestMatchResult,
+    FaceBestMatchTask,
+    FaceMatchResult,
+    FaceMatchTask,
+    FaceQualityResult,
+    FaceQualityTask,
+    FaceRegisterResult,
+    FaceRegisterTask,
+    FaceVerifyResult,
+    FaceVerifyTask,
+    FailedResult,
+    Task,
+)
+
+VERSION = 1
+
+STATUSES: List[TaskStatus] = [
+    TaskStatus.queued,
+    TaskStatus.started,
+    TaskStatus.finished,
+    TaskStatus.failed,
+    TaskStatus.cancelled,
+]
+STAGES: List[VerifyStage] = [
+    VerifyStage.quality,
+    VerifyStage.liveness,
+    VerifyStage.best_match,
+]
+
+_HEADER = struct.Struct('>BBBd')
+_DOUBLE = struct.Struct('>d')
+_LENGTH = struct.Struct('>H')
+_FLAG = struct.Struct('>B')
+
+
+class CodecError(ValueError):
+    pass
+
+
+class UnsupportedVersionError(CodecError):
+    """
+    Record of another codec version, e.g. a pickled task written before
+    the codec. Readers treat it as a missing record.
+    """
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self.__parts: List[bytes] = []
+
+    def double(self, value: float) -> None:
+        self.__parts.append(_DOUBLE.pack(value))
+
+    def flag(self, value: int) -> None:
+        self.__parts.append(_FLAG.pack(value))
+
+    def string(self, value: str) -> None:
+        raw = value.encode('utf-8')
+        self.__parts.append(_LENGTH.pack(len(raw)))
+        self.__parts.append(raw)
+
+    def optional_double(self, value: Optional[float]) -> None:
+        self.flag(value is not None)
+        if value is not None:
+            self.double(value)
+
+    def optional_string(self, value: Optional[str]) -> None:
+        self.flag(value is not None)
+        if value is not None:
+            self.string(value)
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.__parts)
+
+
+class _Reader:
+    def __init__(self, raw: bytes, offset: int) -> None:
+        self.__raw = raw
+        self.__offset = offset
+
+    def double(self) -> float:
+        return self.__unpack(_DOUBLE)
+
+    def flag(self) -> int:
+        return self.__unpack(_FLAG)
+
+    def string(self) -> str:
+        size = self.__unpack(_LENGTH)
+        start = self.__offset
+        self.__offset += size
+        if self.__offset > len(self.__raw):
+            raise CodecError('Truncated task record')
+        try:
+            return self.__raw[start:self.__offset].decode('utf-8')
+        except UnicodeDecodeError:
+            raise CodecError('Invalid string in task record')
+
+    def optional_double(self) -> Optional[float]:
+        return self.double() if self.flag() else None
+
+    def optional_string(self) -> Optional[str]:
+        return self.string() if self.flag() else None
+
+    def done(self) -> None:
+        if self.__offset != len(self.__raw):
+            raise CodecError('Unexpected bytes after task record')
+
+    def __unpack(self, fmt: struct.Struct):
+        try:
+            (value,) = fmt.unpack_from(self.__raw, self.__offset)
+        except struct.error:
+            raise CodecError('Truncated task record')
+        self.__offset += fmt.size
+        return value
+
+
+def _write_failed(writer: _Writer, task: Task) -> None:
+    writer.optional_string(
+        None if task.result is None else task.result.message
+    )
+
+
+def _read_failed(reader: _Reader, status: TaskStatus) -> Task:
+    message = reader.optional_string()
+    return Task.construct(
+        status=status,
+        result=(
+            None if message is None
+            else FailedResult.construct(message=message)
+        ),
+    )
+
+
+def _write_register(writer: _Writer, task: FaceRegisterTask) -> None:
+    writer.string(str(task.result.face_id))
+
+
+def _read_register(reader: _Reader, status: TaskStatus) -> FaceRegisterTask:
+    return FaceRegisterTask.construct(
+        status=status,
+        result=FaceRegisterResult.construct(face_id=reader.string()),
+    )
+
+
+def _write_score(writer: _Writer, task: BaseTask) -> None:
+    writer.double(task.result.score)
+
+
+def _score_reader(
+        task_class: Type[BaseTask],
+        result_class: Type[FaceQualityResult]
+) -> Callable[[_Reader, TaskStatus], BaseTask]:
+    def read(reader: _Reader, status: TaskStatus) -> BaseTask:
+        return task_class.construct(
+            status=status,
+            result=result_class.construct(score=reader.double()),
+        )
+    return read
+
+
+def _write_best_match(writer: _Writer, task: FaceBestMatchTask) -> None:
+    writer.double(task.result.score)
+    writer.string(str(task.result.face_id))
+
+
+def _read_best_match(
+        reader: _Reader,
+        status: TaskStatus
+) -> FaceBestMatchTask:
+    score = reader.double()
+    return FaceBestMatchTask.construct(
+        status=status,
+        result=FaceBestMatchResult.construct(
+            score=score, face_id=reader.string()
+        ),
+    )
+
+
+def _write_verify(writer: _Writer, task: FaceVerifyTask) -> None:
+    result = task.result
+    writer.flag(result.passed)
+    writer.flag(STAGES.index(result.stage))
+    writer.double(result.quality)
+    writer.optional_double(result.liveness)
+    writer.optional_string(
+        None if result.face_id is None else str(result.face_id)
+    )
+    writer.optional_double(result.score)
+
+
+def _read_verify(reader: _Reader, status: TaskStatus) -> FaceVerifyTask:
+    passed = bool(reader.flag())
+    stage = _lookup(STAGES, reader.flag(), 'verify stage')
+    return FaceVerifyTask.construct(
+        status=status,
+        result=FaceVerifyResult.construct(
+            passed=passed,
+            stage=stage,
+            quality=reader.double(),
+            liveness=reader.optional_double(),
+            face_id=reader.optional_string(),
+            score=reader.optional_double(),
+        ),
+    )
+
+
+# tag -> (task class, writer, reader)
+SCHEMAS: List[Tuple[Type[BaseTask], Callable, Callable]] = [
+    (Task, _write_failed, _read_failed),
+    (FaceRegisterTask, _write_register, _read_register),
+    (
+        FaceQualityTask, _write_score,
+        _score_reader(FaceQualityTask, FaceQualityResult),
+    ),
+    (
+        FaceAntiSpoofTask, _write_score,
+        _score_reader(FaceAntiSpoofTask, FaceAntiSpoofResult),
+    ),
+    (FaceBestMatchTask, _write_best_match, _read_best_match),
+    (
+        FaceMatchTask, _write_score,
+        _score_reader(FaceMatchTask, FaceMatchResult),
+    ),
+    (FaceVerifyTask, _write_verify, _read_verify),
+]
+_TAGS: Dict[Type[BaseTask], int] = {
+    task_class: tag for tag, (task_class, _, _) in enumerate(SCHEMAS)
+}
+
+
+def _lookup(values: list, index: int, name: str):
+    if index >= len(values):
+        raise CodecError(f'Unknown {name} {index}')
+    return values[index]
+
+
+def encode_task(task: BaseTask, updated_at: Optional[float] = None) -> bytes:
+    """
+    updated_at defaults to the current time.
+    """
+    tag = _TAGS.get(type(task))
+    if tag is None:
+        raise CodecError(f'Can not encode {type(task).__name__}')
+    _, write, _ = SCHEMAS[tag]
+    writer = _Writer()
+    write(writer, task)
+    header = _HEADER.pack(
+        VERSION,
+        tag,
+        STATUSES.index(task.status),
+        time.time() if updated_at is None else updated_at,
+    )
+    return header + writer.getvalue()
+
+
+def decode_task(raw: bytes) -> BaseTask:
+    tag, status, _, offset = _read_header(raw)
+    _, _, read = _lookup(SCHEMAS, tag, 'schema tag')
+    reader = _Reader(raw, offset)
+    task = read(reader, _lookup(STATUSES, status, 'task status'))
+    reader.done()
+    return task
+
+
+def decode_stored_task(raw: Optional[bytes]) -> Optional[BaseTask]:
+    """
+    Task read from Redis, None for a missing record or a record of another
+    codec version.
+    """
+    if raw is None:
+        return None
+    try:
+        return decode_task(raw)
+    except UnsupportedVersionError:
+        return None
+
+
+def decode_updated_at(raw: bytes) -> float:
+    """
+    Update time of the record without decoding the result.
+    """
+    _, _, updated_at, _ = _read_header(raw)
+    return updated_at
+
+
+def _read_header(raw: bytes) -> Tuple[int, int, float, int]:
+    """
+    Returns schema tag, status index, update time and result offset.
+    """
+    if not raw:
+        raise CodecError('Truncated task record')
+    if raw[0] != VERSION:
+        raise UnsupportedVersionError(
+            f'Unsupported task codec version {raw[0]}'
+        )
+    if len(raw) < _HEADER.size:
+        raise CodecError('Truncated task record')
+    _, tag, status, updated_at = _HEADER.unpack_from(raw)
+    return tag, status, updated_at, _HEADER.size
@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from redis import Redis
+
+from core.config import get_config
+from core.exceptions.orchestrator import (
+    DeadlineExceededError,
+    TaskCancelledError,
+)
+from core.provider.models.enums import TimingStage
+from core.queue.timings import TaskTimings
+
+# smallest timeout passed to providers when the deadline is close
+MIN_TIMEOUT = 0.001
+# result message of a task that missed its deadline
+DEADLINE_MESSAGE = 'Task deadline exceeded'
+
+
+def cancel_key(task_id: str) -> str:
+    return f'{get_config().cancel_name}:{task_id}'
+
+
+class TaskContext:
+    """
+    Deadline, cancellation and timings of the running task.
+    """
+
+    def __init__(
+            self,
+            task_id: str,
+            deadline: Optional[float],
+            redis: Redis,
+            timings: Optional[TaskTimings] = None
+    ) -> None:
+        self.__task_id = task_id
+        self.__deadline = deadline
+        self.__redis = redis
+        self.__timings = timings
+
+    @property
+    def task_id(self) -> str:
+        return self.__task_id
+
+    @property
+    def deadline(self) -> Optional[float]:
+        return self.__deadline
+
+    @property
+    def timings(self) -> Optional[TaskTimings]:
+        return self.__timings
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left until the deadline or None if there is no deadline.
+        """
+        if self.__deadline is None:
+            return None
+        return self.__deadline - time.time()
+
+    def is_cancelled(self) -> bool:
+        return self.__redis.exists(cancel_key(self.__task_id)) > 0
+
+    def check(self) -> None:
+        """
+        Raises TaskCancelledError or DeadlineExceededError if the task
+        should not go on.
+        """
+        if self.is_cancelled():
+            raise TaskCancelledError(f'Task {self.__task_id} is cancelled')
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError(
+                f'Task {self.__task_id} missed its deadline'
+            )
+
+
+__current: contextvars.ContextVar[Optional[TaskContext]] = (
+    contextvars.ContextVar('task_context', default=None)
+)
+
+
+@contextmanager
+def task_context(context: TaskContext) -> Iterator[TaskContext]:
+    token = __current.set(context)
+    try:
+        yield context
+    finally:
+        __current.reset(token)
+
+
+def current_task() -> Optional[TaskContext]:
+    return __current.get()
+
+
+def check_deadline() -> None:
+    """
+    Raises DeadlineExceededError if the current task missed its deadline.
+    Unlike check_task() does not call Redis.
+    """
+    context = current_task()
+    if context is None:
+        return
+    remaining = context.remaining()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError(
+            f'Task {context.task_id} missed its deadline'
+        )
+
+
+def check_task() -> None:
+    context = current_task()
+    if context is not None:
+        context.check()
+
+
+async def check_task_async() -> None:
+    context = current_task()
+    if context is not None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, context.check)
+
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """
+    Timeout for a provider call: the time left until the task deadline,
+    but not more than default.
+    """
+    context = current_task()
+    remaining = context.remaining() if context is not None else None
+    if remaining is None:
+        return default
+    remaining = max(remaining, MIN_TIMEOUT)
+    return remaining if default is None else min(default, remaining)
+
+
+@contextmanager
+def timed(stage: TimingStage) -> Iterator[None]:
+    """
+    Adds the time of the block to the timings of the current task.
+    """
+    context = current_task()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if context is not None and context.timings is not None:
+            context.timings.add(stage, time.monotonic() - start)
@@ -0,0 +1,36 @@
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel
+
+from core.provider.models.enums import TaskOperation, TaskPriority
+
+
+class TaskEnvelope(BaseModel):
+    task_id: str
+    operation: TaskOperation
+    engine_id: uuid.UUID
+    provider: str
+    file_hash: str
+    face_id: Optional[uuid.UUID]
+    priority: TaskPriority = TaskPriority.interactive
+    deadline: Optional[float]
+    # unix time of creation, for the queue wait timing
+    created_at: Optional[float]
+    # W3C traceparent of the request that created the task
+    traceparent: Optional[str]
+    attempts: int = 0
+
+
+class QueueItem(BaseModel):
+    raw: bytes
+    envelope: TaskEnvelope
+
+
+class TaskRequest(BaseModel):
+    operation: TaskOperation
+    engine_id: uuid.UUID
+    file_hash: str
+    face_id: Optional[uuid.UUID]
+    priority: TaskPriority = TaskPriority.interactive
+    timeout: Optional[float]
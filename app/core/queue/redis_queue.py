@@ -0,0 +1,425 @@
+import hashlib
+import logging
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+from redis import Redis
+from redis.client import Pipeline
+
+from core.config import get_config
+from core.metrics import get_registry
+from core.provider.models.enums import TaskPriority
+from core.provider.models.tasks import FailedResult, Task, TaskStatus
+from core.queue.models import QueueItem, TaskEnvelope
+from core.queue.task_store import set_task
+
+logger = logging.getLogger('task_queue')
+stolen_tasks = get_registry().counter(
+    'queue_stolen_total',
+    'Tasks taken from shards of other workers',
+)
+
+# KEYS: processing list, then pending lists in pop order
+# ARGV[1]: smallest length of a pending list to pop from
+# ARGV[2]: lease key prefix, ARGV[3]: worker ID, ARGV[4]: lease seconds
+# the envelope is leased in the same step, so requeue_stale never sees
+# it in the processing list without a lease
+POP_FIRST = """
+for i = 2, #KEYS do
+    if redis.call('LLEN', KEYS[i]) >= tonumber(ARGV[1]) then
+        local raw = redis.call('RPOPLPUSH', KEYS[i], KEYS[1])
+        -- an invalid envelope is dropped by the worker without a lease
+        local ok, envelope = pcall(cjson.decode, raw)
+        if ok and type(envelope) == 'table'
+                and type(envelope.task_id) == 'string' then
+            redis.call(
+                'SET', ARGV[2] .. envelope.task_id, ARGV[3], 'EX', ARGV[4]
+            )
+        end
+        return raw
+    end
+end
+return false
+"""
+
+
+class RedisTaskQueue:
+    """
+    Durable task queue on Redis lists.
+
+    Task states map onto queue transitions:
+        - queued: envelope is in the pending list
+        - started: envelope is moved to the worker processing list
+          and leased for visibility_timeout seconds; the worker
+          heartbeat renews the leases of its running tasks
+        - finished/failed: envelope is removed from the processing list
+
+    Envelopes of dead workers (no heartbeat) and expired leases are moved
+    back to the pending list until max_attempts is reached.
+
+    Each task priority has its own pending list. Workers take from the
+    lists in smooth weighted round robin order, so interactive tasks do
+    not wait behind a bulk backlog and bulk tasks are not starved.
+
+    With shards > 0 the pending lists are split by a hash of engine_id.
+    Each shard prefers affinity_workers live workers chosen by rendezvous
+    hashing, so an engine stays on the same workers and only the shards
+    of joining or leaving workers move. A worker with nothing in its own
+    shards steals from shards with at least steal_backlog pending tasks.
+    """
+
+    def __init__(
+            self,
+            redis: Redis,
+            name: str,
+            visibility_timeout: int,
+            max_attempts: int,
+            heartbeat_ttl: int,
+            weights: Dict[TaskPriority, float],
+            shards: int = 0,
+            affinity_workers: int = 2,
+            steal_backlog: int = 4
+    ) -> None:
+        self.__redis = redis
+        self.__name = name
+        self.__visibility_timeout = visibility_timeout
+        self.__max_attempts = max_attempts
+        self.__heartbeat_ttl = heartbeat_ttl
+        self.__weights = {p: weights.get(p, 1) for p in TaskPriority}
+        self.__credits = {p: 0.0 for p in TaskPriority}
+        self.__shards = shards
+        self.__affinity_workers = affinity_workers
+        self.__steal_backlog = steal_backlog
+        # worker ID -> own shards, updated by heartbeat
+        self.__own_shards: Dict[str, List[int]] = {}
+        self.__next_shard = 0
+        self.__pop_first = redis.register_script(POP_FIRST)
+
+    def pending_key(
+            self,
+            priority: TaskPriority,
+            shard: Optional[int] = None
+    ) -> str:
+        if shard is None:
+            return f'{self.__name}:pending:{priority.value}'
+        return f'{self.__name}:pending:{priority.value}:{shard}'
+
+    def shard(self, engine_id: uuid.UUID) -> Optional[int]:
+        if self.__shards == 0:
+            return None
+        digest = hashlib.md5(engine_id.bytes).digest()
+        return int.from_bytes(digest[:8], 'big') % self.__shards
+
+    def preferred_workers(self, shard: int, workers: List[str]) -> List[str]:
+        """
+        Workers of the shard by rendezvous hashing.
+        """
+        def score(worker_id: str) -> bytes:
+            return hashlib.md5(f'{shard}:{worker_id}'.encode()).digest()
+
+        ranked = sorted(workers, key=score, reverse=True)
+        return ranked[:self.__affinity_workers]
+
+    @property
+    def workers_key(self) -> str:
+        return f'{self.__name}:workers'
+
+    def processing_key(self, worker_id: str) -> str:
+        return f'{self.__name}:processing:{worker_id}'
+
+    def heartbeat_key(self, worker_id: str) -> str:
+        return f'{self.__name}:heartbeat:{worker_id}'
+
+    def claim_key(self, worker_id: str) -> str:
+        return f'{self.__name}:claim:{worker_id}'
+
+    def lease_key(self, task_id: str) -> str:
+        return f'{self.__name}:lease:{task_id}'
+
+    def push(
+            self,
+            envelope: TaskEnvelope,
+            pipe: Optional[Pipeline] = None
+    ) -> None:
+        """
+        Push envelope to the pending list. With pipe the push is only
+        added to the pipeline.
+        """
+        (pipe or self.__redis).lpush(
+            self.__envelope_key(envelope), envelope.json()
+        )
+
+    def pop(self, worker_id: str, timeout: int = 1) -> Optional[QueueItem]:
+        processing_key = self.processing_key(worker_id)
+        shards = self.__pop_shards(worker_id)
+        lanes = self.__lane_order()
+        raw = self.__pop_first(
+            keys=[processing_key] + [
+                self.pending_key(priority, shard)
+                for priority in lanes for shard in shards
+            ],
+            args=self.__pop_args(worker_id, 1),
+        )
+        if raw is None and self.__shards > 0:
+            raw = self.__steal(worker_id, shards, lanes)
+        if raw is None and shards:
+            # a blocking pop can not run in a script, the envelope waits
+            # in the claim list until it is leased
+            claim_key = self.claim_key(worker_id)
+            if self.__redis.brpoplpush(
+                self.pending_key(TaskPriority.interactive, shards[0]),
+                claim_key,
+                timeout=timeout
+            ) is not None:
+                raw = self.__pop_first(
+                    keys=[processing_key, claim_key],
+                    args=self.__pop_args(worker_id, 1),
+                )
+        elif raw is None:
+            time.sleep(timeout)
+        if raw is None:
+            return None
+
+        try:
+            envelope = TaskEnvelope.parse_raw(raw)
+        except Exception:
+            logger.error('Drop invalid envelope: %s', raw, exc_info=True)
+            self.__redis.lrem(self.processing_key(worker_id), 1, raw)
+            return None
+        return QueueItem(raw=raw, envelope=envelope)
+
+    def ack(self, worker_id: str, item: QueueItem) -> None:
+        pipe = self.__redis.pipeline()
+        pipe.lrem(self.processing_key(worker_id), 1, item.raw)
+        pipe.delete(self.lease_key(item.envelope.task_id))
+        pipe.execute()
+
+    def release(
+            self,
+            worker_id: str,
+            item: QueueItem,
+            reset_status: bool = False
+    ) -> None:
+        """
+        Put envelope back to the pending list without counting an attempt.
+        With reset_status the started task is marked queued again.
+        """
+        pipe = self.__redis.pipeline()
+        pipe.lrem(self.processing_key(worker_id), 1, item.raw)
+        pipe.delete(self.lease_key(item.envelope.task_id))
+        pipe.rpush(self.__envelope_key(item.envelope), item.raw)
+        if reset_status:
+            set_task(
+                pipe, item.envelope.task_id, Task(status=TaskStatus.queued)
+            )
+        pipe.execute()
+
+    def heartbeat(
+            self,
+            worker_id: str,
+            task_ids: Iterable[str] = ()
+    ) -> None:
+        """
+        Mark the worker alive, renew the leases of its running tasks and,
+        with shards, update its own shards. A lease that has already
+        expired is not renewed, the task may be requeued by now.
+        """
+        pipe = self.__redis.pipeline()
+        pipe.sadd(self.workers_key, worker_id)
+        pipe.set(
+            self.heartbeat_key(worker_id), 1, ex=self.__heartbeat_ttl
+        )
+        for task_id in task_ids:
+            pipe.set(
+                self.lease_key(task_id),
+                worker_id,
+                ex=self.__visibility_timeout,
+                xx=True,
+            )
+        pipe.execute()
+        if self.__shards > 0:
+            self.__update_shards(worker_id)
+
+    def unregister(self, worker_id: str) -> None:
+        pipe = self.__redis.pipeline()
+        pipe.delete(self.heartbeat_key(worker_id))
+        pipe.srem(self.workers_key, worker_id)
+        pipe.execute()
+
+    def workers(self) -> List[str]:
+        return sorted(
+            w.decode() for w in self.__redis.smembers(self.workers_key)
+        )
+
+    def requeue_stale(self) -> int:
+        """
+        Requeue envelopes of dead workers and envelopes with expired lease.
+        Returns number of requeued envelopes.
+        """
+        requeued = 0
+        for worker_id in self.workers():
+            alive = self.__redis.exists(self.heartbeat_key(worker_id))
+            processing_key = self.processing_key(worker_id)
+            for raw in self.__redis.lrange(processing_key, 0, -1):
+                try:
+                    envelope = TaskEnvelope.parse_raw(raw)
+                except Exception:
+                    self.__redis.lrem(processing_key, 1, raw)
+                    continue
+                if alive and self.__redis.exists(
+                    self.lease_key(envelope.task_id)
+                ):
+                    continue
+                # another worker could requeue it already
+                if self.__redis.lrem(processing_key, 1, raw) == 0:
+                    continue
+                self.__requeue(envelope)
+                requeued += 1
+
+            if alive:
+                continue
+            requeued += self.__requeue_claimed(worker_id)
+            if self.__redis.llen(processing_key) == 0:
+                logger.warning('Remove dead worker %s', worker_id)
+                self.__redis.srem(self.workers_key, worker_id)
+        return requeued
+
+    def __requeue(self, envelope: TaskEnvelope) -> None:
+        envelope.attempts += 1
+        pipe = self.__redis.pipeline()
+        pipe.delete(self.lease_key(envelope.task_id))
+        if envelope.attempts >= self.__max_attempts:
+            logger.error(
+                'Task %s failed after %d attempts',
+                envelope.task_id, envelope.attempts
+            )
+            set_task(
+                pipe,
+                envelope.task_id,
+                Task(
+                    status=TaskStatus.failed,
+                    result=FailedResult(message='Task was lost'),
+                ),
+            )
+        else:
+            logger.warning(
+                'Requeue task %s, attempt %d',
+                envelope.task_id, envelope.attempts
+            )
+            set_task(pipe, envelope.task_id, Task(status=TaskStatus.queued))
+            pipe.rpush(self.__envelope_key(envelope), envelope.json())
+        pipe.execute()
+
+    def __requeue_claimed(self, worker_id: str) -> int:
+        """
+        Put back envelopes a dead worker popped but did not lease. They
+        never started, so no attempt is counted.
+        """
+        requeued = 0
+        claim_key = self.claim_key(worker_id)
+        for raw in self.__redis.lrange(claim_key, 0, -1):
+            if self.__redis.lrem(claim_key, 1, raw) == 0:
+                continue
+            try:
+                envelope = TaskEnvelope.parse_raw(raw)
+            except Exception:
+                continue
+            self.__redis.rpush(self.__envelope_key(envelope), raw)
+            requeued += 1
+        return requeued
+
+    def __pop_args(self, worker_id: str, min_length: int) -> List[Any]:
+        return [
+            min_length,
+            self.lease_key(''),
+            worker_id,
+            self.__visibility_timeout,
+        ]
+
+    def __envelope_key(self, envelope: TaskEnvelope) -> str:
+        return self.pending_key(
+            envelope.priority, self.shard(envelope.engine_id)
+        )
+
+    def __update_shards(self, worker_id: str) -> None:
+        workers = self.workers()
+        pipe = self.__redis.pipeline()
+        for other in workers:
+            pipe.exists(self.heartbeat_key(other))
+        alive = [w for w, exists in zip(workers, pipe.execute()) if exists]
+        if worker_id not in alive:
+            alive.append(worker_id)
+        shards = [
+            shard for shard in range(self.__shards)
+            if worker_id in self.preferred_workers(shard, alive)
+        ]
+        if shards != self.__own_shards.get(worker_id):
+            logger.info(
+                'Worker %s owns %d of %d shards',
+                worker_id, len(shards), self.__shards
+            )
+        self.__own_shards[worker_id] = shards
+
+    def __pop_shards(self, worker_id: str) -> List[Optional[int]]:
+        """
+        Own shards of the worker from a rotating offset, [None] without
+        shards.
+        """
+        if self.__shards == 0:
+            return [None]
+        # all shards until the first heartbeat
+        shards = self.__own_shards.get(worker_id, range(self.__shards))
+        shards = list(shards)
+        if not shards:
+            return []
+        self.__next_shard = (self.__next_shard + 1) % len(shards)
+        return shards[self.__next_shard:] + shards[:self.__next_shard]
+
+    def __steal(
+            self,
+            worker_id: str,
+            shards: List[Optional[int]],
+            lanes: List[TaskPriority]
+    ) -> Optional[bytes]:
+        others = [s for s in range(self.__shards) if s not in shards]
+        if not others:
+            return None
+        start = self.__next_shard % len(others)
+        others = others[start:] + others[:start]
+        raw = self.__pop_first(
+            keys=[self.processing_key(worker_id)] + [
+                self.pending_key(priority, shard)
+                for priority in lanes for shard in others
+            ],
+            args=self.__pop_args(worker_id, self.__steal_backlog),
+        )
+        if raw is not None:
+            stolen_tasks.inc()
+        return raw
+
+    def __lane_order(self) -> List[TaskPriority]:
+        total = sum(self.__weights.values())
+        for priority, weight in self.__weights.items():
+            self.__credits[priority] += weight
+        first = max(self.__credits, key=self.__credits.get)
+        self.__credits[first] -= total
+        rest = sorted(
+            (p for p in TaskPriority if p != first),
+            key=lambda p: -self.__weights[p]
+        )
+        return [first] + rest
+
+
+def create_task_queue(redis: Redis) -> RedisTaskQueue:
+    return RedisTaskQueue(
+        redis=redis,
+        name=get_config().queue_name,
+        visibility_timeout=get_config().queue_visibility_timeout,
+        max_attempts=get_config().queue_max_attempts,
+        heartbeat_ttl=get_config().worker_heartbeat_ttl,
+        weights=get_config().priority_weights,
+        shards=get_config().queue_shards,
+        affinity_workers=get_config().queue_affinity_workers,
+        steal_backlog=get_config().queue_steal_backlog,
+    )
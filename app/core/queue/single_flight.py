@@ -0,0 +1,198 @@
+import logging
+from typing import Optional
+
+from redis import Redis
+
+from core.config import get_config
+from core.metrics import get_registry
+from core.provider.models.enums import TaskOperation
+from core.provider.models.tasks import BaseTask, TaskStatus
+from core.queue.codec import decode_stored_task
+from core.queue.context import DEADLINE_MESSAGE, cancel_key
+from core.queue.models import TaskEnvelope
+from core.queue.task_store import set_task_unless_cancelled
+
+logger = logging.getLogger('single_flight')
+coalesced_tasks = get_registry().counter(
+    'single_flight_coalesced_total',
+    'Tasks attached to an identical running task',
+    ('provider', 'operation'),
+)
+
+# register creates a new face on every call, so it is never coalesced
+COALESCED_OPERATIONS = (
+    TaskOperation.quality,
+    TaskOperation.liveness,
+    TaskOperation.best_match,
+    TaskOperation.match,
+    TaskOperation.verify,
+)
+
+# KEYS[1]: marker, KEYS[2]: followers list; ARGV[1]: marker ttl
+# the first follower becomes the leader in one step, so a joining task
+# never sees the marker gone while followers still wait
+HAND_OVER = """
+local raw = redis.call('LPOP', KEYS[2])
+if not raw then
+    redis.call('DEL', KEYS[1])
+    return false
+end
+redis.call('SET', KEYS[1], cjson.decode(raw).task_id, 'EX', ARGV[1])
+return raw
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces identical tasks (same engine, operation, file and face).
+
+    The first task sets a marker and runs; identical tasks started while
+    the marker exists add their envelopes to the followers list and
+    return. When the leader finishes it removes the marker and copies its
+    result to every follower that is not cancelled. A cancelled leader or
+    a leader that missed its own deadline has no result for the
+    followers, so the first follower becomes the leader and runs. Works
+    across processes since all state is in Redis; the marker expires
+    after ttl seconds if the leader is lost.
+    """
+
+    def __init__(self, redis: Redis, name: str, ttl: int) -> None:
+        self.__redis = redis
+        self.__name = name
+        self.__ttl = ttl
+        self.__hand_over = redis.register_script(HAND_OVER)
+
+    def marker_key(self, task: TaskEnvelope) -> str:
+        key = (
+            f'{self.__name}:{task.engine_id}:'
+            f'{task.operation.value}:{task.file_hash}'
+        )
+        if task.face_id is not None:
+            key = f'{key}:{task.face_id}'
+        return key
+
+    def followers_key(self, task: TaskEnvelope) -> str:
+        return f'{self.marker_key(task)}:followers'
+
+    def join(self, task: TaskEnvelope) -> bool:
+        """
+        Returns True if the task has to run. Returns False if it is
+        attached to an identical running task.
+        """
+        if task.operation not in COALESCED_OPERATIONS:
+            return True
+
+        marker_key = self.marker_key(task)
+        followers_key = self.followers_key(task)
+        raw = task.json()
+        while True:
+            if self.__redis.set(
+                marker_key, task.task_id, nx=True, ex=self.__ttl
+            ):
+                return True
+            leader = self.__redis.get(marker_key)
+            if leader is not None and leader.decode() == task.task_id:
+                # requeued leader
+                return True
+
+            pipe = self.__redis.pipeline()
+            pipe.rpush(followers_key, raw)
+            pipe.expire(followers_key, self.__ttl)
+            pipe.execute()
+            if self.__redis.exists(marker_key):
+                # the leader has not finished yet and will see us
+                break
+            if self.__redis.lrem(followers_key, 1, raw) == 0:
+                # the leader has finished and taken us already
+                break
+            # the leader has finished before we joined, try to lead
+
+        logger.info(
+            'Attach task %s to %s', task.task_id,
+            leader.decode() if leader is not None else 'finished task'
+        )
+        coalesced_tasks.inc(
+            provider=task.provider, operation=task.operation.value
+        )
+        return False
+
+    def land(self, task: TaskEnvelope) -> Optional[TaskEnvelope]:
+        """
+        Copy the leader result to the followers. Returns the follower
+        that becomes the leader if the result is not shared, the caller
+        runs it next.
+        """
+        if task.operation not in COALESCED_OPERATIONS:
+            return None
+
+        marker_key = self.marker_key(task)
+        leader = self.__redis.get(marker_key)
+        if leader is not None and leader.decode() != task.task_id:
+            # the marker has expired and another task leads now
+            return None
+
+        result = self.__get_shared_result(task)
+        if result is None:
+            return self.__next_leader(task)
+
+        self.__redis.delete(marker_key)
+        pipe = self.__redis.pipeline()
+        pipe.lrange(self.followers_key(task), 0, -1)
+        pipe.delete(self.followers_key(task))
+        followers, _ = pipe.execute()
+        for raw in followers:
+            try:
+                follower = TaskEnvelope.parse_raw(raw)
+            except Exception:
+                logger.error('Drop invalid follower: %s', raw, exc_info=True)
+                continue
+            # a cancelled follower keeps its status
+            set_task_unless_cancelled(
+                self.__redis, follower.task_id, result
+            )
+        if followers:
+            logger.info(
+                'Copy result of %s to %d tasks', task.task_id, len(followers)
+            )
+        return None
+
+    def __get_shared_result(self, task: TaskEnvelope) -> Optional[BaseTask]:
+        """
+        Leader result that is valid for the followers or None.
+        """
+        if self.__redis.exists(cancel_key(task.task_id)):
+            return None
+        result = decode_stored_task(self.__redis.get(task.task_id))
+        if result is None or result.status == TaskStatus.cancelled:
+            return None
+        message = getattr(result.result, 'message', None)
+        if result.status == TaskStatus.failed and message == DEADLINE_MESSAGE:
+            return None
+        return result
+
+    def __next_leader(self, task: TaskEnvelope) -> Optional[TaskEnvelope]:
+        while True:
+            raw = self.__hand_over(
+                keys=[self.marker_key(task), self.followers_key(task)],
+                args=[self.__ttl],
+            )
+            if raw is None:
+                return None
+            try:
+                follower = TaskEnvelope.parse_raw(raw)
+            except Exception:
+                logger.error('Drop invalid follower: %s', raw, exc_info=True)
+                continue
+            logger.info(
+                'Task %s has no result to share, %s leads now',
+                task.task_id, follower.task_id
+            )
+            return follower
+
+
+def create_single_flight(redis: Redis) -> SingleFlight:
+    return SingleFlight(
+        redis=redis,
+        name=get_config().single_flight_name,
+        ttl=get_config().queue_visibility_timeout,
+    )
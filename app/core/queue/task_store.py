@@ -0,0 +1,103 @@
+from functools import lru_cache
+from typing import Callable, Optional, Union
+
+from redis import Redis
+from redis.client import Pipeline
+
+from core.config import get_config
+from core.provider.models.enums import TaskStatus
+from core.provider.models.tasks import BaseTask, Task
+from core.queue.codec import STATUSES, VERSION, decode_stored_task, encode_task
+from core.queue.context import cancel_key
+from core.queue.timings import TaskTimings, timings_key
+
+# one round trip for the cancel check, the status and the timings write
+SET_UNLESS_CANCELLED = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+if KEYS[3] then
+    redis.call('SET', KEYS[3], ARGV[3], 'EX', ARGV[2])
+end
+return 1
+"""
+# the status check and the cancel in one step, so a result written
+# between them is not overwritten
+CANCEL = """
+local raw = redis.call('GET', KEYS[1])
+-- record header: codec version, schema tag, status
+local version, _, status = string.byte(raw or '', 1, 3)
+-- records of other codec versions are missing, as for decode_stored_task
+if version ~= tonumber(ARGV[3]) then
+    return -1
+end
+if status ~= tonumber(ARGV[4]) and status ~= tonumber(ARGV[5]) then
+    return 0
+end
+redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+def set_task(
+        redis: Union[Redis, Pipeline],
+        task_id: str,
+        task: BaseTask
+) -> None:
+    redis.set(
+        name=task_id,
+        value=encode_task(task),
+        ex=get_config().redis_queue_exp,
+    )
+
+
+def set_task_unless_cancelled(
+        redis: Redis,
+        task_id: str,
+        task: BaseTask,
+        timings: Optional[TaskTimings] = None
+) -> bool:
+    """
+    Returns False if the task is cancelled and nothing was written.
+    timings are written with the task, so they are there as soon as the
+    final status is.
+    """
+    keys = [task_id, cancel_key(task_id)]
+    args = [encode_task(task), get_config().redis_queue_exp]
+    if timings is not None:
+        keys.append(timings_key(task_id))
+        args.append(timings.encode())
+    written = __get_script(redis, SET_UNLESS_CANCELLED)(keys=keys, args=args)
+    return written == 1
+
+
+def set_task_cancelled(redis: Redis, task_id: str) -> Optional[bool]:
+    """
+    Cancels a queued or started task. Returns False if the task is done
+    and None if there is no such task or its record has another codec
+    version.
+    """
+    cancelled = __get_script(redis, CANCEL)(
+        keys=[task_id, cancel_key(task_id)],
+        args=[
+            encode_task(Task(status=TaskStatus.cancelled)),
+            get_config().redis_queue_exp,
+            VERSION,
+            STATUSES.index(TaskStatus.queued),
+            STATUSES.index(TaskStatus.started),
+        ],
+    )
+    if cancelled == -1:
+        return None
+    return cancelled == 1
+
+
+def get_task(redis: Redis, task_id: str) -> Optional[BaseTask]:
+    return decode_stored_task(redis.get(name=task_id))
+
+
+@lru_cache()
+def __get_script(redis: Redis, script: str) -> Callable[..., int]:
+    return redis.register_script(script)
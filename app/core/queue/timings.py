@@ -0,0 +1,76 @@
+import struct
+import threading
+from typing import Dict, List
+
+from core.config import get_config
+from core.metrics import get_registry
+from core.provider.models.enums import TimingStage
+
+# positions are part of the stored format, append new stages
+STAGES: List[TimingStage] = [
+    TimingStage.queue_wait,
+    TimingStage.file_fetch,
+    TimingStage.provider_call,
+    TimingStage.db,
+    TimingStage.result_write,
+]
+_COUNT = struct.Struct('>B')
+_SECONDS = struct.Struct('>d')
+
+stage_seconds = get_registry().histogram(
+    'task_stage_seconds',
+    'Time spent by tasks in each stage',
+    ('provider', 'operation', 'stage'),
+)
+
+
+class TaskTimings:
+    """
+    Seconds spent by one task in each stage. Parallel calls of a stage
+    (e.g. match fan-out) are summed.
+    """
+
+    def __init__(self, **seconds: float) -> None:
+        self.__seconds: Dict[TimingStage, float] = {
+            TimingStage(stage): value for stage, value in seconds.items()
+        }
+        self.__lock = threading.Lock()
+
+    def add(self, stage: TimingStage, seconds: float) -> None:
+        with self.__lock:
+            self.__seconds[stage] = self.__seconds.get(stage, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        with self.__lock:
+            return {
+                stage.value: seconds
+                for stage, seconds in self.__seconds.items()
+            }
+
+    def encode(self) -> bytes:
+        with self.__lock:
+            values = [self.__seconds.get(stage, 0.0) for stage in STAGES]
+        return _COUNT.pack(len(values)) + b''.join(
+            _SECONDS.pack(value) for value in values
+        )
+
+    @classmethod
+    def decode(cls, raw: bytes) -> 'TaskTimings':
+        (count,) = _COUNT.unpack_from(raw)
+        timings = cls()
+        for i, stage in enumerate(STAGES[:count]):
+            (value,) = _SECONDS.unpack_from(
+                raw, _COUNT.size + i * _SECONDS.size
+            )
+            timings.add(stage, value)
+        return timings
+
+    def observe(self, provider: str, operation: str) -> None:
+        for stage, seconds in self.as_dict().items():
+            stage_seconds.observe(
+                seconds, provider=provider, operation=operation, stage=stage
+            )
+
+
+def timings_key(task_id: str) -> str:
+    return f'{get_config().timings_name}:{task_id}'
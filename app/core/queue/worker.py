@@ -0,0 +1,232 @@
+import logging
+import socket
+import threading
+import time
+import uuid
+from typing import Dict
+
+from redis import Redis
+
+from core.config import get_config
+from core.exceptions.orchestrator import QueueFullError
+from core.executors.manager import ExecutorManager, get_executor_manager
+from core.provider.manager import ProviderManager, get_provider_manager
+from core.provider.models.enums import TaskOperation
+from core.provider.models.tasks import FailedResult, Task, TaskStatus
+from core.queue.models import QueueItem
+from core.queue.redis_queue import RedisTaskQueue, create_task_queue
+from core.queue.task_store import get_task, set_task, set_task_unless_cancelled
+from core.queue.timings import TaskTimings
+from core.tracing import TracedRedis
+
+logger = logging.getLogger('worker')
+
+# a repeated engine call has another effect, e.g. a second face
+NON_IDEMPOTENT_OPERATIONS = (TaskOperation.register,)
+
+
+class Worker:
+    """
+    Pulls task envelopes from the queue and runs orchestrator functions
+    on the provider executors.
+    """
+
+    def __init__(
+            self,
+            queue: RedisTaskQueue,
+            providers: ProviderManager,
+            executors: ExecutorManager,
+            redis_tasks: Redis,
+            redis_cashe: Redis,
+            concurrency: int,
+            heartbeat_interval: int,
+            grace_period: float
+    ) -> None:
+        self.__worker_id = f'{socket.gethostname()}-{uuid.uuid4().hex[:8]}'
+        self.__queue = queue
+        self.__providers = providers
+        self.__executors = executors
+        self.__redis_tasks = redis_tasks
+        self.__redis_cashe = redis_cashe
+        self.__slots = threading.BoundedSemaphore(concurrency)
+        self.__heartbeat_interval = heartbeat_interval
+        self.__grace_period = grace_period
+        self.__stopped = threading.Event()
+        # the heartbeat renews the leases of running and draining tasks
+        self.__drained = threading.Event()
+        # submitted items by task ID
+        self.__items: Dict[str, QueueItem] = {}
+
+    @property
+    def worker_id(self) -> str:
+        return self.__worker_id
+
+    def run(self) -> None:
+        logger.info('Start worker %s', self.__worker_id)
+        self.__queue.heartbeat(self.__worker_id)
+        heartbeat = threading.Thread(
+            target=self.__heartbeat, name='heartbeat', daemon=True
+        )
+        heartbeat.start()
+
+        while not self.__stopped.is_set():
+            if not self.__slots.acquire(timeout=1):
+                continue
+            if self.__stopped.is_set():
+                self.__slots.release()
+                break
+            try:
+                item = self.__queue.pop(self.__worker_id, timeout=1)
+            except Exception:
+                logger.error('Can not pop task from queue', exc_info=True)
+                item = None
+                self.__stopped.wait(1)
+            if item is None:
+                self.__slots.release()
+                continue
+            self.__dispatch(item)
+
+        self.__drain()
+        self.__drained.set()
+        heartbeat.join()
+        self.__queue.unregister(self.__worker_id)
+        self.__providers.close()
+        logger.info('Stop worker %s', self.__worker_id)
+
+    def stop(self) -> None:
+        """
+        Stop taking tasks. Running tasks get the grace period to finish,
+        the rest go back to the queue. Started tasks of non-idempotent
+        operations fail instead, the engine may have done them already.
+        """
+        self.__stopped.set()
+
+    def __drain(self) -> None:
+        unfinished = self.__executors.drain(self.__grace_period)
+        for envelope in unfinished:
+            item = self.__items.pop(envelope.task_id, None)
+            if item is None:
+                continue
+            try:
+                if self.__is_repeatable(item):
+                    self.__queue.release(
+                        self.__worker_id, item, reset_status=True
+                    )
+                    logger.warning(
+                        'Requeue unfinished task %s', envelope.task_id
+                    )
+                else:
+                    self.__abandon(item)
+                    logger.warning(
+                        'Fail unfinished task %s', envelope.task_id
+                    )
+            except Exception:
+                logger.error(
+                    'Can not release task %s', envelope.task_id,
+                    exc_info=True
+                )
+
+    def __is_repeatable(self, item: QueueItem) -> bool:
+        if item.envelope.operation not in NON_IDEMPOTENT_OPERATIONS:
+            return True
+        # the provider call starts after the started status is set
+        task = get_task(self.__redis_tasks, item.envelope.task_id)
+        return task is None or task.status == TaskStatus.queued
+
+    def __abandon(self, item: QueueItem) -> None:
+        set_task_unless_cancelled(
+            self.__redis_tasks,
+            item.envelope.task_id,
+            Task(
+                status=TaskStatus.failed,
+                result=FailedResult(message='Service is shutting down'),
+            ),
+        )
+        self.__queue.ack(self.__worker_id, item)
+
+    def __heartbeat(self) -> None:
+        while not self.__drained.wait(self.__heartbeat_interval):
+            try:
+                self.__queue.heartbeat(
+                    self.__worker_id, list(self.__items)
+                )
+                requeued = self.__queue.requeue_stale()
+                if requeued > 0:
+                    logger.warning('Requeue %d stale tasks', requeued)
+            except Exception:
+                logger.error('Heartbeat failed', exc_info=True)
+
+    def __dispatch(self, item: QueueItem) -> None:
+        envelope = item.envelope
+        try:
+            if envelope.provider not in self.__providers.provider_names:
+                raise ValueError(f'No such provider {envelope.provider}')
+            start = time.monotonic()
+            data = self.__redis_cashe.get(name=envelope.file_hash)
+            timings = TaskTimings(file_fetch=time.monotonic() - start)
+            if data is None:
+                raise ValueError(f'No such file {envelope.file_hash}')
+        except Exception as ex:
+            logger.error('Can not start task %s: %s', envelope.task_id, ex)
+            self.__fail(item, message=str(ex))
+            return
+
+        self.__items[envelope.task_id] = item
+        try:
+            self.__executors.submit_task(
+                task=envelope,
+                provider=self.__providers.get_provider(envelope.provider),
+                data=data,
+                redis=self.__redis_tasks,
+                done=lambda: self.__done(item),
+                timings=timings,
+            )
+        except QueueFullError:
+            self.__items.pop(envelope.task_id, None)
+            self.__queue.release(self.__worker_id, item)
+            self.__slots.release()
+            self.__stopped.wait(1)
+
+    def __done(self, item: QueueItem) -> None:
+        self.__items.pop(item.envelope.task_id, None)
+        try:
+            self.__queue.ack(self.__worker_id, item)
+        finally:
+            self.__slots.release()
+
+    def __fail(self, item: QueueItem, message: str) -> None:
+        try:
+            set_task(
+                self.__redis_tasks,
+                item.envelope.task_id,
+                Task(
+                    status=TaskStatus.failed,
+                    result=FailedResult(message=message),
+                ),
+            )
+            self.__queue.ack(self.__worker_id, item)
+        finally:
+            self.__slots.release()
+
+
+def create_worker() -> Worker:
+    redis_tasks = TracedRedis(
+        host=get_config().redis_host,
+        port=get_config().redis_port,
+        db=get_config().redis_queue_db
+    )
+    redis_cashe = TracedRedis(
+        host=get_config().redis_host,
+        port=get_config().redis_port,
+        db=get_config().redis_cashe_db
+    )
+    return Worker(
+        queue=create_task_queue(redis_tasks),
+        providers=get_provider_manager(),
+        executors=get_executor_manager(),
+        redis_tasks=redis_tasks,
+        redis_cashe=redis_cashe,
+        concurrency=get_config().worker_concurrency,
+        heartbeat_interval=get_config().worker_heartbeat_interval,
+        grace_period=get_config().shutdown_grace_period,
+    )
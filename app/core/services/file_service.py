@@ -2,14 +2,13 @@ import hashlib
 import logging
 from typing import Tuple
 
-from redis import Redis
-
 from core.config import get_config
 from core.exceptions.app import AppError, InputError
 from core.provider.models.enums import FileStatus
+from core.tracing import TracedRedis
 
 logger = logging.getLogger('file_service')
-redis_cashe = Redis(
+redis_cashe = TracedRedis(
     host=get_config().redis_host,
     port=get_config().redis_port,
     db=get_config().redis_cashe_db
@@ -1,31 +1,77 @@
+import collections
+import hashlib
 import logging
-import pickle
+import struct
+import time
 import uuid
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
-from fastapi import BackgroundTasks
-from redis import Redis
 from sqlalchemy.orm import Session
 
-from core import orchestrator
+from core import tracing
+from core.cache.result_cache import create_result_cache
 from core.config import get_config
 from core.db.operations import engine as db_ops
 from core.exceptions.app import AppError, InputError
+from core.exceptions.orchestrator import PayloadBudgetError, QueueFullError
+from core.executors.budget import get_payload_budget
+from core.executors.manager import get_executor_manager
+from core.metrics import get_registry
 from core.provider.manager import get_provider_manager
-from core.provider.models.enums import TaskStatus
-from core.provider.models.tasks import BaseTask, Task
+from core.provider.models.enums import (
+    TaskBackend,
+    TaskOperation,
+    TaskPriority,
+    TaskStatus,
+)
+from core.provider.models.tasks import BaseTask, FailedResult, Task
+from core.queue.codec import (
+    CodecError,
+    UnsupportedVersionError,
+    decode_stored_task,
+    decode_updated_at,
+)
+from core.queue.context import cancel_key
+from core.queue.models import TaskEnvelope, TaskRequest
+from core.queue.redis_queue import create_task_queue
+from core.queue.task_store import (
+    set_task,
+    set_task_cancelled,
+    set_task_unless_cancelled,
+)
+from core.queue.timings import TaskTimings, timings_key
+from core.tracing import TracedRedis
 
 logger = logging.getLogger('user_service')
-redis_tasks = Redis(
+redis_tasks = TracedRedis(
     host=get_config().redis_host,
     port=get_config().redis_port, 
     db=get_config().redis_queue_db
 )
-redis_cashe = Redis(
+redis_cashe = TracedRedis(
     host=get_config().redis_host,
     port=get_config().redis_port, 
     db=get_config().redis_cashe_db
 )
+task_queue = create_task_queue(redis_tasks)
+result_cache = create_result_cache(redis_tasks)
+cache_hits = get_registry().counter(
+    'result_cache_hits_total',
+    'Tasks finished from the result cache',
+    ('provider', 'operation'),
+)
+cache_misses = get_registry().counter(
+    'result_cache_misses_total',
+    'Cacheable tasks sent to the provider',
+    ('provider', 'operation'),
+)
+precomputed_tasks = get_registry().counter(
+    'precompute_tasks_total',
+    'Speculative tasks created on file upload',
+    ('operation',),
+)
 pm = get_provider_manager()
+em = get_executor_manager()
 
 
 def get_task_result(task_id: uuid.UUID) -> BaseTask:
@@ -36,256 +82,667 @@ def get_task_result(task_id: uuid.UUID) -> BaseTask:
     except Exception:
         logger.error('Can not get result from redis.', exc_info=True)
         raise AppError('Can not get result from redis.')
-    if raw_result is None:
-        raise InputError('No such task')
+    return __decode_result(task_id, raw_result)
+
+
+def get_task_result_with_timings(
+        task_id: uuid.UUID
+) -> Tuple[BaseTask, Optional[Dict[str, float]]]:
+    """
+    Task record and seconds spent in each stage, from one MGET. Timings
+    are None until the task is finished or failed.
+    """
+    if len(str(task_id)) > 36:
+        raise InputError('invalid uuid')
+    try:
+        raw_result, raw_timings = redis_tasks.mget(
+            [str(task_id), timings_key(str(task_id))]
+        )
+    except Exception:
+        logger.error('Can not get result from redis.', exc_info=True)
+        raise AppError('Can not get result from redis.')
+    result = __decode_result(task_id, raw_result)
+
+    timings = None
+    if raw_timings is not None:
+        try:
+            timings = TaskTimings.decode(raw_timings).as_dict()
+        except struct.error:
+            logger.error('Invalid timings %s', task_id, exc_info=True)
+    return result, timings
+
 
-    result = pickle.loads(raw_result)
-    if not isinstance(result, BaseTask):
-        logger.error('Invalid result type: %s but %s', BaseTask, type(result))
+def __decode_result(
+        task_id: uuid.UUID,
+        raw_result: Optional[bytes]
+) -> BaseTask:
+    try:
+        result = decode_stored_task(raw_result)
+    except CodecError:
+        logger.error('Invalid task record %s', task_id, exc_info=True)
         raise AppError('Invalid result type')
+    if result is None:
+        raise InputError('No such task')
     return result
 
 
-def register_face(
-        sess: Session,
-        background_tasks: BackgroundTasks,
-        engine_id: uuid.UUID,
-        file_hash: str
-) -> uuid.UUID:
-    if len(str(engine_id)) > 36:
-        raise InputError('invalid uuid')
+def get_task_results(
+        task_ids: List[uuid.UUID],
+        since: Optional[float] = None
+) -> Tuple[float, Dict[uuid.UUID, Optional[BaseTask]]]:
+    """
+    Task records from one MGET. With since only the tasks updated at or
+    after that time are returned. Unknown or expired tasks map to None.
 
-    engine = db_ops.get_engine(sess=sess, engine_id=engine_id)
-    if engine is None:
-        raise InputError('No such engine')
-        
+    Returns the poll time to pass as since next time and the tasks.
+    """
+    if len(task_ids) > get_config().task_batch_size:
+        raise InputError(
+            f'Too many tasks, max {get_config().task_batch_size}'
+        )
+    task_ids = list(dict.fromkeys(task_ids))
+    if not task_ids:
+        return time.time(), {}
+
+    # taken before the read, so updates racing with it are not lost
+    now = time.time()
     try:
-        raw_file = redis_cashe.get(name=file_hash)
+        raws = redis_tasks.mget([str(task_id) for task_id in task_ids])
     except Exception:
-        logger.error('Can not get file from redis.', exc_info=True)
-        raise AppError('Can not get file from redis.')
+        logger.error('Can not get results from redis.', exc_info=True)
+        raise AppError('Can not get results from redis.')
+
+    results: Dict[uuid.UUID, Optional[BaseTask]] = {}
+    for task_id, raw in zip(task_ids, raws):
+        if raw is None:
+            results[task_id] = None
+            continue
+        try:
+            if since is not None:
+                updated_at = decode_updated_at(raw)
+                if updated_at < since:
+                    continue
+            results[task_id] = decode_stored_task(raw)
+        except UnsupportedVersionError:
+            results[task_id] = None
+        except CodecError:
+            logger.error('Invalid task record %s', task_id, exc_info=True)
+            raise AppError('Invalid result type')
+    return now, results
+
+
+def drain_tasks(grace_period: float) -> None:
+    """
+    Wait for tasks of the local backend on shutdown and fail the tasks
+    that are not done after grace_period seconds.
+    """
+    for task in em.drain(grace_period):
+        try:
+            set_task_unless_cancelled(
+                redis_tasks,
+                task.task_id,
+                Task(
+                    status=TaskStatus.failed,
+                    result=FailedResult(message='Service is shutting down'),
+                ),
+            )
+        except Exception:
+            logger.error(
+                'Can not fail task %s in redis.', task.task_id, exc_info=True
+            )
+
+
+def cancel_task(task_id: uuid.UUID) -> BaseTask:
+    if len(str(task_id)) > 36:
+        raise InputError('invalid uuid')
+    try:
+        cancelled = set_task_cancelled(redis_tasks, str(task_id))
+    except Exception:
+        logger.error('Can not cancel task in redis.', exc_info=True)
+        raise AppError('Can not cancel task in redis.')
 
-    if raw_file is None:
-        raise InputError('No such file')
-        
-    if engine.provider not in pm.provider_names:
-        raise InputError('No such provider')
+    if cancelled is None:
+        raise InputError('No such task')
+    if not cancelled:
+        raise InputError('Task is already finished')
+    return Task(status=TaskStatus.cancelled)
 
-    task_id = uuid.uuid4()
-    task_id_in_redis = str(task_id)
 
+def __submit(
+        task: TaskEnvelope,
+        data: bytes,
+        timings: Optional[TaskTimings] = None
+) -> None:
     try:
-        redis_tasks.set(
-            name=task_id_in_redis,
-            value=pickle.dumps(Task(status=TaskStatus.queued)),
-            ex=get_config().redis_queue_exp,
+        em.submit_task(
+            task=task,
+            provider=pm.get_provider(task.provider),
+            data=data,
+            redis=redis_tasks,
+            timings=timings,
+            # the caller reserves the payloads before they are fetched
+            reserved=True
         )
+    except QueueFullError:
+        __delete_task(task.task_id)
+        raise
     except Exception:
-        logger.error('Can not set task in redis.', exc_info=True)
-        raise AppError('Can not set task in redis.')
-    background_tasks.add_task(
-        orchestrator.register_face,
-        task_id=task_id_in_redis,
+        logger.error('Can not put task in queue.', exc_info=True)
+        __delete_task(task.task_id)
+        raise AppError('Can not put task in queue.')
+
+
+def __delete_task(task_id: str) -> None:
+    try:
+        redis_tasks.delete(task_id)
+    except Exception:
+        logger.error('Can not delete task from redis.', exc_info=True)
+
+
+def register_face(
+        sess: Session,
+        engine_id: uuid.UUID,
+        file_hash: str,
+        priority: TaskPriority = TaskPriority.interactive,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
+) -> uuid.UUID:
+    return __create_task(
+        sess=sess,
         engine_id=engine_id,
-        provider=pm.get_provider(engine.provider),
-        data=raw_file,
-        redis=redis_tasks,
-        sess=sess
+        file_hash=file_hash,
+        operation=TaskOperation.register,
+        priority=priority,
+        timeout=timeout,
+        idempotency_key=idempotency_key
     )
-    return task_id
 
 
 def check_face_quality(
         sess: Session,
-        background_tasks: BackgroundTasks,
         engine_id: uuid.UUID,
-        file_hash: str
+        file_hash: str,
+        priority: TaskPriority = TaskPriority.interactive,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
 ) -> uuid.UUID:
-    if len(str(engine_id)) > 36:
-        raise InputError('invalid uuid')
+    return __create_task(
+        sess=sess,
+        engine_id=engine_id,
+        file_hash=file_hash,
+        operation=TaskOperation.quality,
+        priority=priority,
+        timeout=timeout,
+        idempotency_key=idempotency_key
+    )
 
-    engine = db_ops.get_engine(sess=sess, engine_id=engine_id)
-    if engine is None:
-        raise InputError('No such engine')
 
-    try:
-        raw_file = redis_cashe.get(name=file_hash)
-    except Exception:
-        logger.error('Can not get file from redis.', exc_info=True)
-        raise AppError('Can not get file from redis.')
-        
-    if raw_file is None:
-        raise InputError('No such file')
+def check_face_anti_spoofing(
+        sess: Session,
+        engine_id: uuid.UUID,
+        file_hash: str,
+        priority: TaskPriority = TaskPriority.interactive,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
+) -> uuid.UUID:
+    return __create_task(
+        sess=sess,
+        engine_id=engine_id,
+        file_hash=file_hash,
+        operation=TaskOperation.liveness,
+        priority=priority,
+        timeout=timeout,
+        idempotency_key=idempotency_key
+    )
 
-    if engine.provider not in pm.provider_names:
-        raise InputError('No such provider')
 
-    task_id = uuid.uuid4()
-    task_id_in_redis = str(task_id)
+def best_match(
+        sess: Session,
+        engine_id: uuid.UUID,
+        file_hash: str,
+        priority: TaskPriority = TaskPriority.interactive,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
+) -> uuid.UUID:
+    return __create_task(
+        sess=sess,
+        engine_id=engine_id,
+        file_hash=file_hash,
+        operation=TaskOperation.best_match,
+        priority=priority,
+        timeout=timeout,
+        idempotency_key=idempotency_key
+    )
 
-    try:
-        redis_tasks.set(
-            name=task_id_in_redis,
-            value=pickle.dumps(Task(status=TaskStatus.queued)),
-            ex=get_config().redis_queue_exp,
-        )
-    except Exception:
-        logger.error('Can not set task in redis.', exc_info=True)
-        raise AppError('Can not set task in redis.')
 
-    background_tasks.add_task(
-        orchestrator.face_quality,
-        task_id=task_id_in_redis,
-        provider=pm.get_provider(engine.provider),
-        data=raw_file,
-        redis=redis_tasks,
+def match_with_face(
+        sess: Session,
+        engine_id: uuid.UUID,
+        file_hash: str,
+        face_id: uuid.UUID,
+        priority: TaskPriority = TaskPriority.interactive,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
+) -> uuid.UUID:
+    return __create_task(
+        sess=sess,
+        engine_id=engine_id,
+        file_hash=file_hash,
+        operation=TaskOperation.match,
+        face_id=face_id,
+        priority=priority,
+        timeout=timeout,
+        idempotency_key=idempotency_key
     )
-    return task_id
 
 
-def check_face_anti_spoofing(
+def verify_face(
         sess: Session,
-        background_tasks: BackgroundTasks,
         engine_id: uuid.UUID,
-        file_hash: str
+        file_hash: str,
+        priority: TaskPriority = TaskPriority.interactive,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
 ) -> uuid.UUID:
-    if len(str(engine_id)) > 36:
-        raise InputError('invalid uuid')
+    return __create_task(
+        sess=sess,
+        engine_id=engine_id,
+        file_hash=file_hash,
+        operation=TaskOperation.verify,
+        priority=priority,
+        timeout=timeout,
+        idempotency_key=idempotency_key
+    )
 
-    engine = db_ops.get_engine(sess=sess, engine_id=engine_id)
-    if engine is None:
-        raise InputError('No such engine')
-        
-    try:
-        raw_file = redis_cashe.get(name=file_hash)
-    except Exception:
-        logger.error('Can not get file from redis.', exc_info=True)
-        raise AppError('Can not get file from redis.')
 
-    if raw_file is None:
-        raise InputError('No such file')
-        
-    if engine.provider not in pm.provider_names:
-        raise InputError('No such provider')
+def create_tasks(
+        sess: Session,
+        tasks: List[TaskRequest],
+        idempotency_key: Optional[str] = None
+) -> List[uuid.UUID]:
+    """
+    Create tasks with one engine query, one file lookup and one status
+    pipeline. Returns task IDs in the order of tasks.
 
-    task_id = uuid.uuid4()
-    task_id_in_redis = str(task_id)
+    A repeated request with the same idempotency_key returns the task IDs
+    of the first request and creates nothing.
+    """
+    return __create_tasks(sess, tasks, idempotency_key)
 
-    try:
-        redis_tasks.set(
-            name=task_id_in_redis,
-            value=pickle.dumps(Task(status=TaskStatus.queued)),
-            ex=get_config().redis_queue_exp,
+
+def __create_tasks(
+        sess: Session,
+        tasks: List[TaskRequest],
+        idempotency_key: Optional[str] = None,
+        count_cache: bool = True
+) -> List[uuid.UUID]:
+    if len(tasks) > get_config().task_batch_size:
+        raise InputError(
+            f'Too many tasks, max {get_config().task_batch_size}'
+        )
+    fingerprint = None
+    if idempotency_key is not None:
+        fingerprint = __fingerprint(tasks)
+        task_ids = __get_idempotent_tasks(idempotency_key, fingerprint)
+        if task_ids is not None:
+            return task_ids
+
+    providers = __get_providers(sess, tasks)
+    cached = __get_cached_results(providers, tasks, count_cache)
+    queued = get_config().task_backend == TaskBackend.redis
+    sizes = __get_file_sizes(
+        {t.file_hash for t, c in zip(tasks, cached) if c is None}
+    )
+
+    envelopes = []
+    for task, provider in zip(tasks, providers):
+        envelopes.append(
+            TaskEnvelope(
+                task_id=str(uuid.uuid4()),
+                operation=task.operation,
+                engine_id=task.engine_id,
+                provider=provider,
+                file_hash=task.file_hash,
+                face_id=task.face_id,
+                priority=task.priority,
+                deadline=(
+                    None if task.timeout is None
+                    else time.time() + task.timeout
+                ),
+                created_at=time.time(),
+                traceparent=tracing.traceparent(),
+            )
+        )
+
+    task_ids = [uuid.UUID(envelope.task_id) for envelope in envelopes]
+    if idempotency_key is not None:
+        # a concurrent retry can take the key first
+        existing = __reserve_idempotency_key(
+            idempotency_key, fingerprint, task_ids
         )
+        if existing is not None:
+            return existing
+
+    try:
+        __put_tasks(envelopes, cached, sizes, queued)
+    except AppError:
+        if idempotency_key is not None:
+            __delete_idempotency_key(idempotency_key)
+        raise
+    return task_ids
+
+
+def __put_tasks(
+        envelopes: List[TaskEnvelope],
+        cached: List[Optional[BaseTask]],
+        sizes: Dict[str, int],
+        queued: bool
+) -> None:
+    pending = [e for e, r in zip(envelopes, cached) if r is None]
+    if queued:
+        __write_tasks(envelopes, cached, queued)
+        return
+
+    # admit the tasks before their files are fetched
+    __check_capacity(pending)
+    reserved = sum(sizes[file_hash] for file_hash in {
+        envelope.file_hash for envelope in pending
+    })
+    budget = get_payload_budget()
+    if not budget.reserve(reserved):
+        raise PayloadBudgetError('Payload budget is exhausted')
+    try:
+        start = time.monotonic()
+        files = __get_files(sizes)
+        file_fetch = time.monotonic() - start
+        __write_tasks(envelopes, cached, queued)
+        for i, envelope in enumerate(pending):
+            try:
+                __submit(
+                    task=envelope,
+                    data=files[envelope.file_hash],
+                    timings=TaskTimings(file_fetch=file_fetch),
+                )
+            except AppError:
+                # the client does not get the IDs of the submitted tasks
+                __cancel_tasks(pending[:i])
+                for rest in pending[i + 1:]:
+                    __delete_task(rest.task_id)
+                raise
+    finally:
+        budget.unreserve(reserved)
+
+
+def __write_tasks(
+        envelopes: List[TaskEnvelope],
+        cached: List[Optional[BaseTask]],
+        queued: bool
+) -> None:
+    # statuses and queue pushes go in one round trip
+    try:
+        pipe = redis_tasks.pipeline()
+        for envelope, result in zip(envelopes, cached):
+            set_task(
+                pipe,
+                envelope.task_id,
+                result or Task(status=TaskStatus.queued)
+            )
+            if result is None and queued:
+                task_queue.push(envelope, pipe=pipe)
+        pipe.execute()
     except Exception:
         logger.error('Can not set task in redis.', exc_info=True)
         raise AppError('Can not set task in redis.')
 
-    background_tasks.add_task(
-        orchestrator.face_liveness,
-        task_id=task_id_in_redis,
-        provider=pm.get_provider(engine.provider),
-        data=raw_file,
-        redis=redis_tasks,
-    )
-    return task_id
 
+def __check_capacity(envelopes: List[TaskEnvelope]) -> None:
+    """
+    The local backend runs tasks straight on the provider executors:
+    reject a batch that does not fit into their queues before any task
+    is written.
+    """
+    counts = collections.Counter(envelope.provider for envelope in envelopes)
+    for provider, count in counts.items():
+        queue_size = em.get_executor(provider).queue_size
+        if count > queue_size:
+            raise InputError(
+                f'Too many tasks for {provider}, max {queue_size}'
+            )
+        if count > em.free_slots(provider):
+            raise QueueFullError(f'Provider {provider} is overloaded')
+
+
+def __cancel_tasks(envelopes: List[TaskEnvelope]) -> None:
+    # tasks that have not started yet skip the provider call
+    try:
+        pipe = redis_tasks.pipeline()
+        for envelope in envelopes:
+            pipe.set(
+                name=cancel_key(envelope.task_id),
+                value=1,
+                ex=get_config().redis_queue_exp,
+            )
+            set_task(pipe, envelope.task_id, Task(status=TaskStatus.cancelled))
+        pipe.execute()
+    except Exception:
+        logger.error('Can not cancel tasks in redis.', exc_info=True)
 
-def best_match(
+
+def precompute_results(
         sess: Session,
-        background_tasks: BackgroundTasks,
         engine_id: uuid.UUID,
         file_hash: str
-) -> uuid.UUID:
-    if len(str(engine_id)) > 36:
-        raise InputError('invalid uuid')
-
-    engine = db_ops.get_engine(sess=sess, engine_id=engine_id)
-    if engine is None:
-        raise InputError('No such engine')
-        
+) -> None:
+    """
+    Start bulk quality and liveness tasks for an uploaded file, so the
+    tasks the client sends next finish from the result cache. Results
+    that are cached already are not computed again. Errors are logged,
+    the upload does not depend on them.
+    """
+    tasks = [
+        TaskRequest(
+            operation=operation,
+            engine_id=engine_id,
+            file_hash=file_hash,
+            priority=TaskPriority.bulk,
+        )
+        for operation in (TaskOperation.quality, TaskOperation.liveness)
+        if result_cache.is_cached(operation)
+    ]
+    if not tasks:
+        return
     try:
-        raw_file = redis_cashe.get(name=file_hash)
+        providers = __get_providers(sess, tasks)
+        cached = result_cache.get_many([
+            (provider, task.operation, task.file_hash)
+            for provider, task in zip(providers, tasks)
+        ])
+        tasks = [t for t, result in zip(tasks, cached) if result is None]
+        if tasks:
+            # speculative tasks are not client lookups of the cache
+            __create_tasks(sess=sess, tasks=tasks, count_cache=False)
     except Exception:
-        logger.error('Can not get file from redis.', exc_info=True)
-        raise AppError('Can not get file from redis.')
+        logger.warning(
+            'Can not precompute results of %s', file_hash, exc_info=True
+        )
+        return
+    for task in tasks:
+        precomputed_tasks.inc(operation=task.operation.value)
 
-    if raw_file is None:
-        raise InputError('No such file')
-        
-    if engine.provider not in pm.provider_names:
-        raise InputError('No such provider')
 
-    task_id = uuid.uuid4()
-    task_id_in_redis = str(task_id)
+def __idempotency_key(key: str) -> str:
+    return f'{get_config().idempotency_name}:{key}'
+
 
+def __fingerprint(tasks: List[TaskRequest]) -> str:
+    content = '\n'.join(task.json() for task in tasks)
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def __decode_idempotent_tasks(
+        raw: bytes,
+        fingerprint: str
+) -> List[uuid.UUID]:
+    # fingerprint:task_id,task_id,...
+    stored, task_ids = raw.decode('utf-8').split(':', 1)
+    if stored != fingerprint:
+        raise InputError('Idempotency-Key is used by another request')
+    return [uuid.UUID(task_id) for task_id in task_ids.split(',')]
+
+
+def __get_idempotent_tasks(
+        key: str,
+        fingerprint: str
+) -> Optional[List[uuid.UUID]]:
+    try:
+        raw = redis_tasks.get(__idempotency_key(key))
+    except Exception:
+        logger.error('Can not get idempotency key.', exc_info=True)
+        raise AppError('Can not get idempotency key.')
+    if raw is None:
+        return None
+    return __decode_idempotent_tasks(raw, fingerprint)
+
+
+def __reserve_idempotency_key(
+        key: str,
+        fingerprint: str,
+        task_ids: List[uuid.UUID]
+) -> Optional[List[uuid.UUID]]:
+    """
+    Map the key to task_ids unless it is mapped already.
+    Returns the task IDs of the existing mapping.
+    """
+    value = fingerprint + ':' + ','.join(str(t) for t in task_ids)
     try:
-        redis_tasks.set(
-            name=task_id_in_redis,
-            value=pickle.dumps(Task(status=TaskStatus.queued)),
-            ex=get_config().redis_queue_exp,
+        pipe = redis_tasks.pipeline()
+        pipe.set(
+            __idempotency_key(key),
+            value,
+            nx=True,
+            ex=get_config().idempotency_ttl,
         )
+        pipe.get(__idempotency_key(key))
+        reserved, raw = pipe.execute()
     except Exception:
-        logger.error('Can not set task in redis.', exc_info=True)
-        raise AppError('Can not set task in redis.')
+        logger.error('Can not set idempotency key.', exc_info=True)
+        raise AppError('Can not set idempotency key.')
+    if reserved or raw is None:
+        return None
+    return __decode_idempotent_tasks(raw, fingerprint)
 
-    background_tasks.add_task(
-        orchestrator.best_match,
-        task_id=task_id_in_redis,
-        provider=pm.get_provider(engine.provider),
-        data=raw_file,
-        redis=redis_tasks,
-        sess=sess
-    )
-    return task_id
 
+def __delete_idempotency_key(key: str) -> None:
+    # retries of a failed request create the tasks again
+    try:
+        redis_tasks.delete(__idempotency_key(key))
+    except Exception:
+        logger.error('Can not delete idempotency key.', exc_info=True)
 
-def match_with_face(
+
+def __create_task(
         sess: Session,
-        background_tasks: BackgroundTasks,
         engine_id: uuid.UUID,
         file_hash: str,
-        face_id: uuid.UUID
+        operation: TaskOperation,
+        face_id: Optional[uuid.UUID] = None,
+        priority: TaskPriority = TaskPriority.interactive,
+        timeout: Optional[float] = None,
+        idempotency_key: Optional[str] = None
 ) -> uuid.UUID:
     if len(str(engine_id)) > 36:
         raise InputError('invalid uuid')
 
-    engine = db_ops.get_engine(sess=sess, engine_id=engine_id)
-    if engine is None:
-        raise InputError('No such engine')
+    task = TaskRequest(
+        operation=operation,
+        engine_id=engine_id,
+        file_hash=file_hash,
+        face_id=face_id,
+        priority=priority,
+        timeout=timeout,
+    )
+    return create_tasks(
+        sess=sess, tasks=[task], idempotency_key=idempotency_key
+    )[0]
+
 
+def __get_providers(sess: Session, tasks: List[TaskRequest]) -> List[str]:
+    engine_ids = list({task.engine_id for task in tasks})
+    engines = {
+        engine.engine_id: engine.provider
+        for engine in db_ops.get_engines_by_ids(
+            sess=sess, engine_ids=engine_ids
+        )
+    }
+
+    for task in tasks:
+        if task.engine_id not in engines:
+            raise InputError('No such engine')
+        if engines[task.engine_id] not in pm.provider_names:
+            raise InputError('No such provider')
+        if task.operation == TaskOperation.match and task.face_id is None:
+            raise InputError('No face_id for match task')
+    return [engines[task.engine_id] for task in tasks]
+
+
+def __get_file_sizes(file_hashes: Set[str]) -> Dict[str, int]:
+    """
+    Check files in one round trip without fetching them.
+    """
+    file_hashes = list(file_hashes)
+    if not file_hashes:
+        return {}
     try:
-        raw_file = redis_cashe.get(name=file_hash)
+        pipe = redis_cashe.pipeline()
+        for file_hash in file_hashes:
+            pipe.exists(file_hash)
+            pipe.strlen(file_hash)
+        found = pipe.execute()
     except Exception:
         logger.error('Can not get file from redis.', exc_info=True)
         raise AppError('Can not get file from redis.')
 
-    if raw_file is None:
+    if not all(found[::2]):
         raise InputError('No such file')
+    return dict(zip(file_hashes, found[1::2]))
 
-    if engine.provider not in pm.provider_names:
-        raise InputError('No such provider')
-
-    task_id = uuid.uuid4()
-    task_id_in_redis = str(task_id)
 
+def __get_files(file_hashes: Iterable[str]) -> Dict[str, bytes]:
+    file_hashes = list(file_hashes)
+    if not file_hashes:
+        return {}
     try:
-        redis_tasks.set(
-            name=task_id_in_redis,
-            value=pickle.dumps(Task(status=TaskStatus.queued)),
-            ex=get_config().redis_queue_exp,
-        )
+        found = redis_cashe.mget(file_hashes)
     except Exception:
-        logger.error('Can not set task in redis.', exc_info=True)
-        raise AppError('Can not set task in redis.')
+        logger.error('Can not get file from redis.', exc_info=True)
+        raise AppError('Can not get file from redis.')
 
-    background_tasks.add_task(
-        orchestrator.match_with_face,
-        task_id=task_id_in_redis,
-        provider=pm.get_provider(engine.provider),
-        data=raw_file,
-        face_id=face_id,
-        redis=redis_tasks,
-        sess=sess
-    )
-    return task_id
+    # the file can expire after its size is checked
+    if any(data is None for data in found):
+        raise InputError('No such file')
+    return dict(zip(file_hashes, found))
+
+
+def __get_cached_results(
+        providers: List[str],
+        tasks: List[TaskRequest],
+        count_cache: bool = True
+) -> List[Optional[BaseTask]]:
+    keys = [
+        (provider, task.operation, task.file_hash)
+        for provider, task in zip(providers, tasks)
+    ]
+    try:
+        cached = result_cache.get_many(keys)
+    except Exception:
+        logger.error('Can not get result from cache.', exc_info=True)
+        cached = [None] * len(keys)
+
+    if not count_cache:
+        return cached
+    for (provider, operation, _), result in zip(keys, cached):
+        if not result_cache.is_cached(operation):
+            continue
+        counter = cache_hits if result is not None else cache_misses
+        counter.inc(provider=provider, operation=operation.value)
+    return cached
@@ -0,0 +1,253 @@
+"""
+Request-scoped traces. A trace starts in the API (or continues the W3C
+traceparent header of the caller), travels with the task envelope into
+the orchestrator and goes out to engines in the traceparent header.
+
+Spans are recorded only inside a trace and exported as Zipkin v2 JSON,
+one span per line, to the trace_file of the config.
+"""
+
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from redis import Redis
+from redis.client import Pipeline
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core.config import get_config
+
+HEADER = 'traceparent'
+_TRACEPARENT = re.compile(
+    r'^00-(?P<trace>[0-9a-f]{32})-(?P<span>[0-9a-f]{16})-[0-9a-f]{2}$'
+)
+
+
+class Span:
+    def __init__(
+            self,
+            name: str,
+            trace_id: str,
+            parent_id: Optional[str] = None,
+            kind: Optional[str] = None,
+            **tags: Any
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.tags = {key: str(value) for key, value in tags.items()}
+        self.__start = time.time()
+        self.__started = time.monotonic()
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def tag(self, key: str, value: Any) -> None:
+        self.tags[key] = str(value)
+
+    def finish(self) -> None:
+        get_exporter().export(self, time.monotonic() - self.__started)
+
+    def as_zipkin(self, duration: float) -> Dict[str, Any]:
+        span = {
+            'traceId': self.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': int(self.__start * 1e6),
+            'duration': max(int(duration * 1e6), 1),
+            'localEndpoint': {'serviceName': get_config().project_name},
+            'tags': self.tags,
+        }
+        if self.parent_id is not None:
+            span['parentId'] = self.parent_id
+        if self.kind is not None:
+            span['kind'] = self.kind
+        return span
+
+
+class FileExporter:
+    """
+    Appends spans to a file, one Zipkin v2 JSON span per line.
+    """
+
+    def __init__(self, path: Optional[str]) -> None:
+        self.__file = None
+        if path is not None:
+            self.__file = open(path, 'a', encoding='utf-8', buffering=1)
+        self.__lock = threading.Lock()
+
+    def export(self, span: Span, duration: float) -> None:
+        if self.__file is None:
+            return
+        line = json.dumps(span.as_zipkin(duration))
+        with self.__lock:
+            self.__file.write(line + '\n')
+
+
+@lru_cache()
+def get_exporter() -> FileExporter:
+    return FileExporter(get_config().trace_file)
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    'span', default=None
+)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def traceparent() -> Optional[str]:
+    span = _current.get()
+    return None if span is None else span.traceparent
+
+
+def headers() -> Dict[str, str]:
+    """
+    Headers that pass the current trace to an engine.
+    """
+    span = _current.get()
+    return {} if span is None else {HEADER: span.traceparent}
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Trace ID and parent span ID of a traceparent header or None.
+    """
+    match = _TRACEPARENT.match((value or '').strip().lower())
+    if match is None or set(match['trace']) == {'0'}:
+        return None
+    return match['trace'], match['span']
+
+
+@contextmanager
+def trace(
+        parent: Optional[str],
+        name: str,
+        kind: Optional[str] = None,
+        **tags: Any
+) -> Iterator[Span]:
+    """
+    Start a trace, continuing the traceparent value if it is valid.
+    """
+    ids = parse_traceparent(parent)
+    if ids is None:
+        root = Span(name, os.urandom(16).hex(), None, kind, **tags)
+    else:
+        root = Span(name, ids[0], ids[1], kind, **tags)
+    with __activate(root):
+        yield root
+
+
+@contextmanager
+def span(
+        name: str,
+        kind: Optional[str] = None,
+        **tags: Any
+) -> Iterator[Optional[Span]]:
+    """
+    Child span of the current span, nothing outside a trace.
+    """
+    child = start_span(name, kind, **tags)
+    if child is None:
+        yield None
+        return
+    with __activate(child):
+        yield child
+
+
+def start_span(
+        name: str,
+        kind: Optional[str] = None,
+        **tags: Any
+) -> Optional[Span]:
+    """
+    Child span that is not made current, finish it with Span.finish.
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(name, parent.trace_id, parent.span_id, kind, **tags)
+
+
+@contextmanager
+def __activate(current: Span) -> Iterator[None]:
+    token = _current.set(current)
+    try:
+        yield
+    except BaseException as ex:
+        current.tag('error', type(ex).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        current.finish()
+
+
+class TracedPipeline(Pipeline):
+    def execute(self, raise_on_error: bool = True) -> Any:
+        with span(
+                'redis pipeline', 'CLIENT',
+                commands=len(self.command_stack)
+        ):
+            return super().execute(raise_on_error)
+
+
+class TracedRedis(Redis):
+    """
+    Redis client that records each command and pipeline as a span.
+    """
+
+    def execute_command(self, *args: Any, **options: Any) -> Any:
+        with span(f'redis {args[0]}', 'CLIENT'):
+            return super().execute_command(*args, **options)
+
+    def pipeline(
+            self,
+            transaction: bool = True,
+            shard_hint: Any = None
+    ) -> TracedPipeline:
+        return TracedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+        )
+
+
+def trace_engine(engine: Engine) -> None:
+    """
+    Record each SQL statement of the engine as a span.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, many):
+        operation = statement.split(None, 1)[0] if statement.strip() else ''
+        context.trace_span = start_span(f'db {operation.upper()}', 'CLIENT')
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, many):
+        __finish_db_span(context)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        __finish_db_span(exception_context.execution_context, error=True)
+
+
+def __finish_db_span(context: Any, error: bool = False) -> None:
+    current = getattr(context, 'trace_span', None)
+    if current is None:
+        return
+    context.trace_span = None
+    if error:
+        current.tag('error', 'true')
+    current.finish()
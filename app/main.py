@@ -1,9 +1,15 @@
+import argparse
+import logging.config
+import signal
+
 import uvicorn
 
-from core.app import get_application
 from core.config import get_config
 
-if __name__ == '__main__':
+
+def run_api() -> None:
+    from core.app import get_application
+
     app = get_application()
     uvicorn.run(
         app,
@@ -11,3 +17,46 @@ if __name__ == '__main__':
         port=get_config().port,
         log_config=get_config().log_config
     )
+
+
+def run_host(provider: str) -> None:
+    from core.provider.host_provider import run_host
+
+    logging.config.fileConfig(get_config().log_config)
+    run_host(provider)
+
+
+def run_worker() -> None:
+    from core.queue.worker import create_worker
+
+    logging.config.fileConfig(get_config().log_config)
+    worker = create_worker()
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=get_config().project_name)
+    parser.add_argument(
+        'mode',
+        nargs='?',
+        default='api',
+        choices=['api', 'worker', 'host'],
+        help='run API server, task queue worker or provider host'
+    )
+    parser.add_argument(
+        'provider',
+        nargs='?',
+        help='provider namespace to host, e.g. providers.facenet_provider'
+    )
+    args = parser.parse_args()
+
+    if args.mode == 'worker':
+        run_worker()
+    elif args.mode == 'host':
+        if args.provider is None:
+            parser.error('host mode needs a provider namespace')
+        run_host(args.provider)
+    else:
+        run_api()
@@ -1,10 +1,18 @@
-from typing import Union
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Union
 
+import httpx
 import requests
 
-from core.config import get_config
-from core.provider.interfaces import IProvider, IProviderConfig
+from core import tracing
+from core.provider.interfaces import (
+    ENGINE_ERROR_MESSAGE,
+    SEND_FAILED_MESSAGE,
+    IProvider,
+    IProviderConfig,
+)
 from core.provider.models.tasks import (
+    BaseTask,
     FaceAntiSpoofResult,
     FaceAntiSpoofTask,
     FaceBestMatchResult,
@@ -18,210 +26,352 @@ from core.provider.models.tasks import (
     Task,
     TaskStatus,
 )
+from core.provider.replicas import ReplicaSet
+from core.queue.context import remaining_time
+
+Parser = Callable[[str, int, Dict[str, Any]], BaseTask]
 
 
 class Config(IProviderConfig):
-    base_url: str
+    # one url or urls of replicas sharing the face db
+    base_url: Union[str, List[str]]
+    # seconds per engine call
+    timeout: float = 30
+    replica_eject_failures: int = 3
+    replica_eject_ms: int = 10000
+    # latency quantile after which quality, liveness and best match
+    # requests are sent to a second replica, None - no hedging
+    hedge_quantile: Optional[float] = None
+    hedge_workers: int = 32
 
 
 class Provider(IProvider):
     def __init__(self, config: Config) -> None:
         super().__init__(config)
-        self.__base_url = config.base_url
-    
+        urls = config.base_url
+        self.__replicas = ReplicaSet(
+            name=self.name,
+            urls=[urls] if isinstance(urls, str) else urls,
+            eject_failures=config.replica_eject_failures,
+            eject_time=config.replica_eject_ms / 1000,
+            hedge_quantile=config.hedge_quantile,
+            hedge_workers=config.hedge_workers,
+        )
+        self.__timeout = config.timeout
+        self.__client: Optional[httpx.AsyncClient] = None
+        self.__client_loop: Optional[asyncio.AbstractEventLoop] = None
+
     def register(self, data: bytes) -> Union[FaceRegisterTask, Task]:
-        multipart_form_data = {
-            'data': ('image', data)
-        }
-        url = f'{self.__base_url}/register'
-        try:
-            response = requests.post(
-                url, 
-                files=multipart_form_data, 
-                timeout=get_config().redis_queue_exp
+        return self.__post('register', data, self.__register_result)
+
+    async def register_async(
+            self,
+            data: bytes
+    ) -> Union[FaceRegisterTask, Task]:
+        return await self.__post_async(
+            'register', data, self.__register_result
+        )
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        return self.__post(
+            'quality', data, self.__quality_result, hedge=True
+        )
+
+    async def quality_async(
+            self,
+            data: bytes
+    ) -> Union[FaceQualityTask, Task]:
+        return await self.__post_async(
+            'quality', data, self.__quality_result, hedge=True
+        )
+
+    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
+        return self.__post(
+            'liveness', data, self.__liveness_result, hedge=True
+        )
+
+    async def liveness_async(
+            self,
+            data: bytes
+    ) -> Union[FaceAntiSpoofTask, Task]:
+        return await self.__post_async(
+            'liveness', data, self.__liveness_result, hedge=True
+        )
+
+    def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
+        return self.__post(
+            'best_batch', data, self.__best_match_result, hedge=True
+        )
+
+    async def best_match_async(
+            self,
+            data: bytes
+    ) -> Union[FaceBestMatchTask, Task]:
+        return await self.__post_async(
+            'best_batch', data, self.__best_match_result, hedge=True
+        )
+
+    def match_with_face(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        raise NotImplementedError()
+
+    async def match_with_face_async(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return self.match_with_face(data=data, internal_id=internal_id)
+
+    def remove_face(self, internal_id: str) -> Task:
+        def send(url: str) -> requests.Response:
+            return requests.delete(
+                url,
+                params={'face_id': internal_id},
+                headers=headers,
+                timeout=self.__timeout
             )
-            content = dict(response.json())
+
+        try:
+            with tracing.span('DELETE face', 'CLIENT'):
+                headers = tracing.headers()
+                response = self.__replicas.call('face', send)
         except Exception:
-            self._log.error(f'Can not send request to {url}', exc_info=True)
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Can not send request to engie')
+            self._log.error('Can not send request to face', exc_info=True)
+            return self.__send_failed()
+
+        if response.status_code >= 500:
+            self._log.error(
+                f'Get {response.status_code} status code '
+                f'from {response.url}'
             )
-        
+            return self.__engine_error()
         if response.status_code != 200:
             self._log.error(
-                f'Get {response.status_code} status code from {url}'
+                f'Get {response.status_code} status code '
+                f'from {response.url}'
+            )
+            return self.__bad_response()
+
+        return Task(
+            status=TaskStatus.finished,
+            result=None
+        )
+
+    def close(self) -> None:
+        self.__replicas.close()
+        loop = self.__client_loop
+        if self.__client is None or loop.is_closed() or loop.is_running():
+            return
+        loop.run_until_complete(self.__client.aclose())
+        self.__client = None
+
+    def __post(
+            self,
+            path: str,
+            data: bytes,
+            parse: Parser,
+            hedge: bool = False
+    ) -> BaseTask:
+        # hedged requests run in other threads without the task context
+        timeout = remaining_time(self.__timeout)
+
+        def send(url: str) -> requests.Response:
+            return requests.post(
+                url,
+                files={'data': ('image', data)},
+                headers=headers,
+                timeout=timeout
+            )
+
+        try:
+            with tracing.span(f'POST {path}', 'CLIENT'):
+                headers = tracing.headers()
+                response = self.__replicas.call(path, send, hedge=hedge)
+        except Exception:
+            self._log.error(f'Can not send request to {path}', exc_info=True)
+            return self.__send_failed()
+        return self.__parse(
+            response.url, response.status_code, response.json, parse
+        )
+
+    async def __post_async(
+            self,
+            path: str,
+            data: bytes,
+            parse: Parser,
+            hedge: bool = False
+    ) -> BaseTask:
+        timeout = remaining_time(self.__timeout)
+
+        async def send(url: str) -> httpx.Response:
+            return await self.__get_client().post(
+                url,
+                files={'data': ('image', data)},
+                headers=headers,
+                timeout=timeout
             )
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
+
+        try:
+            with tracing.span(f'POST {path}', 'CLIENT'):
+                headers = tracing.headers()
+                response = await self.__replicas.call_async(
+                    path, send, hedge=hedge
+                )
+        except Exception:
+            self._log.error(f'Can not send request to {path}', exc_info=True)
+            return self.__send_failed()
+        return self.__parse(
+            str(response.url), response.status_code, response.json, parse
+        )
+
+    def __get_client(self) -> httpx.AsyncClient:
+        # the client is bound to the loop of the asyncio orchestrator
+        loop = asyncio.get_running_loop()
+        if self.__client is None or self.__client_loop is not loop:
+            self.__client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=None)
             )
-        
+            self.__client_loop = loop
+        return self.__client
+
+    def __parse(
+            self,
+            url: str,
+            status_code: int,
+            read: Callable[[], Any],
+            parse: Parser
+    ) -> BaseTask:
+        # 5xx is an engine failure, other responses are checked by parse
+        if status_code >= 500:
+            self._log.error(f'Get {status_code} status code from {url}')
+            return self.__engine_error()
+        try:
+            content = dict(read())
+        except Exception:
+            self._log.error(f'Get invalid response from {url}', exc_info=True)
+            return self.__bad_response()
+        return parse(url, status_code, content)
+
+    def __send_failed(self) -> Task:
+        return Task(
+            status=TaskStatus.failed,
+            result=FailedResult(message=SEND_FAILED_MESSAGE)
+        )
+
+    def __engine_error(self) -> Task:
+        return Task(
+            status=TaskStatus.failed,
+            result=FailedResult(message=ENGINE_ERROR_MESSAGE)
+        )
+
+    def __bad_response(self) -> Task:
+        return Task(
+            status=TaskStatus.failed,
+            result=FailedResult(message='Get bad response from engine')
+        )
+
+    def __register_result(
+            self,
+            url: str,
+            status_code: int,
+            content: Dict[str, Any]
+    ) -> Union[FaceRegisterTask, Task]:
+        if status_code != 200:
+            self._log.error(f'Get {status_code} status code from {url}')
+            return self.__bad_response()
+
         if 'id' not in content.keys():
             self._log.error(f'Get wrong response: {content} from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+            return self.__bad_response()
+
         user_id = content.get('id')
         if user_id is None:
             self._log.error(f'Get empty user id from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
+            return self.__bad_response()
 
         return FaceRegisterTask(
             status=TaskStatus.finished,
             result=FaceRegisterResult(face_id=f'{user_id}')
         )
 
-    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
-        multipart_form_data = {
-            'data': ('image', data)
-        }
-        url = f'{self.__base_url}/quality'
-        try:
-            response = requests.post(url, files=multipart_form_data)
-            content = dict(response.json())
-        except Exception:
-            self._log.error(
-                f'Can not send request to {url}', exc_info=True
-            )
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Can not send request to engie')
-            )
-        
-        if response.status_code != 200:
-            self._log.error(
-                f'Get {response.status_code} status code from {url}'
-            )
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+    def __quality_result(
+            self,
+            url: str,
+            status_code: int,
+            content: Dict[str, Any]
+    ) -> Union[FaceQualityTask, Task]:
+        if status_code != 200:
+            self._log.error(f'Get {status_code} status code from {url}')
+            return self.__bad_response()
+
         if 'score' not in content.keys():
             self._log.error(f'Get wrong response: {content} from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+            return self.__bad_response()
+
         quality = content.get('score')
         if quality is None:
             self._log.error(f'Get empty quality from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
+            return self.__bad_response()
 
         return FaceQualityTask(
             status=TaskStatus.finished,
             result=FaceQualityResult(score=float(quality))
         )
 
-    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
-        multipart_form_data = {
-            'data': ('image', data)
-        }
-        url = f'{self.__base_url}/liveness'
-        try:
-            response = requests.post(url, files=multipart_form_data)
-            content = dict(response.json())
-        except Exception:
-            self._log.error(
-                f'Can not send request to {url}', exc_info=True
-            )
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Can not send request to engie')
-            )
-        
-        if response.status_code != 200:
-            self._log.error(
-                f'Get {response.status_code} status code from {url}'
-            )
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+    def __liveness_result(
+            self,
+            url: str,
+            status_code: int,
+            content: Dict[str, Any]
+    ) -> Union[FaceAntiSpoofTask, Task]:
+        if status_code != 200:
+            self._log.error(f'Get {status_code} status code from {url}')
+            return self.__bad_response()
+
         if 'score' not in content.keys():
             self._log.error(f'Get wrong response: {content} from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+            return self.__bad_response()
+
         liveness = content.get('score')
         if liveness is None:
             self._log.error(f'Get empty liveness from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
+            return self.__bad_response()
 
         return FaceAntiSpoofTask(
             status=TaskStatus.finished,
             result=FaceAntiSpoofResult(score=float(liveness))
         )
 
-    def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
-        multipart_form_data = {
-            'data': ('image', data)
-        }
-        url = f'{self.__base_url}/best_batch'
-        try:
-            response = requests.post(url, files=multipart_form_data)
-            content = dict(response.json())
-        except Exception:
-            self._log.error(f'Can not send request to {url}', exc_info=True)
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Can not send request to engie')
-            )
-        
-        if response.status_code != 200:
-            self._log.error(
-                f'Get {response.status_code} status code from {url}'
-            )
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+    def __best_match_result(
+            self,
+            url: str,
+            status_code: int,
+            content: Dict[str, Any]
+    ) -> Union[FaceBestMatchTask, Task]:
+        if status_code != 200:
+            self._log.error(f'Get {status_code} status code from {url}')
+            return self.__bad_response()
+
         if 'score' not in content.keys():
             self._log.error(f'Get wrong response: {content} from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+            return self.__bad_response()
+
         if 'id' not in content.keys():
             self._log.error(f'Get wrong response: {content} from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+            return self.__bad_response()
+
         score = content.get('score')
         if score is None:
             self._log.error(f'Get empty score from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
+            return self.__bad_response()
+
         user_id = content.get('id')
         if user_id is None:
             self._log.error(f'Get empty uuid from {url}')
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
+            return self.__bad_response()
 
         return FaceBestMatchTask(
             status=TaskStatus.finished,
@@ -229,39 +379,3 @@ class Provider(IProvider):
                 face_id=f'{user_id}', score=float(score)
             )
         )
-
-    def match_with_face(
-            self, 
-            data: bytes, 
-            internal_id: str
-    ) -> Union[FaceMatchTask, Task]:
-        self._log.error('Method is not implemented')
-        return Task(
-            status=TaskStatus.failed, 
-            result=FailedResult(message='Method is not implemented')
-        )
-
-    def remove_face(self, internal_id: str) -> Task:
-        url = f'{self.__base_url}/face'
-        try:
-            response = requests.delete(url, params={'face_id': internal_id})
-        except Exception:
-            self._log.error(f'Can not send request to {url}', exc_info=True)
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Can not send request to engie')
-            )
-
-        if response.status_code != 200:
-            self._log.error(
-                f'Get {response.status_code} status code from {url}'
-            )
-            return Task(
-                status=TaskStatus.failed, 
-                result=FailedResult(message='Get bad response from engine')
-            )
-        
-        return Task(
-            status=TaskStatus.finished, 
-            result=None
-        )
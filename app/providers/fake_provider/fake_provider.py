@@ -1,6 +1,6 @@
 import uuid
 from time import sleep
-from typing import Union
+from typing import List, Union
 
 from core.provider.interfaces import IProvider, IProviderConfig
 from core.provider.models.tasks import (
@@ -48,6 +48,20 @@ class Provider(IProvider):
             result=FaceQualityResult(score=0.9)
         )
 
+    def quality_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceQualityTask, Task]]:
+        sleep(2)
+        self._log.info('face quality batch of %d', len(data))
+        return [
+            FaceQualityTask(
+                status=TaskStatus.finished,
+                result=FaceQualityResult(score=0.9)
+            )
+            for _ in data
+        ]
+
     def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
         sleep(2)
         self._log.info('face anti spoofing')
@@ -56,6 +70,20 @@ class Provider(IProvider):
             result=FaceAntiSpoofResult(score=0.9)
         )
 
+    def liveness_batch(
+            self, 
+            data: List[bytes]
+    ) -> List[Union[FaceAntiSpoofTask, Task]]:
+        sleep(2)
+        self._log.info('face anti spoofing batch of %d', len(data))
+        return [
+            FaceAntiSpoofTask(
+                status=TaskStatus.finished,
+                result=FaceAntiSpoofResult(score=0.9)
+            )
+            for _ in data
+        ]
+
     def best_match(self, data: bytes) -> Union[FaceBestMatchTask, Task]:
         sleep(2)
         if len(self.db) == 0:
@@ -75,3 +75,25 @@ def test_upload_file(client: TestClient):
     )
     assert response.status_code == 200
     assert response.json() == expected
+
+
+def test_upload_file_with_engine(client: TestClient):
+    stolman_img = open(
+        os.path.join(bin_directory, 'stolman.jpg'), 'rb'
+    ).read()
+    stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
+    expected = {
+        "file_hash": stolman_img_hash,
+        "exp": 60
+    }
+
+    multipart_form_data = {
+        'data': ('stolman.jpg', stolman_img)
+    }
+    response = client.post(
+        f'{prefix}/file',
+        files=multipart_form_data,
+        data={'engine_id': '11111111-1111-1111-1111-111111111111'}
+    )
+    assert response.status_code == 200
+    assert response.json() == expected
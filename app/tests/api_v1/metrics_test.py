@@ -0,0 +1,14 @@
+from fastapi.testclient import TestClient
+
+from core.config import get_config
+
+prefix = get_config().api_prefix
+
+
+def test_metrics(client: TestClient):
+    response = client.get(f"{prefix}/metrics")
+    assert response.status_code == 200
+    assert 'result_cache_hits_total' in response.text
+    assert 'provider_breaker_state' in response.text
+    assert 'task_stage_seconds' in response.text
+    assert 'payload_inflight_bytes' in response.text
@@ -8,3 +8,13 @@ prefix = get_config().api_prefix
 def test_ping(client: TestClient):
     response = client.get(f"{prefix}/ping")
     assert response.status_code == 200
+
+
+def test_ping_traceparent(client: TestClient):
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    response = client.get(
+        f"{prefix}/ping",
+        headers={'traceparent': f'00-{trace_id}-00f067aa0ba902b7-01'}
+    )
+    assert response.status_code == 200
+    assert response.headers['traceparent'].startswith(f'00-{trace_id}-')
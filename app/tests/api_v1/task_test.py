@@ -6,6 +6,7 @@ import uuid
 from fastapi.testclient import TestClient
 
 from core.config import get_config
+from tests.utils import wait_idle, wait_task
 
 prefix = get_config().api_prefix
 
@@ -57,12 +58,7 @@ def test_register(client: TestClient):
     assert x == response.json()['task_id']
 
     task_id = response.json()['task_id']
-    response = client.get(
-        f'{prefix}/task', 
-        params={
-            'uuid': task_id
-        }
-    )
+    response = wait_task(client, task_id)
     assert response.status_code == 200
     response = dict(response.json())
     assert response['status'] == 'finished'
@@ -105,11 +101,41 @@ def test_quality(client: TestClient):
     assert x == response.json()['task_id']
 
     task_id = response.json()['task_id']
+    response = wait_task(client, task_id)
+    assert response.status_code == 200
+    response = dict(response.json())
+    assert response['status'] == 'finished'
+    assert response['result']['score'] == 0.9
+
     response = client.get(
-        f'{prefix}/task', 
-        params={
-            'uuid': task_id
-        }
+        f'{prefix}/task',
+        params={'uuid': task_id, 'timings': 1}
+    )
+    assert response.status_code == 200
+    assert 'provider_call' in response.json()['timings']
+
+
+def test_quality_cached(client: TestClient):
+    stolman_img = open(
+        os.path.join(bin_directory, 'stolman.jpg'), 'rb'
+    ).read()
+    stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
+
+    data = {
+        'engine_id': '11111111-1111-1111-1111-111111111111',
+        'file_hash': stolman_img_hash
+    }
+
+    # test_quality has already computed the score of this file
+    response = client.post(
+        f'{prefix}/task/quality',
+        data=json.dumps(data)
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        f'{prefix}/task',
+        params={'uuid': response.json()['task_id']}
     )
     assert response.status_code == 200
     response = dict(response.json())
@@ -117,6 +143,38 @@ def test_quality(client: TestClient):
     assert response['result']['score'] == 0.9
 
 
+def test_quality_idempotency_key(client: TestClient):
+    stolman_img = open(
+        os.path.join(bin_directory, 'stolman.jpg'), 'rb'
+    ).read()
+    stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
+
+    data = {
+        'engine_id': '11111111-1111-1111-1111-111111111111',
+        'file_hash': stolman_img_hash
+    }
+    headers = {'Idempotency-Key': str(uuid.uuid4())}
+
+    task_ids = []
+    for _ in range(2):
+        response = client.post(
+            f'{prefix}/task/quality',
+            data=json.dumps(data),
+            headers=headers
+        )
+        assert response.status_code == 200
+        task_ids.append(response.json()['task_id'])
+    assert task_ids[0] == task_ids[1]
+
+    data['file_hash'] = hashlib.md5(b'another').hexdigest()
+    response = client.post(
+        f'{prefix}/task/quality',
+        data=json.dumps(data),
+        headers=headers
+    )
+    assert response.status_code == 400
+
+
 def test_anti_spoofing(client: TestClient):
     stolman_img = open(
         os.path.join(bin_directory, 'stolman.jpg'), 'rb'
@@ -152,12 +210,7 @@ def test_anti_spoofing(client: TestClient):
     assert x == response.json()['task_id']
 
     task_id = response.json()['task_id']
-    response = client.get(
-        f'{prefix}/task', 
-        params={
-            'uuid': task_id
-        }
-    )
+    response = wait_task(client, task_id)
     assert response.status_code == 200
     response = dict(response.json())
     assert response['status'] == 'finished'
@@ -199,20 +252,198 @@ def test_best_match(client: TestClient):
     assert x == response.json()['task_id']
 
     task_id = response.json()['task_id']
-    response = client.get(
-        f'{prefix}/task', 
-        params={
-            'uuid': task_id
-        }
+    response = wait_task(client, task_id)
+    assert response.status_code == 200
+    response = dict(response.json())
+    assert response['status'] == 'finished'
+    assert response['result']['score'] == 0.9
+    x = str(uuid.UUID(response['result']['face_id']))
+    assert x == response['result']['face_id']
+
+
+def test_verify(client: TestClient):
+    stolman_img = open(
+        os.path.join(bin_directory, 'stolman.jpg'), 'rb'
+    ).read()
+    stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
+
+    multipart_form_data = {
+        'data': ('stolman.jpg', stolman_img)
+    }
+    response = client.post(
+        f'{prefix}/file', 
+        files=multipart_form_data
     )
     assert response.status_code == 200
+
+    data = {
+        'engine_id': '11111111-1111-1111-1111-111111111111',
+        'file_hash': stolman_img_hash
+    }
+
+    response = client.post(
+        f'{prefix}/task/verify',
+        data=json.dumps(data)
+    )
+
+    assert response.status_code == 200
+    task_id = response.json()['task_id']
+    response = wait_task(client, task_id)
+    assert response.status_code == 200
     response = dict(response.json())
     assert response['status'] == 'finished'
+    assert response['result']['passed']
+    assert response['result']['stage'] == 'best_match'
+    assert response['result']['quality'] == 0.9
+    assert response['result']['liveness'] == 0.9
     assert response['result']['score'] == 0.9
     x = str(uuid.UUID(response['result']['face_id']))
     assert x == response['result']['face_id']
 
 
+def test_cancel(client: TestClient):
+    stolman_img = open(
+        os.path.join(bin_directory, 'stolman.jpg'), 'rb'
+    ).read()
+    stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
+
+    multipart_form_data = {
+        'data': ('stolman.jpg', stolman_img)
+    }
+    response = client.post(
+        f'{prefix}/file', 
+        files=multipart_form_data
+    )
+    assert response.status_code == 200
+
+    data = {
+        'engine_id': '11111111-1111-1111-1111-111111111111',
+        'file_hash': stolman_img_hash
+    }
+
+    response = client.post(
+        f'{prefix}/task/best_match',
+        data=json.dumps(data)
+    )
+    assert response.status_code == 200
+    task_id = response.json()['task_id']
+
+    response = client.delete(f'{prefix}/task', params={'uuid': task_id})
+    assert response.status_code == 200
+    assert response.json()['status'] == 'cancelled'
+
+    # the provider result must not overwrite the cancelled status
+    assert wait_idle()
+    response = client.get(f'{prefix}/task', params={'uuid': task_id})
+    assert response.status_code == 200
+    assert response.json()['status'] == 'cancelled'
+
+    response = client.delete(f'{prefix}/task', params={'uuid': task_id})
+    assert response.status_code == 400
+
+
+def test_batch(client: TestClient):
+    stolman_img = open(
+        os.path.join(bin_directory, 'stolman.jpg'), 'rb'
+    ).read()
+    stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
+
+    multipart_form_data = {
+        'data': ('stolman.jpg', stolman_img)
+    }
+    response = client.post(
+        f'{prefix}/file', 
+        files=multipart_form_data
+    )
+    assert response.status_code == 200
+
+    operations = ['quality', 'liveness', 'best_match']
+    data = {
+        'tasks': [
+            {
+                'operation': operation,
+                'engine_id': '11111111-1111-1111-1111-111111111111',
+                'file_hash': stolman_img_hash,
+                'priority': 'bulk'
+            }
+            for operation in operations
+        ]
+    }
+
+    response = client.post(
+        f'{prefix}/task/batch',
+        data=json.dumps(data)
+    )
+    assert response.status_code == 200
+    task_ids = response.json()['task_ids']
+    assert len(task_ids) == len(operations)
+
+    for task_id in task_ids:
+        response = wait_task(client, task_id)
+        assert response.status_code == 200
+        response = dict(response.json())
+        assert response['status'] == 'finished'
+        assert response['result']['score'] == 0.9
+
+    data['tasks'][0]['file_hash'] = 'no_such_file'
+    response = client.post(
+        f'{prefix}/task/batch',
+        data=json.dumps(data)
+    )
+    assert response.status_code == 400
+
+
+def test_tasks(client: TestClient):
+    stolman_img = open(
+        os.path.join(bin_directory, 'stolman.jpg'), 'rb'
+    ).read()
+    stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
+
+    multipart_form_data = {
+        'data': ('stolman.jpg', stolman_img)
+    }
+    response = client.post(
+        f'{prefix}/file', 
+        files=multipart_form_data
+    )
+    assert response.status_code == 200
+
+    data = {
+        'engine_id': '11111111-1111-1111-1111-111111111111',
+        'file_hash': stolman_img_hash
+    }
+    response = client.post(
+        f'{prefix}/task/quality',
+        data=json.dumps(data)
+    )
+    assert response.status_code == 200
+    task_id = response.json()['task_id']
+    response = wait_task(client, task_id)
+    assert response.status_code == 200
+
+    missing_id = '00000000-0000-0000-0000-000000000000'
+    response = client.get(
+        f'{prefix}/tasks',
+        params={'uuid': [task_id, missing_id]}
+    )
+    assert response.status_code == 200
+    response = dict(response.json())
+    assert response['tasks'][task_id]['status'] == 'finished'
+    assert response['missing'] == [missing_id]
+
+    # the task has not changed since the previous poll
+    data = {
+        'task_ids': [task_id],
+        'since': response['time']
+    }
+    response = client.post(
+        f'{prefix}/tasks',
+        data=json.dumps(data)
+    )
+    assert response.status_code == 200
+    assert response.json()['tasks'] == {}
+
+
 def test_match(client: TestClient):
     stolman_img = open(os.path.join(bin_directory, 'stolman.jpg'), 'rb').read()
     stolman_img_hash = hashlib.md5(stolman_img).hexdigest()
@@ -246,12 +477,7 @@ def test_match(client: TestClient):
     assert x == response.json()['task_id']
 
     task_id = response.json()['task_id']
-    response = client.get(
-        f'{prefix}/task', 
-        params={
-            'uuid': task_id
-        }
-    )
+    response = wait_task(client, task_id)
     assert response.status_code == 200
     response = dict(response.json())
     assert response['status'] == 'finished'
@@ -293,12 +519,7 @@ def test_match(client: TestClient):
     assert x == response.json()['task_id']
 
     task_id = response.json()['task_id']
-    response = client.get(
-        f'{prefix}/task', 
-        params={
-            'uuid': task_id
-        }
-    )
+    response = wait_task(client, task_id)
     assert response.status_code == 200
     response = dict(response.json())
     assert response['status'] == 'finished'
@@ -0,0 +1,220 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Generator, List
+
+import pytest
+from redis import Redis
+
+from core import tracing
+from core.exceptions.orchestrator import DeadlineExceededError
+from core.provider.batching_provider import BatchingProvider, MicroBatcher
+from core.provider.guarded_provider import GuardedProvider
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.tasks import (
+    FaceQualityResult,
+    FaceQualityTask,
+    TaskStatus,
+)
+from core.queue.context import TaskContext, task_context
+from core.queue.timings import TaskTimings
+
+
+def quality(data: bytes) -> FaceQualityTask:
+    return FaceQualityTask(
+        status=TaskStatus.finished,
+        result=FaceQualityResult(score=len(data)),
+    )
+
+
+class Batches:
+    """
+    Batch call that records the batches and answers with the item sizes.
+    """
+
+    def __init__(self) -> None:
+        self.batches: List[List[bytes]] = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, data: List[bytes]) -> List[FaceQualityTask]:
+        self.batches.append(data)
+        assert self.release.wait(10)
+        return [quality(item) for item in data]
+
+
+@pytest.fixture
+def flusher() -> Generator[ThreadPoolExecutor, Any, None]:
+    flusher = ThreadPoolExecutor(max_workers=1)
+    yield flusher
+    flusher.shutdown(wait=True)
+
+
+def test_flush_full_batch(flusher: ThreadPoolExecutor):
+    call = Batches()
+    batcher = MicroBatcher('test', call, 3, 60, flusher)
+
+    futures = [batcher.submit(b'x' * size) for size in range(1, 4)]
+
+    # a full batch does not wait max_wait
+    scores = [future.result(10).result.score for future in futures]
+    assert scores == [1, 2, 3]
+    assert call.batches == [[b'x', b'xx', b'xxx']]
+    batcher.close()
+
+
+def test_flush_after_max_wait(flusher: ThreadPoolExecutor):
+    call = Batches()
+    batcher = MicroBatcher('test', call, 10, 0.05, flusher)
+
+    started = time.monotonic()
+    futures = [batcher.submit(b'x'), batcher.submit(b'yy')]
+
+    assert [future.result(10).result.score for future in futures] == [1, 2]
+    assert time.monotonic() - started >= 0.05
+    assert call.batches == [[b'x', b'yy']]
+    batcher.close()
+
+
+def test_batch_error_fails_all_items(flusher: ThreadPoolExecutor):
+    def fail(data: List[bytes]) -> List[FaceQualityTask]:
+        raise ConnectionError('engine is down')
+
+    batcher = MicroBatcher('test', fail, 2, 60, flusher)
+    futures = [batcher.submit(b'x'), batcher.submit(b'y')]
+
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result(10)
+    batcher.close()
+
+
+def test_missing_results_fail_all_items(flusher: ThreadPoolExecutor):
+    batcher = MicroBatcher(
+        'test', lambda data: [quality(data[0])], 2, 60, flusher
+    )
+    futures = [batcher.submit(b'x'), batcher.submit(b'y')]
+
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(10)
+    batcher.close()
+
+
+def test_close_flushes_pending_items(flusher: ThreadPoolExecutor):
+    call = Batches()
+    batcher = MicroBatcher('test', call, 10, 60, flusher)
+    future = batcher.submit(b'x')
+
+    batcher.close()
+    assert future.result(10).result.score == 1
+    with pytest.raises(RuntimeError):
+        batcher.submit(b'y')
+
+
+class BatchProvider(IProvider):
+    def __init__(self, **params: Any) -> None:
+        super().__init__(IProviderConfig(
+            engine_type='facenet',
+            version={'major': 1, 'minor': 0, 'path': 0},
+            description='batching provider test',
+            quality_threshold=0.5,
+            anti_spoofing_threshold=0.5,
+            build='test',
+            orchestrator={'orchestrator_type': 'thread', 'params': params},
+        ))
+        self.call = Batches()
+
+    def quality_batch(self, data: List[bytes]) -> List[FaceQualityTask]:
+        return self.call(data)
+
+
+@pytest.fixture
+def provider() -> Generator[BatchProvider, Any, None]:
+    provider = BatchProvider(batch_size=4, batch_wait_ms=60000)
+    yield provider
+    provider.call.release.set()
+
+
+def context(redis: Redis, prefix: str, seconds: float) -> TaskContext:
+    return TaskContext(
+        f'{prefix}:task', time.time() + seconds, redis, TaskTimings()
+    )
+
+
+def test_missed_deadline(redis: Redis, prefix: str, provider: BatchProvider):
+    batching = BatchingProvider(provider)
+
+    with task_context(context(redis, prefix, 0.1)):
+        with pytest.raises(DeadlineExceededError):
+            batching.quality(b'x')
+
+    # the cancelled item is not sent to the engine
+    batching.close()
+    assert provider.call.batches == []
+
+
+def test_missed_deadline_async(
+        redis: Redis,
+        prefix: str,
+        provider: BatchProvider
+):
+    batching = BatchingProvider(provider)
+
+    async def call() -> None:
+        with task_context(context(redis, prefix, 0.1)):
+            await batching.quality_async(b'x')
+
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(call())
+    batching.close()
+    assert provider.call.batches == []
+
+
+class Spans:
+    def __init__(self) -> None:
+        self.spans: List[Dict[str, Any]] = []
+
+    def export(self, span: tracing.Span, duration: float) -> None:
+        self.spans.append(span.as_zipkin(duration))
+
+
+def test_item_timings_and_spans(
+        redis: Redis,
+        prefix: str,
+        monkeypatch
+):
+    spans = Spans()
+    monkeypatch.setattr(tracing, 'get_exporter', lambda: spans)
+    provider = GuardedProvider(BatchingProvider(
+        BatchProvider(batch_size=2, batch_wait_ms=60000)
+    ))
+    contexts = [context(redis, f'{prefix}:{number}', 60) for number in (0, 1)]
+    results = {}
+
+    def call(number: int) -> None:
+        with task_context(contexts[number]):
+            with tracing.trace(None, f'task {number}') as root:
+                results[number] = (root, provider.quality(b'x' * number))
+
+    threads = [
+        threading.Thread(target=call, args=(number,)) for number in (0, 1)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    provider.close()
+
+    for number in (0, 1):
+        root, result = results[number]
+        assert result.result.score == number
+        # each caller records the shared batch call for its own task
+        assert 'provider_call' in contexts[number].timings.as_dict()
+        batch, = [
+            span for span in spans.spans
+            if span.get('parentId') == root.span_id
+        ]
+        assert batch['name'] == 'batch quality'
+        assert batch['tags'] == {'batch_size': '2'}
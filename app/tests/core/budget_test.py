@@ -0,0 +1,73 @@
+from core.executors.budget import PayloadBudget
+
+
+def test_reject_over_limit():
+    budget = PayloadBudget(limit=10)
+    first, second = b'x' * 6, b'y' * 6
+
+    assert budget.acquire(first)
+    assert not budget.acquire(second)
+    assert budget.used == 6
+
+    budget.release(first)
+    assert budget.acquire(second)
+    assert budget.used == 6
+
+
+def test_shared_buffer_counted_once():
+    budget = PayloadBudget(limit=10)
+    data = b'x' * 6
+
+    assert budget.acquire(data)
+    assert budget.acquire(data)
+    assert budget.used == 6
+
+    budget.release(data)
+    assert budget.used == 6
+    budget.release(data)
+    assert budget.used == 0
+
+
+def test_equal_bytes_are_different_buffers():
+    budget = PayloadBudget(limit=10)
+    first, second = bytes(bytearray(6)), bytes(bytearray(6))
+
+    assert budget.acquire(first)
+    assert not budget.acquire(second)
+
+
+def test_large_payload_alone():
+    budget = PayloadBudget(limit=10)
+    large, small = b'x' * 20, b'y'
+
+    assert budget.acquire(large)
+    assert not budget.acquire(small)
+    budget.release(large)
+
+    assert budget.acquire(small)
+    assert not budget.acquire(large)
+
+
+def test_no_limit():
+    budget = PayloadBudget(limit=0)
+    payloads = [bytes([number]) * 1000 for number in range(5)]
+
+    for data in payloads:
+        assert budget.acquire(data)
+    assert budget.used == 5000
+
+
+def test_reserve():
+    budget = PayloadBudget(limit=10)
+    data = b'x' * 6
+
+    assert budget.reserve(6)
+    assert not budget.reserve(6)
+    # the reserved buffer skips the budget check
+    assert not budget.acquire(data)
+    assert budget.acquire(data, reserved=True)
+    budget.unreserve(6)
+    assert budget.used == 6
+
+    budget.release(data)
+    assert budget.used == 0
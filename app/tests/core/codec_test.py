@@ -0,0 +1,180 @@
+import pickle
+import struct
+import uuid
+
+import pytest
+
+from core.provider.models.enums import TaskStatus, VerifyStage
+from core.provider.models.tasks import (
+    FaceAntiSpoofResult,
+    FaceAntiSpoofTask,
+    FaceBestMatchResult,
+    FaceBestMatchTask,
+    FaceMatchResult,
+    FaceMatchTask,
+    FaceQualityResult,
+    FaceQualityTask,
+    FaceRegisterResult,
+    FaceRegisterTask,
+    FaceVerifyResult,
+    FaceVerifyTask,
+    FailedResult,
+    Task,
+)
+from core.queue.codec import (
+    SCHEMAS,
+    CodecError,
+    UnsupportedVersionError,
+    decode_stored_task,
+    decode_task,
+    decode_updated_at,
+    encode_task,
+)
+
+FACE_ID = str(uuid.uuid4())
+TASKS = [
+    Task(status=TaskStatus.queued),
+    Task(
+        status=TaskStatus.failed,
+        result=FailedResult(message='Face not found: ошибка'),
+    ),
+    FaceRegisterTask(
+        status=TaskStatus.finished,
+        result=FaceRegisterResult(face_id=FACE_ID),
+    ),
+    FaceQualityTask(
+        status=TaskStatus.finished,
+        result=FaceQualityResult(score=0.75),
+    ),
+    FaceAntiSpoofTask(
+        status=TaskStatus.finished,
+        result=FaceAntiSpoofResult(score=0.125),
+    ),
+    FaceBestMatchTask(
+        status=TaskStatus.finished,
+        result=FaceBestMatchResult(score=0.5, face_id=FACE_ID),
+    ),
+    FaceMatchTask(
+        status=TaskStatus.finished,
+        result=FaceMatchResult(score=0.25),
+    ),
+    FaceVerifyTask(
+        status=TaskStatus.finished,
+        result=FaceVerifyResult(
+            passed=False,
+            stage=VerifyStage.quality,
+            quality=0.1,
+        ),
+    ),
+    FaceVerifyTask(
+        status=TaskStatus.finished,
+        result=FaceVerifyResult(
+            passed=True,
+            stage=VerifyStage.best_match,
+            quality=0.9,
+            liveness=0.8,
+            face_id=FACE_ID,
+            score=0.7,
+        ),
+    ),
+]
+
+
+def test_tasks_cover_schemas():
+    assert {type(task) for task in TASKS} == {
+        task_class for task_class, _, _ in SCHEMAS
+    }
+
+
+@pytest.mark.parametrize(
+    'task', TASKS, ids=[type(task).__name__ for task in TASKS]
+)
+def test_round_trip(task):
+    raw = encode_task(task, updated_at=1234.5)
+    decoded = decode_task(raw)
+
+    assert type(decoded) is type(task)
+    assert decoded.dict() == task.dict()
+    assert decode_updated_at(raw) == 1234.5
+
+
+def test_updated_at_defaults_to_now():
+    raw = encode_task(Task(status=TaskStatus.started))
+
+    assert decode_updated_at(raw) > 0
+
+
+def test_encode_unknown_class():
+    class OtherTask(Task):
+        pass
+
+    with pytest.raises(CodecError):
+        encode_task(OtherTask(status=TaskStatus.queued))
+
+
+@pytest.mark.parametrize('raw', [
+    b'',
+    b'\x01',
+    b'\x01\x00\x00',
+    encode_task(TASKS[2])[:-1],
+    encode_task(TASKS[5])[:-3],
+], ids=['empty', 'version', 'header', 'string', 'field'])
+def test_decode_truncated(raw):
+    with pytest.raises(CodecError, match='Truncated'):
+        decode_task(raw)
+
+
+def test_decode_trailing_bytes():
+    raw = encode_task(TASKS[3]) + b'\x00'
+
+    with pytest.raises(CodecError, match='Unexpected bytes'):
+        decode_task(raw)
+
+
+def test_decode_unknown_version():
+    raw = encode_task(TASKS[0])
+
+    with pytest.raises(CodecError, match='version'):
+        decode_task(b'\x02' + raw[1:])
+    with pytest.raises(CodecError, match='version'):
+        decode_updated_at(b'\x02' + raw[1:])
+
+
+def test_legacy_record_is_missing():
+    # records pickled before the codec are never unpickled
+    raw = pickle.dumps(TASKS[3])
+
+    with pytest.raises(UnsupportedVersionError):
+        decode_task(raw)
+    assert decode_stored_task(raw) is None
+    assert decode_stored_task(None) is None
+    assert decode_stored_task(encode_task(TASKS[3])).dict() == TASKS[3].dict()
+
+
+def test_decode_unknown_tag():
+    raw = encode_task(TASKS[0])
+
+    with pytest.raises(CodecError, match='schema tag'):
+        decode_task(raw[:1] + bytes([len(SCHEMAS)]) + raw[2:])
+
+
+def test_decode_unknown_status():
+    raw = encode_task(TASKS[0])
+
+    with pytest.raises(CodecError, match='task status'):
+        decode_task(raw[:2] + b'\xff' + raw[3:])
+
+
+def test_decode_unknown_stage():
+    raw = bytearray(encode_task(TASKS[7]))
+    raw[struct.calcsize('>BBBd') + 1] = 0xff
+
+    with pytest.raises(CodecError, match='verify stage'):
+        decode_task(bytes(raw))
+
+
+def test_decode_invalid_utf8():
+    raw = encode_task(TASKS[2])
+
+    with pytest.raises(CodecError, match='Invalid string'):
+        decode_task(raw[:-1] + b'\xff')
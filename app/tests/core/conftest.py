@@ -0,0 +1,96 @@
+import threading
+import uuid
+from typing import Any, Callable, Generator
+
+import pytest
+from redis import Redis
+
+from core.config import get_config
+from core.provider.models.enums import OrchestratorType, TaskOperation
+from core.provider.models.tasks import (
+    FaceQualityResult,
+    FaceQualityTask,
+    TaskStatus,
+)
+from core.queue.models import TaskEnvelope
+
+
+@pytest.fixture
+def redis() -> Generator[Redis, Any, None]:
+    redis = Redis(
+        host=get_config().redis_host,
+        port=get_config().redis_port,
+        db=get_config().redis_queue_db
+    )
+    yield redis
+    redis.close()
+
+
+@pytest.fixture
+def prefix(redis: Redis) -> Generator[str, Any, None]:
+    """
+    Unique key prefix, keys with it are removed after the test.
+    """
+    prefix = f'test-{uuid.uuid4().hex}'
+    yield prefix
+    keys = redis.keys(f'*{prefix}*')
+    if keys:
+        redis.delete(*keys)
+
+
+@pytest.fixture
+def engine_id() -> uuid.UUID:
+    return uuid.UUID('11111111-1111-1111-1111-111111111111')
+
+
+@pytest.fixture
+def create_envelope(
+        prefix: str,
+        engine_id: uuid.UUID
+) -> Callable[..., TaskEnvelope]:
+    """
+    Factory of quality tasks of the fake provider, keyword arguments
+    replace the fields.
+    """
+    def create(number: int = 0, **kwargs) -> TaskEnvelope:
+        fields = dict(
+            task_id=f'{prefix}:task:{number}',
+            operation=TaskOperation.quality,
+            engine_id=engine_id,
+            provider='fake',
+            file_hash=f'{prefix}:file',
+        )
+        fields.update(kwargs)
+        return TaskEnvelope(**fields)
+
+    return create
+
+
+class BlockingProvider:
+    """
+    Fake provider, quality calls wait until release is set.
+    """
+
+    name = 'fake'
+    orchestrator_type = OrchestratorType.thread
+    params = {'max_workers': 1, 'queue_size': 2}
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def quality(self, data: bytes) -> FaceQualityTask:
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(10)
+        return FaceQualityTask(
+            status=TaskStatus.finished, result=FaceQualityResult(score=0.9)
+        )
+
+
+@pytest.fixture
+def blocking_provider() -> Generator[BlockingProvider, Any, None]:
+    provider = BlockingProvider()
+    yield provider
+    provider.release.set()
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+import uuid
+from typing import Union
+
+import pytest
+from redis import Redis
+
+from core.exceptions.orchestrator import QueueFullError
+from core.executors.event_loop import AsyncioExecutor
+from core.executors.manager import ExecutorManager
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.enums import TaskOperation
+from core.provider.models.tasks import (
+    FaceQualityResult,
+    FaceQualityTask,
+    Task,
+    TaskStatus,
+)
+from core.queue.context import remaining_time
+from core.queue.models import TaskEnvelope
+from core.queue.task_store import get_task
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_jobs_run_on_max_workers():
+    executor = AsyncioExecutor(name='test-async', max_workers=2, queue_size=8)
+    running = []
+    peak = []
+    done = threading.Semaphore(0)
+
+    async def job() -> None:
+        running.append(True)
+        peak.append(len(running))
+        await asyncio.sleep(0.05)
+        running.pop()
+        done.release()
+
+    for _ in range(6):
+        executor.submit(job)
+    for _ in range(6):
+        assert done.acquire(timeout=10)
+    executor.shutdown()
+
+    assert max(peak) == 2
+    assert executor.running == 0
+
+
+def test_failed_job_frees_its_slot():
+    executor = AsyncioExecutor(name='test-fail', max_workers=1, queue_size=8)
+    done = threading.Event()
+
+    async def fail() -> None:
+        raise ValueError('job failed')
+
+    async def job() -> None:
+        done.set()
+
+    executor.submit(fail)
+    executor.submit(job)
+
+    assert done.wait(10)
+    executor.shutdown()
+
+
+def test_queue_full():
+    executor = AsyncioExecutor(name='test-full', max_workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def job() -> None:
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+
+    executor.submit(job)
+    assert wait_for(lambda: executor.running == 1)
+    executor.submit(job)
+
+    with pytest.raises(QueueFullError):
+        executor.submit(job)
+    assert executor.pending == 1
+    release.set()
+    executor.shutdown()
+
+
+def test_shutdown():
+    executor = AsyncioExecutor(name='test-stop', max_workers=1, queue_size=8)
+    executor.shutdown()
+
+    assert not executor.loop.is_running()
+    with pytest.raises(QueueFullError):
+        executor.submit(asyncio.sleep)
+
+
+config = IProviderConfig(
+    engine_type='facenet',
+    version={'major': 1, 'minor': 0, 'path': 0},
+    description='event loop executor test',
+    quality_threshold=0.5,
+    anti_spoofing_threshold=0.5,
+    build='test',
+    orchestrator={'orchestrator_type': 'asyncio', 'params': {}},
+)
+
+
+class SyncProvider(IProvider):
+    """
+    Has only sync calls, the async ones run them through _run_sync.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(config)
+        self.threads = []
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        self.threads.append(threading.current_thread().name)
+        # the task deadline is visible in the executor thread
+        return FaceQualityTask(
+            status=TaskStatus.finished,
+            result=FaceQualityResult(score=remaining_time() or 0),
+        )
+
+
+def test_sync_provider_on_event_loop(redis: Redis, prefix: str):
+    provider = SyncProvider()
+    manager = ExecutorManager([provider])
+    assert manager.get_executor(provider.name).is_async
+    task = TaskEnvelope(
+        task_id=f'{prefix}:task',
+        operation=TaskOperation.quality,
+        engine_id=uuid.uuid4(),
+        provider=provider.name,
+        file_hash=prefix,
+        deadline=time.time() + 60,
+    )
+
+    manager.submit_task(
+        task=task, provider=provider, data=b'data', redis=redis
+    )
+    assert manager.drain(10) == []
+
+    result = get_task(redis, task.task_id)
+    assert result.status == TaskStatus.finished
+    assert 0 < result.result.score <= 60
+    # the sync call did not block the loop thread
+    assert provider.threads and not provider.threads[0].endswith('-loop')
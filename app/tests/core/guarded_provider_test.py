@@ -0,0 +1,206 @@
+import threading
+import time
+from typing import Any, Dict, Optional, Union
+
+import pytest
+
+from core.provider.guarded_provider import (
+    BreakerState,
+    CircuitBreaker,
+    GuardedProvider,
+)
+from core.provider.interfaces import (
+    ENGINE_ERROR_MESSAGE,
+    SEND_FAILED_MESSAGE,
+    IProvider,
+    IProviderConfig,
+)
+from core.provider.models.tasks import (
+    FaceQualityResult,
+    FaceQualityTask,
+    FailedResult,
+    Task,
+    TaskStatus,
+)
+
+OPEN_TIME = 0.05
+
+
+def create_config(params: Optional[Dict[str, Any]]) -> IProviderConfig:
+    return IProviderConfig(
+        engine_type='facenet',
+        version={'major': 1, 'minor': 0, 'path': 0},
+        description='guarded provider test',
+        quality_threshold=0.5,
+        anti_spoofing_threshold=0.5,
+        build='test',
+        orchestrator={'orchestrator_type': 'thread', 'params': params},
+    )
+
+
+class FakeProvider(IProvider):
+    def __init__(self, **params) -> None:
+        super().__init__(create_config(params))
+        self.calls = 0
+        self.failing = False
+        # message of the failed results
+        self.message = ENGINE_ERROR_MESSAGE
+        self.error: Optional[Exception] = None
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(10)
+        if self.error is not None:
+            raise self.error
+        if self.failing:
+            return Task(
+                status=TaskStatus.failed,
+                result=FailedResult(message=self.message),
+            )
+        return FaceQualityTask(
+            status=TaskStatus.finished,
+            result=FaceQualityResult(score=0.9),
+        )
+
+
+def create_breaker(max_failures: int = 2) -> CircuitBreaker:
+    return CircuitBreaker('test', max_failures, OPEN_TIME, trial_calls=1)
+
+
+def fail(breaker: CircuitBreaker, times: int) -> None:
+    for _ in range(times):
+        assert breaker.acquire()
+        breaker.release(success=False)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = create_breaker()
+    fail(breaker, 1)
+    assert breaker.acquire()
+    breaker.release(success=True)
+    fail(breaker, 1)
+    assert breaker.state == BreakerState.closed
+
+    fail(breaker, 1)
+    assert breaker.state == BreakerState.open
+    assert not breaker.acquire()
+
+
+def test_breaker_half_open_trial_closes():
+    breaker = create_breaker()
+    fail(breaker, 2)
+    time.sleep(OPEN_TIME * 2)
+
+    assert breaker.acquire()
+    assert breaker.state == BreakerState.half_open
+    # one trial call at a time
+    assert not breaker.acquire()
+    breaker.release(success=True)
+
+    assert breaker.state == BreakerState.closed
+    assert breaker.acquire()
+    assert breaker.acquire()
+
+
+def test_breaker_half_open_failure_opens():
+    breaker = create_breaker()
+    fail(breaker, 2)
+    time.sleep(OPEN_TIME * 2)
+
+    assert breaker.acquire()
+    breaker.release(success=False)
+
+    assert breaker.state == BreakerState.open
+    assert not breaker.acquire()
+
+
+def test_breaker_ignores_late_failures_while_open():
+    breaker = create_breaker()
+    # calls started before the breaker opened
+    assert breaker.acquire()
+    assert breaker.acquire()
+    fail(breaker, 2)
+    breaker.release(success=False)
+    breaker.release(success=True)
+
+    assert breaker.state == BreakerState.open
+
+
+@pytest.mark.parametrize(
+    'message', [ENGINE_ERROR_MESSAGE, SEND_FAILED_MESSAGE]
+)
+def test_guarded_provider_rejects_when_open(message: str):
+    provider = FakeProvider(breaker_failures=2, breaker_open_ms=60000)
+    provider.failing = True
+    provider.message = message
+    guarded = GuardedProvider(provider)
+    for _ in range(2):
+        assert guarded.quality(b'data').result.message == message
+
+    result = guarded.quality(b'data')
+
+    assert result.status == TaskStatus.failed
+    assert result.result.message == 'Engine is unavailable'
+    assert provider.calls == 2
+
+
+def test_guarded_provider_exceptions_are_failures():
+    provider = FakeProvider(breaker_failures=2, breaker_open_ms=60000)
+    provider.error = ConnectionError('engine is down')
+    guarded = GuardedProvider(provider)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            guarded.quality(b'data')
+
+    assert guarded.breaker.state == BreakerState.open
+
+
+def test_guarded_provider_client_failures_are_not_failures():
+    provider = FakeProvider(breaker_failures=2, breaker_open_ms=60000)
+    provider.failing = True
+    # e.g. the engine answers 400 to an image without a face
+    provider.message = 'Get bad response from engine'
+    guarded = GuardedProvider(provider)
+    for _ in range(5):
+        result = guarded.quality(b'data')
+        assert result.result.message == 'Get bad response from engine'
+
+    assert provider.calls == 5
+    assert guarded.breaker.state == BreakerState.closed
+
+
+def test_guarded_provider_not_implemented_is_not_failure():
+    provider = FakeProvider(breaker_failures=1)
+    guarded = GuardedProvider(provider)
+    with pytest.raises(NotImplementedError):
+        guarded.register(b'data')
+
+    assert guarded.breaker.state == BreakerState.closed
+
+
+def test_limiter_rejects_over_max_outstanding():
+    provider = FakeProvider(max_outstanding=1, breaker_failures=0)
+    provider.release.clear()
+    guarded = GuardedProvider(provider)
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(guarded.quality(b'data'))
+    )
+    thread.start()
+    assert provider.started.wait(10)
+
+    rejected = guarded.quality(b'data')
+    provider.release.set()
+    thread.join(10)
+
+    assert rejected.status == TaskStatus.failed
+    assert rejected.result.message == 'Engine is overloaded'
+    assert results[0].status == TaskStatus.finished
+    assert provider.calls == 1
+    # the slot is free again
+    assert guarded.quality(b'data').status == TaskStatus.finished
+    assert guarded.breaker is None
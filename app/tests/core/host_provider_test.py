@@ -0,0 +1,179 @@
+import os
+import socket
+import threading
+from typing import Any, Generator, List, Optional, Union
+
+import pytest
+
+from core.exceptions.provider import ProviderError
+from core.provider import host_provider
+from core.provider.host_provider import _REQUEST, HostProvider, _HostServer
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.tasks import (
+    FaceMatchResult,
+    FaceMatchTask,
+    FaceQualityResult,
+    FaceQualityTask,
+    Task,
+    TaskStatus,
+)
+
+
+def create_config(path: str, spawn_host: bool = False) -> IProviderConfig:
+    return IProviderConfig(
+        engine_type='facenet',
+        version={'major': 1, 'minor': 0, 'path': 0},
+        description='host provider test',
+        quality_threshold=0.5,
+        anti_spoofing_threshold=0.5,
+        build='test',
+        orchestrator={
+            'orchestrator_type': 'host',
+            'params': {
+                'socket_path': path,
+                'spawn_host': spawn_host,
+                'host_start_timeout': 5,
+            },
+        },
+    )
+
+
+class FakeProvider(IProvider):
+    def __init__(self, path: str) -> None:
+        super().__init__(create_config(path))
+        self.calls: List[bytes] = []
+
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        self.calls.append(data)
+        if data == b'error':
+            raise ValueError('engine error')
+        return FaceQualityTask(
+            status=TaskStatus.finished,
+            result=FaceQualityResult(score=len(data) / 10),
+        )
+
+    def match_with_face(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> Union[FaceMatchTask, Task]:
+        return FaceMatchTask(
+            status=TaskStatus.finished,
+            result=FaceMatchResult(score=float(internal_id)),
+        )
+
+
+class Host:
+    """
+    Host server on a thread of the test process.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.server = _HostServer(path, FakeProvider(path))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(10)
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / 'provider.sock')
+
+
+@pytest.fixture
+def host(path: str) -> Generator[Host, Any, None]:
+    host = Host(path)
+    yield host
+    host.stop()
+
+
+@pytest.fixture
+def client(path: str, host: Host) -> Generator[HostProvider, Any, None]:
+    client = HostProvider('providers.fake', create_config(path))
+    yield client
+    client.close()
+
+
+def test_round_trip(client: HostProvider):
+    assert client.ping()
+    assert client.quality(b'data').result.score == 0.4
+    # the connection is reused for the next calls
+    assert client.match_with_face(b'data', '0.5').result.score == 0.5
+    assert client.quality(b'x' * 100000).result.score == 10000
+
+
+def test_errors(client: HostProvider):
+    with pytest.raises(ProviderError, match='engine error'):
+        client.quality(b'error')
+    with pytest.raises(NotImplementedError):
+        client.liveness(b'data')
+    assert client.quality(b'data').status == TaskStatus.finished
+
+
+def test_truncated_request(path: str, host: Host, client: HostProvider):
+    # the client dies in the middle of the data
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall(_REQUEST.pack(2, 0, 100) + b'x' * 10)
+    sock.close()
+
+    assert client.quality(b'data').result.score == 0.4
+    # the truncated call does not reach the provider
+    assert host.server.provider.calls == [b'data']
+
+
+def test_no_host(path: str):
+    client = HostProvider('providers.fake', create_config(path))
+
+    assert not client.ping()
+    with pytest.raises(FileNotFoundError):
+        client.quality(b'data')
+
+
+class FakeProcess:
+    """
+    Popen of the spawned host, the host runs on a thread.
+    """
+
+    def __init__(self, args: List[str], cwd: str, **kwargs) -> None:
+        self.args = args
+        self.cwd = cwd
+        self.host: Optional[Host] = Host(args[-1])
+        self.waited = False
+
+    def poll(self) -> Optional[int]:
+        return None if self.host is not None else 0
+
+    def terminate(self) -> None:
+        self.host.stop()
+        self.host = None
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        self.waited = True
+        return 0
+
+
+def test_spawn_host(path: str, monkeypatch):
+    processes = []
+
+    def popen(args: List[str], **kwargs) -> FakeProcess:
+        # the namespace argument is the socket path of the fake host
+        process = FakeProcess(args[:-1] + [path], **kwargs)
+        processes.append(process)
+        return process
+
+    monkeypatch.setattr(host_provider.subprocess, 'Popen', popen)
+    client = HostProvider('providers.fake', create_config(path, True))
+
+    assert client.quality(b'data').result.score == 0.4
+    process, = processes
+    main = process.args[1]
+    assert os.path.isabs(main) and os.path.exists(main)
+    assert process.cwd == os.path.dirname(main)
+
+    client.close()
+    assert process.host is None and process.waited
@@ -0,0 +1,329 @@
+import asyncio
+import itertools
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import pytest
+from redis import Redis
+
+from core import orchestrator
+from core.cache.result_cache import ResultCache, create_result_cache
+from core.config import get_config
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.enums import TaskOperation, TaskPriority
+from core.provider.models.tasks import (
+    FaceMatchResult,
+    FaceMatchTask,
+    FaceQualityResult,
+    FaceQualityTask,
+    TaskStatus,
+)
+from core.queue.context import cancel_key
+from core.queue.models import TaskEnvelope
+from core.queue.task_store import get_task
+from core.queue.timings import TaskTimings, timings_key
+
+# match pools are kept by provider name, every test gets its own
+versions = itertools.count()
+
+
+class MatchProvider(IProvider):
+    """
+    Answers with the score of the descriptor and records how many calls
+    were in progress at the same time.
+    """
+
+    def __init__(self, scores: Dict[str, float], max_workers: int) -> None:
+        super().__init__(IProviderConfig(
+            engine_type='facenet',
+            version={'major': 1, 'minor': next(versions), 'path': 0},
+            description='match test',
+            quality_threshold=0.5,
+            anti_spoofing_threshold=0.5,
+            match_threshold=0.8,
+            build='test',
+            orchestrator={
+                'orchestrator_type': 'thread',
+                'params': {'max_workers': max_workers},
+            },
+        ))
+        self.scores = scores
+        self.calls: List[str] = []
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __enter(self, internal_id: str) -> None:
+        with self.lock:
+            self.calls.append(internal_id)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def __exit(self, internal_id: str) -> FaceMatchTask:
+        with self.lock:
+            self.running -= 1
+        return FaceMatchTask(
+            status=TaskStatus.finished,
+            result=FaceMatchResult(score=self.scores[internal_id]),
+        )
+
+    def match_with_face(self, data: bytes, internal_id: str) -> FaceMatchTask:
+        self.__enter(internal_id)
+        time.sleep(0.02)
+        return self.__exit(internal_id)
+
+    async def match_with_face_async(
+            self,
+            data: bytes,
+            internal_id: str
+    ) -> FaceMatchTask:
+        self.__enter(internal_id)
+        await asyncio.sleep(0.02)
+        return self.__exit(internal_id)
+
+
+@pytest.fixture
+def fanout(monkeypatch) -> int:
+    monkeypatch.setattr(get_config(), 'match_fanout', 2)
+    return 2
+
+
+def no_match(count: int) -> Dict[str, float]:
+    return {f'descriptor-{number}': 0.1 for number in range(count)}
+
+
+def test_match_fanout(fanout: int):
+    provider = MatchProvider(no_match(6), max_workers=8)
+
+    results = orchestrator.__match_descriptors(
+        provider, b'data', list(provider.scores)
+    )
+
+    assert len(results) == 6
+    assert provider.peak == fanout
+
+
+def test_match_limited_by_provider_workers(fanout: int):
+    provider = MatchProvider(no_match(4), max_workers=1)
+
+    results = orchestrator.__match_descriptors(
+        provider, b'data', list(provider.scores)
+    )
+
+    assert len(results) == 4
+    assert provider.peak == 1
+
+
+def test_match_stops_over_threshold(monkeypatch):
+    monkeypatch.setattr(get_config(), 'match_fanout', 1)
+    scores = no_match(5)
+    scores['descriptor-1'] = 0.9
+    provider = MatchProvider(scores, max_workers=8)
+
+    results = orchestrator.__match_descriptors(
+        provider, b'data', list(scores)
+    )
+
+    assert [result.result.score for result in results] == [0.1, 0.9]
+    assert provider.calls == ['descriptor-0', 'descriptor-1']
+
+
+def test_match_fanout_async(fanout: int):
+    provider = MatchProvider(no_match(6), max_workers=8)
+
+    results = asyncio.run(orchestrator.__match_descriptors_async(
+        provider, b'data', list(provider.scores)
+    ))
+
+    assert len(results) == 6
+    assert provider.peak == fanout
+
+
+def test_match_limited_by_provider_workers_async(fanout: int):
+    provider = MatchProvider(no_match(4), max_workers=1)
+
+    results = asyncio.run(orchestrator.__match_descriptors_async(
+        provider, b'data', list(provider.scores)
+    ))
+
+    assert len(results) == 4
+    assert provider.peak == 1
+
+
+def test_match_stops_over_threshold_async(monkeypatch):
+    monkeypatch.setattr(get_config(), 'match_fanout', 1)
+    scores = no_match(5)
+    scores['descriptor-1'] = 0.9
+    provider = MatchProvider(scores, max_workers=8)
+
+    results = asyncio.run(orchestrator.__match_descriptors_async(
+        provider, b'data', list(scores)
+    ))
+
+    assert [result.result.score for result in results] == [0.1, 0.9]
+    assert provider.calls == ['descriptor-0', 'descriptor-1']
+
+
+def test_match_limit_created_once():
+    provider = MatchProvider(no_match(1), max_workers=1)
+    limits = []
+    barrier = threading.Barrier(8)
+
+    async def get_limit() -> None:
+        limits.append(orchestrator.__get_match_limit(provider))
+
+    def run() -> None:
+        # every thread with its own loop, as asyncio providers have
+        barrier.wait()
+        asyncio.run(get_limit())
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert len(limits) == 8
+    assert all(limit is limits[0] for limit in limits)
+
+
+class QualityProvider(IProvider):
+    def __init__(self, error: Optional[Exception] = None) -> None:
+        super().__init__(IProviderConfig(
+            engine_type='facenet',
+            version={'major': 1, 'minor': next(versions), 'path': 0},
+            description='result write test',
+            quality_threshold=0.5,
+            anti_spoofing_threshold=0.5,
+            build='test',
+            orchestrator={'orchestrator_type': 'thread', 'params': {}},
+        ))
+        self.error = error
+        self.calls = 0
+
+    def quality(self, data: bytes) -> FaceQualityTask:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return FaceQualityTask(
+            status=TaskStatus.finished, result=FaceQualityResult(score=0.9)
+        )
+
+
+def quality_task(
+        prefix: str,
+        priority: TaskPriority = TaskPriority.interactive
+) -> TaskEnvelope:
+    return TaskEnvelope(
+        task_id=f'{prefix}:task',
+        operation=TaskOperation.quality,
+        engine_id=uuid.uuid4(),
+        provider='fake',
+        file_hash=prefix,
+        priority=priority,
+    )
+
+
+def get_timings(redis: Redis, task_id: str) -> Dict[str, float]:
+    return TaskTimings.decode(redis.get(timings_key(task_id))).as_dict()
+
+
+def test_timings_written_with_result(redis: Redis, prefix: str):
+    task = quality_task(prefix)
+
+    orchestrator.run(task, QualityProvider(), b'data', redis)
+
+    assert get_task(redis, task.task_id).status == TaskStatus.finished
+    assert 'provider_call' in get_timings(redis, task.task_id)
+
+
+def test_timings_written_with_failure(redis: Redis, prefix: str):
+    task = quality_task(prefix)
+
+    orchestrator.run(
+        task, QualityProvider(ValueError('engine error')), b'data', redis
+    )
+
+    assert get_task(redis, task.task_id).status == TaskStatus.failed
+    assert 'provider_call' in get_timings(redis, task.task_id)
+
+
+def test_timings_written_with_result_async(redis: Redis, prefix: str):
+    task = quality_task(prefix)
+
+    asyncio.run(
+        orchestrator.run_async(task, QualityProvider(), b'data', redis)
+    )
+
+    assert get_task(redis, task.task_id).status == TaskStatus.finished
+    assert 'provider_call' in get_timings(redis, task.task_id)
+
+
+def test_no_timings_for_cancelled_task(redis: Redis, prefix: str):
+    task = quality_task(prefix)
+    redis.set(cancel_key(task.task_id), 1)
+
+    orchestrator.run(task, QualityProvider(), b'data', redis)
+
+    assert get_task(redis, task.task_id) is None
+    assert not redis.exists(timings_key(task.task_id))
+
+
+@pytest.fixture
+def result_cache(redis: Redis, prefix: str, monkeypatch) -> ResultCache:
+    monkeypatch.setattr(get_config(), 'result_cache_name', prefix)
+    return create_result_cache(redis)
+
+
+cached = FaceQualityTask(
+    status=TaskStatus.finished, result=FaceQualityResult(score=0.7)
+)
+
+
+def test_bulk_task_uses_cached_result(
+        redis: Redis,
+        prefix: str,
+        result_cache: ResultCache
+):
+    provider = QualityProvider()
+    task = quality_task(prefix, TaskPriority.bulk)
+    # an interactive task on the file finished after the bulk enqueue
+    result_cache.set(provider.name, TaskOperation.quality, prefix, cached)
+
+    orchestrator.run(task, provider, b'data', redis)
+
+    assert provider.calls == 0
+    assert get_task(redis, task.task_id) == cached
+
+
+def test_bulk_task_uses_cached_result_async(
+        redis: Redis,
+        prefix: str,
+        result_cache: ResultCache
+):
+    provider = QualityProvider()
+    task = quality_task(prefix, TaskPriority.bulk)
+    result_cache.set(provider.name, TaskOperation.quality, prefix, cached)
+
+    asyncio.run(orchestrator.run_async(task, provider, b'data', redis))
+
+    assert provider.calls == 0
+    assert get_task(redis, task.task_id) == cached
+
+
+def test_interactive_task_calls_provider(
+        redis: Redis,
+        prefix: str,
+        result_cache: ResultCache
+):
+    provider = QualityProvider()
+    task = quality_task(prefix)
+    result_cache.set(provider.name, TaskOperation.quality, prefix, cached)
+
+    orchestrator.run(task, provider, b'data', redis)
+
+    # the cache was checked when the task was created
+    assert provider.calls == 1
+    assert get_task(redis, task.task_id).result.score == 0.9
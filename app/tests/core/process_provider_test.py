@@ -0,0 +1,115 @@
+import asyncio
+import os
+import time
+from typing import Any, Generator, Union
+
+import pytest
+
+from core import tracing
+from core.exceptions.orchestrator import DeadlineExceededError
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.tasks import (
+    FaceAntiSpoofResult,
+    FaceAntiSpoofTask,
+    FaceQualityResult,
+    FaceQualityTask,
+    FaceRegisterResult,
+    FaceRegisterTask,
+    Task,
+    TaskStatus,
+)
+from core.provider.process_provider import ProcessProvider
+from core.queue.context import TaskContext, remaining_time, task_context
+
+config = IProviderConfig(
+    engine_type='facenet',
+    version={'major': 1, 'minor': 0, 'path': 0},
+    description='process provider test',
+    quality_threshold=0.5,
+    anti_spoofing_threshold=0.5,
+    build='test',
+    orchestrator={
+        'orchestrator_type': 'process',
+        'params': {'processes': 1},
+    },
+)
+
+
+class EchoProvider(IProvider):
+    def quality(self, data: bytes) -> Union[FaceQualityTask, Task]:
+        return FaceQualityTask(
+            status=TaskStatus.finished,
+            result=FaceQualityResult(score=len(data)),
+        )
+
+    def liveness(self, data: bytes) -> Union[FaceAntiSpoofTask, Task]:
+        # the deadline of the calling task
+        return FaceAntiSpoofTask(
+            status=TaskStatus.finished,
+            result=FaceAntiSpoofResult(score=remaining_time() or -1),
+        )
+
+    def register(self, data: bytes) -> Union[FaceRegisterTask, Task]:
+        # sleeps for data seconds, returns the trace of the calling task
+        time.sleep(float(data.decode()))
+        return FaceRegisterTask(
+            status=TaskStatus.finished,
+            result=FaceRegisterResult(face_id=tracing.traceparent() or ''),
+        )
+
+
+@pytest.fixture(scope='module')
+def provider() -> Generator[ProcessProvider, Any, None]:
+    provider = ProcessProvider(EchoProvider, config)
+    yield provider
+    provider.close()
+
+
+def shm_segments() -> set:
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm')}
+
+
+def test_call(provider: ProcessProvider):
+    segments = shm_segments()
+    assert provider.quality(data=b'x' * 1000).result.score == 1000
+    assert provider.liveness(data=b'x').result.score == -1
+    assert shm_segments() == segments
+
+
+def test_task_context(provider: ProcessProvider):
+    context = TaskContext('task', time.time() + 30, redis=None)
+    with task_context(context), tracing.trace(None, 'test') as span:
+        score = provider.liveness(data=b'x').result.score
+        face_id = provider.register(data=b'0').result.face_id
+
+    assert 0 < score <= 30
+    # a child span of the caller in the same trace
+    assert face_id.startswith(f'00-{span.trace_id}-')
+    assert span.span_id not in face_id
+
+
+def test_deadline(provider: ProcessProvider):
+    segments = shm_segments()
+    context = TaskContext('task', time.time() + 0.5, redis=None)
+    start = time.monotonic()
+    with task_context(context), pytest.raises(DeadlineExceededError):
+        provider.register(data=b'2')
+    assert time.monotonic() - start < 1.5
+
+    # the child still reads the payload until it is done
+    assert len(shm_segments() - segments) == 1
+    provider.quality(data=b'x')
+    assert shm_segments() == segments
+
+
+def test_deadline_async(provider: ProcessProvider):
+    async def call() -> None:
+        context = TaskContext('task', time.time() + 0.5, redis=None)
+        with task_context(context):
+            await provider.register_async(data=b'2')
+
+    segments = shm_segments()
+    with pytest.raises(DeadlineExceededError):
+        asyncio.run(call())
+    assert provider.quality(data=b'x').result.score == 1
+    assert shm_segments() == segments
@@ -0,0 +1,341 @@
+import json
+import threading
+import uuid
+from typing import Callable
+
+from redis import Redis
+
+from core.provider.models.enums import TaskPriority
+from core.provider.models.tasks import TaskStatus
+from core.queue.models import TaskEnvelope
+from core.queue.redis_queue import RedisTaskQueue
+from core.queue.task_store import get_task
+
+
+def create_queue(redis: Redis, prefix: str, **kwargs) -> RedisTaskQueue:
+    params = dict(
+        redis=redis,
+        name=prefix,
+        visibility_timeout=60,
+        max_attempts=2,
+        heartbeat_ttl=60,
+        weights={priority: 1 for priority in TaskPriority},
+    )
+    params.update(kwargs)
+    return RedisTaskQueue(**params)
+
+
+def test_pop_leases_task(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    envelope = create_envelope()
+    queue.push(envelope)
+
+    item = queue.pop('worker', timeout=1)
+    assert item.envelope == envelope
+    assert redis.get(queue.lease_key(envelope.task_id)) == b'worker'
+    assert redis.lrange(queue.processing_key('worker'), 0, -1) == [item.raw]
+
+    queue.ack('worker', item)
+    assert redis.llen(queue.processing_key('worker')) == 0
+    assert not redis.exists(queue.lease_key(envelope.task_id))
+    assert queue.pop('worker', timeout=1) is None
+
+
+def test_blocking_pop_leases_task(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    envelope = create_envelope()
+    pusher = threading.Timer(0.2, queue.push, args=(envelope,))
+    pusher.start()
+
+    item = queue.pop('worker', timeout=2)
+    pusher.join()
+    assert item.envelope == envelope
+    assert redis.get(queue.lease_key(envelope.task_id)) == b'worker'
+    assert redis.llen(queue.claim_key('worker')) == 0
+
+
+def test_pop_drops_invalid_envelope(redis: Redis, prefix: str):
+    queue = create_queue(redis, prefix)
+    redis.lpush(queue.pending_key(TaskPriority.interactive), b'invalid')
+
+    assert queue.pop('worker', timeout=1) is None
+    assert redis.llen(queue.processing_key('worker')) == 0
+
+
+def test_pop_leases_any_json_layout(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    envelope = create_envelope()
+    fields = json.loads(envelope.json())
+    task_id = fields.pop('task_id')
+    fields['task_id'] = task_id
+    redis.lpush(
+        queue.pending_key(TaskPriority.interactive),
+        json.dumps(fields, separators=(',', ':')),
+    )
+
+    assert queue.pop('worker', timeout=1).envelope == envelope
+    assert redis.get(queue.lease_key(task_id)) == b'worker'
+
+
+def test_requeue_keeps_leased_tasks(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    queue.heartbeat('worker')
+    queue.push(create_envelope())
+    queue.pop('worker', timeout=1)
+
+    assert queue.requeue_stale() == 0
+    assert redis.llen(queue.processing_key('worker')) == 1
+
+
+def test_requeue_expired_lease(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    queue.heartbeat('worker')
+    envelope = create_envelope()
+    queue.push(envelope)
+
+    # the first expiry requeues the task, the second one fails it
+    for attempts in range(1, 3):
+        item = queue.pop('worker', timeout=1)
+        assert item.envelope.attempts == attempts - 1
+        redis.delete(queue.lease_key(envelope.task_id))
+        assert queue.requeue_stale() == 1
+        assert redis.llen(queue.processing_key('worker')) == 0
+
+    task = get_task(redis, envelope.task_id)
+    assert task.status == TaskStatus.failed
+    assert task.result.message == 'Task was lost'
+    assert queue.pop('worker', timeout=1) is None
+
+
+def test_requeue_dead_worker(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    queue.heartbeat('dead')
+    envelope = create_envelope()
+    queue.push(envelope)
+    queue.pop('dead', timeout=1)
+    # popped by a blocking pop but not leased yet
+    claimed = create_envelope(1)
+    redis.lpush(queue.claim_key('dead'), claimed.json())
+    redis.delete(queue.heartbeat_key('dead'))
+
+    assert queue.requeue_stale() == 2
+    assert queue.workers() == []
+    assert get_task(redis, envelope.task_id).status == TaskStatus.queued
+
+    queue.heartbeat('worker')
+    popped = {
+        item.envelope.task_id: item.envelope.attempts
+        for item in (queue.pop('worker', timeout=1) for _ in range(2))
+    }
+    assert popped == {envelope.task_id: 1, claimed.task_id: 0}
+
+
+def test_claimed_task_of_live_worker_is_kept(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    queue.heartbeat('worker')
+    redis.lpush(queue.claim_key('worker'), create_envelope().json())
+
+    assert queue.requeue_stale() == 0
+    assert redis.llen(queue.claim_key('worker')) == 1
+
+
+def test_release(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    envelope = create_envelope()
+    queue.push(envelope)
+
+    item = queue.pop('worker', timeout=1)
+    queue.release('worker', item, reset_status=True)
+    assert redis.llen(queue.processing_key('worker')) == 0
+    assert not redis.exists(queue.lease_key(envelope.task_id))
+    assert get_task(redis, envelope.task_id).status == TaskStatus.queued
+
+    item = queue.pop('worker', timeout=1)
+    assert item.envelope.attempts == 0
+
+
+def test_heartbeat_renews_leases(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(redis, prefix)
+    running = create_envelope(0)
+    expired = create_envelope(1)
+    queue.push(running)
+    queue.push(expired)
+    queue.pop('worker', timeout=1)
+    queue.pop('worker', timeout=1)
+    redis.expire(queue.lease_key(running.task_id), 5)
+    redis.delete(queue.lease_key(expired.task_id))
+
+    queue.heartbeat('worker', [running.task_id, expired.task_id])
+    assert redis.ttl(queue.lease_key(running.task_id)) > 5
+    assert not redis.exists(queue.lease_key(expired.task_id))
+
+
+def test_pop_priority_lanes(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_queue(
+        redis, prefix,
+        weights={TaskPriority.interactive: 3, TaskPriority.bulk: 1},
+    )
+    for number in range(4):
+        queue.push(create_envelope(
+            number, priority=TaskPriority.bulk
+        ))
+        queue.push(create_envelope(
+            10 + number, priority=TaskPriority.interactive
+        ))
+
+    priorities = [
+        queue.pop('worker', timeout=1).envelope.priority
+        for _ in range(8)
+    ]
+    # 3 interactive tasks for each bulk task while both lanes have tasks
+    assert priorities[:4].count(TaskPriority.bulk) == 1
+    assert priorities.count(TaskPriority.bulk) == 4
+
+
+def engine_in_shard(queue: RedisTaskQueue, shard: int) -> uuid.UUID:
+    for number in range(1000):
+        engine = uuid.UUID(int=number)
+        if queue.shard(engine) == shard:
+            return engine
+    raise AssertionError(f'No engine in shard {shard}')
+
+
+def test_shard_by_engine(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope],
+        engine_id: uuid.UUID
+):
+    assert create_queue(redis, prefix).shard(engine_id) is None
+
+    queue = create_queue(redis, prefix, shards=8)
+    shards = {queue.shard(uuid.UUID(int=number)) for number in range(200)}
+    assert shards == set(range(8))
+    # the same engine maps to the same shard in every process
+    other = create_queue(redis, prefix, shards=8)
+    assert other.shard(engine_id) == queue.shard(engine_id)
+
+    envelope = create_envelope()
+    queue.push(envelope)
+    key = queue.pending_key(envelope.priority, queue.shard(engine_id))
+    assert redis.llen(key) == 1
+
+
+def test_preferred_workers_rendezvous(redis: Redis, prefix: str):
+    queue = create_queue(redis, prefix, shards=16, affinity_workers=2)
+    workers = [f'worker-{number}' for number in range(5)]
+    preferred = {
+        shard: queue.preferred_workers(shard, workers) for shard in range(16)
+    }
+
+    for shard, chosen in preferred.items():
+        assert len(chosen) == 2
+        assert queue.preferred_workers(shard, workers[::-1]) == chosen
+    # the shards are spread over the workers
+    assert set().union(*preferred.values()) == set(workers)
+
+    # a leaving worker only moves its own shards
+    left = workers[0]
+    rest = workers[1:]
+    for shard, chosen in preferred.items():
+        now = queue.preferred_workers(shard, rest)
+        if left not in chosen:
+            assert now == chosen
+        else:
+            assert [w for w in chosen if w != left][0] in now
+
+
+def create_shard_queue(redis: Redis, prefix: str) -> RedisTaskQueue:
+    queue = create_queue(
+        redis, prefix, shards=4, affinity_workers=1, steal_backlog=3
+    )
+    for worker_id in ('owner', 'thief', 'owner'):
+        queue.heartbeat(worker_id)
+    return queue
+
+
+def owned_shard(queue: RedisTaskQueue, worker_id: str) -> int:
+    workers = ['owner', 'thief']
+    for shard in range(4):
+        if queue.preferred_workers(shard, workers) == [worker_id]:
+            return shard
+    raise AssertionError(f'{worker_id} owns no shard')
+
+
+def test_pop_own_shards(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_shard_queue(redis, prefix)
+    engine = engine_in_shard(queue, owned_shard(queue, 'owner'))
+    envelope = create_envelope(engine_id=engine)
+    queue.push(envelope)
+
+    # below the steal backlog the task stays with its shard
+    assert queue.pop('thief', timeout=1) is None
+    assert queue.pop('owner', timeout=1).envelope == envelope
+
+
+def test_steal_over_backlog(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = create_shard_queue(redis, prefix)
+    engine = engine_in_shard(queue, owned_shard(queue, 'owner'))
+    envelopes = [
+        create_envelope(number, engine_id=engine)
+        for number in range(3)
+    ]
+    for envelope in envelopes[:2]:
+        queue.push(envelope)
+    assert queue.pop('thief', timeout=1) is None
+
+    queue.push(envelopes[2])
+    stolen = queue.pop('thief', timeout=1)
+    assert stolen.envelope == envelopes[0]
+    assert redis.get(queue.lease_key(stolen.envelope.task_id)) == b'thief'
+    # the backlog is below the threshold again
+    assert queue.pop('thief', timeout=1) is None
+    assert queue.pop('owner', timeout=1).envelope == envelopes[1]
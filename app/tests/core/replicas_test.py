@@ -0,0 +1,181 @@
+import asyncio
+import threading
+from typing import Callable, Generator, List
+
+import pytest
+
+from core.provider.replicas import MIN_LATENCY_SAMPLES, ReplicaSet
+
+URLS = ['http://a', 'http://b', 'http://c']
+
+
+class Response:
+    def __init__(self, url: str, status_code: int = 200) -> None:
+        self.url = url
+        self.status_code = status_code
+
+
+@pytest.fixture
+def release() -> Generator[threading.Event, None, None]:
+    # blocked sends return when the test ends
+    release = threading.Event()
+    yield release
+    release.set()
+
+
+def create_replicas(urls: List[str], **kwargs) -> ReplicaSet:
+    kwargs.setdefault('eject_failures', 2)
+    kwargs.setdefault('eject_time', 60)
+    return ReplicaSet('test', urls, **kwargs)
+
+
+def call_in_thread(
+        replicas: ReplicaSet,
+        send: Callable[[str], Response]
+) -> threading.Thread:
+    thread = threading.Thread(target=replicas.call, args=('path', send))
+    thread.start()
+    return thread
+
+
+def prime(replicas: ReplicaSet) -> None:
+    # fast latencies, so the hedge delay is short
+    for _ in range(MIN_LATENCY_SAMPLES):
+        replicas.call('path', Response)
+
+
+def test_least_outstanding(release: threading.Event):
+    replicas = create_replicas(URLS)
+    busy = []
+    started = threading.Semaphore(0)
+
+    def block(url: str) -> Response:
+        busy.append(url.rsplit('/', 1)[0])
+        started.release()
+        assert release.wait(10)
+        return Response(url)
+
+    threads = [call_in_thread(replicas, block) for _ in range(2)]
+    for _ in threads:
+        assert started.acquire(timeout=10)
+    free = [url for url in URLS if url not in busy]
+
+    assert len(free) == 1
+    for _ in range(3):
+        assert replicas.call('path', Response).url == f'{free[0]}/path'
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+
+def test_eject_failing_replica():
+    replicas = create_replicas(URLS[:2])
+    calls = []
+
+    def send(url: str) -> Response:
+        calls.append(url)
+        if url.startswith(URLS[0]):
+            return Response(url, 503)
+        return Response(url)
+
+    for _ in range(4):
+        replicas.call('path', send)
+    assert calls.count(f'{URLS[0]}/path') == 2
+
+    calls.clear()
+    for _ in range(4):
+        assert replicas.call('path', send).status_code == 200
+    assert calls == [f'{URLS[1]}/path'] * 4
+
+
+def test_all_ejected_are_used():
+    replicas = create_replicas(URLS[:2], eject_failures=1)
+
+    def send(url: str) -> Response:
+        raise ConnectionError(url)
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            replicas.call('path', send)
+
+    with pytest.raises(ConnectionError):
+        replicas.call('path', send)
+
+
+def test_hedge_delay_needs_samples():
+    replicas = create_replicas(URLS[:2], hedge_quantile=0.9)
+    assert replicas.hedge_delay('path') is None
+    prime(replicas)
+
+    assert replicas.hedge_delay('path') is not None
+    assert replicas.hedge_delay('other') is None
+
+
+def test_no_hedge_with_one_replica():
+    replicas = create_replicas(URLS[:1], hedge_quantile=0.9)
+    prime(replicas)
+
+    assert replicas.hedge_delay('path') is None
+
+
+def test_hedge_slow_replica(release: threading.Event):
+    replicas = create_replicas(URLS[:2], hedge_quantile=0.5)
+    prime(replicas)
+    calls = []
+
+    def send(url: str) -> Response:
+        calls.append(url)
+        if url.startswith(URLS[0]):
+            assert release.wait(10)
+        return Response(url)
+
+    try:
+        response = replicas.call('path', send, hedge=True)
+    finally:
+        release.set()
+        replicas.close()
+
+    assert response.url == f'{URLS[1]}/path'
+    assert calls == [f'{URLS[0]}/path', f'{URLS[1]}/path']
+
+
+def test_hedge_failed_response_waits_for_other(release: threading.Event):
+    replicas = create_replicas(URLS[:2], hedge_quantile=0.5)
+    prime(replicas)
+
+    def send(url: str) -> Response:
+        if url.startswith(URLS[0]):
+            assert release.wait(10)
+            return Response(url)
+        release.set()
+        return Response(url, 500)
+
+    try:
+        response = replicas.call('path', send, hedge=True)
+    finally:
+        replicas.close()
+
+    assert response.url == f'{URLS[0]}/path'
+    assert response.status_code == 200
+
+
+def test_hedge_slow_replica_async():
+    replicas = create_replicas(URLS[:2], hedge_quantile=0.5)
+    prime(replicas)
+    cancelled = []
+
+    async def send(url: str) -> Response:
+        if url.startswith(URLS[0]):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+        return Response(url)
+
+    response = asyncio.run(replicas.call_async('path', send, hedge=True))
+
+    assert response.url == f'{URLS[1]}/path'
+    # the slow request is cancelled and does not count as a failure
+    assert cancelled == [f'{URLS[0]}/path']
+    assert replicas.call('path', Response).status_code == 200
@@ -0,0 +1,80 @@
+import queue
+import time
+
+import pytest
+
+from core.executors.scheduler import FairQueue
+
+
+def drain(fair_queue: FairQueue) -> list:
+    items = []
+    while fair_queue.qsize() > 0:
+        items.append(fair_queue.get_nowait())
+    return items
+
+
+def test_flow_is_fifo():
+    fair_queue = FairQueue(maxsize=8)
+    for number in range(4):
+        fair_queue.put_nowait(('a', number), flow='a')
+
+    assert drain(fair_queue) == [('a', number) for number in range(4)]
+
+
+def test_equal_flows_alternate():
+    fair_queue = FairQueue(maxsize=8)
+    for _ in range(3):
+        fair_queue.put_nowait('a', flow='a')
+    for _ in range(3):
+        fair_queue.put_nowait('b', flow='b')
+
+    assert drain(fair_queue) == ['a', 'b'] * 3
+
+
+def test_weighted_share():
+    fair_queue = FairQueue(maxsize=16)
+    for _ in range(8):
+        fair_queue.put_nowait('interactive', flow='interactive', weight=3)
+        fair_queue.put_nowait('bulk', flow='bulk', weight=1)
+
+    served = drain(fair_queue)
+    # 3 to 1 while both flows are backlogged
+    assert served[:8].count('bulk') == 2
+    assert served[8:] == ['interactive', 'interactive'] + ['bulk'] * 6
+
+
+def test_backlog_does_not_delay_new_flow():
+    fair_queue = FairQueue(maxsize=16)
+    for _ in range(10):
+        fair_queue.put_nowait('backlog', flow='backlog')
+    fair_queue.get_nowait()
+    fair_queue.put_nowait('new', flow='new')
+
+    assert 'new' in [fair_queue.get_nowait() for _ in range(2)]
+
+
+def test_full_and_closed():
+    fair_queue = FairQueue(maxsize=1)
+    with pytest.raises(ValueError):
+        fair_queue.put_nowait('item', weight=0)
+    fair_queue.put_nowait('item')
+    with pytest.raises(queue.Full):
+        fair_queue.put_nowait('item')
+
+    assert fair_queue.close() == 1
+    assert fair_queue.get(timeout=1) is None
+    with pytest.raises(queue.Full):
+        fair_queue.put_nowait('item')
+
+
+def test_get_timeout_and_oldest_wait():
+    fair_queue = FairQueue(maxsize=2)
+    assert fair_queue.oldest_wait() == 0
+    with pytest.raises(queue.Empty):
+        fair_queue.get(timeout=0.01)
+
+    fair_queue.put_nowait('item')
+    time.sleep(0.05)
+    assert fair_queue.oldest_wait() >= 0.05
+    assert fair_queue.get(timeout=1) == 'item'
+    assert fair_queue.oldest_wait() == 0
@@ -0,0 +1,175 @@
+import json
+import threading
+from typing import Callable
+
+from redis import Redis
+
+from core import orchestrator
+from core.provider.models.tasks import (
+    FaceQualityResult,
+    FaceQualityTask,
+    FailedResult,
+    Task,
+    TaskStatus,
+)
+from core.queue.context import DEADLINE_MESSAGE, cancel_key
+from core.queue.models import TaskEnvelope
+from core.queue.single_flight import SingleFlight
+from core.queue.task_store import get_task, set_task
+
+finished = FaceQualityTask(
+    status=TaskStatus.finished, result=FaceQualityResult(score=0.9)
+)
+
+
+def cancel(redis: Redis, task: TaskEnvelope) -> None:
+    redis.set(cancel_key(task.task_id), 1)
+    set_task(redis, task.task_id, Task(status=TaskStatus.cancelled))
+
+
+def test_copy_result_to_followers(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    flight = SingleFlight(redis, prefix, ttl=60)
+    leader, follower, cancelled = [create_envelope(i) for i in range(3)]
+
+    assert flight.join(leader)
+    assert not flight.join(follower)
+    assert not flight.join(cancelled)
+    cancel(redis, cancelled)
+    set_task(redis, leader.task_id, finished)
+
+    assert flight.land(leader) is None
+    assert get_task(redis, follower.task_id) == finished
+    assert get_task(redis, cancelled.task_id).status == TaskStatus.cancelled
+    # the next identical task runs again
+    assert flight.join(create_envelope(3))
+
+
+def test_cancelled_leader_hands_over(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    flight = SingleFlight(redis, prefix, ttl=60)
+    leader, first, second = [create_envelope(i) for i in range(3)]
+    flight.join(leader)
+    flight.join(first)
+    flight.join(second)
+    cancel(redis, leader)
+
+    assert flight.land(leader) == first
+    assert get_task(redis, first.task_id) is None
+    # the new leader runs, later tasks still follow
+    assert flight.join(first)
+    assert not flight.join(create_envelope(3))
+
+    set_task(redis, first.task_id, finished)
+    assert flight.land(first) is None
+    assert get_task(redis, second.task_id) == finished
+    assert get_task(redis, leader.task_id).status == TaskStatus.cancelled
+
+
+def test_deadline_leader_hands_over(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    flight = SingleFlight(redis, prefix, ttl=60)
+    leader, follower = [create_envelope(i) for i in range(2)]
+    flight.join(leader)
+    flight.join(follower)
+    set_task(redis, leader.task_id, Task(
+        status=TaskStatus.failed,
+        result=FailedResult(message=DEADLINE_MESSAGE),
+    ))
+
+    assert flight.land(follower) is None
+    assert flight.land(leader) == follower
+    set_task(redis, follower.task_id, finished)
+    assert flight.land(follower) is None
+    # no followers are left
+    assert flight.join(create_envelope(2))
+
+
+def test_hand_over_without_followers(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    flight = SingleFlight(redis, prefix, ttl=60)
+    leader = create_envelope(0)
+    flight.join(leader)
+    cancel(redis, leader)
+
+    assert flight.land(leader) is None
+    assert not redis.exists(flight.marker_key(leader))
+
+
+def test_hand_over_any_json_layout(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    flight = SingleFlight(redis, prefix, ttl=60)
+    leader, follower = [create_envelope(i) for i in range(2)]
+    flight.join(leader)
+    redis.rpush(flight.followers_key(follower), json.dumps(
+        json.loads(follower.json()), separators=(',', ':'), sort_keys=True
+    ))
+    cancel(redis, leader)
+
+    assert flight.land(leader) == follower
+    assert redis.get(flight.marker_key(leader)) == follower.task_id.encode()
+
+
+def test_run_cancelled_leader(
+        redis: Redis,
+        prefix: str,
+        blocking_provider,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    leader, follower = [create_envelope(i) for i in range(2)]
+    thread = threading.Thread(
+        target=orchestrator.run,
+        args=(leader, blocking_provider, b'data', redis),
+    )
+    thread.start()
+    assert blocking_provider.started.wait(10)
+
+    # the follower is attached and returns at once
+    orchestrator.run(follower, blocking_provider, b'data', redis)
+    cancel(redis, leader)
+    blocking_provider.release.set()
+    thread.join(10)
+
+    # the follower runs again instead of copying the cancellation
+    assert blocking_provider.calls == 2
+    assert get_task(redis, leader.task_id).status == TaskStatus.cancelled
+    assert get_task(redis, follower.task_id) == finished
+
+
+def test_run_keeps_cancelled_follower(
+        redis: Redis,
+        prefix: str,
+        blocking_provider,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    leader, follower = [create_envelope(i) for i in range(2)]
+    thread = threading.Thread(
+        target=orchestrator.run,
+        args=(leader, blocking_provider, b'data', redis),
+    )
+    thread.start()
+    assert blocking_provider.started.wait(10)
+
+    orchestrator.run(follower, blocking_provider, b'data', redis)
+    cancel(redis, follower)
+    blocking_provider.release.set()
+    thread.join(10)
+
+    assert blocking_provider.calls == 1
+    assert get_task(redis, leader.task_id) == finished
+    assert get_task(redis, follower.task_id).status == TaskStatus.cancelled
@@ -0,0 +1,370 @@
+import pickle
+import uuid
+from typing import Any, Callable, Generator, List
+
+import pytest
+from redis import Redis
+
+from core.cache.result_cache import ResultCache
+from core.exceptions.app import InputError
+from core.exceptions.orchestrator import PayloadBudgetError, QueueFullError
+from core.executors import manager
+from core.executors.budget import PayloadBudget
+from core.executors.manager import ExecutorManager
+from core.provider.models.enums import TaskOperation, TaskPriority
+from core.provider.models.tasks import (
+    FaceAntiSpoofResult,
+    FaceAntiSpoofTask,
+    FaceQualityResult,
+    FaceQualityTask,
+    Task,
+    TaskStatus,
+)
+from core.queue.context import cancel_key
+from core.queue.models import TaskEnvelope, TaskRequest
+from core.queue.task_store import get_task, set_task
+from core.services import task_service
+
+
+class ProviderManager:
+    def __init__(self, provider: Any) -> None:
+        self.provider = provider
+
+    def get_provider(self, name: str) -> Any:
+        return self.provider
+
+
+@pytest.fixture
+def provider(blocking_provider, monkeypatch) -> Generator[Any, Any, None]:
+    manager = ExecutorManager([blocking_provider])
+    monkeypatch.setattr(task_service, 'em', manager)
+    monkeypatch.setattr(
+        task_service, 'pm', ProviderManager(blocking_provider)
+    )
+    yield blocking_provider
+    blocking_provider.release.set()
+    manager.shutdown()
+
+
+def create_envelopes(
+        create_envelope: Callable[..., TaskEnvelope],
+        prefix: str,
+        count: int
+) -> List[TaskEnvelope]:
+    # different files, so the tasks are not coalesced
+    return [
+        create_envelope(number, file_hash=f'{prefix}:file:{number}')
+        for number in range(count)
+    ]
+
+
+@pytest.fixture
+def files(prefix: str) -> Generator[Redis, Any, None]:
+    """
+    File storage of the service, files with the prefix are removed after
+    the test.
+    """
+    redis = task_service.redis_cashe
+    yield redis
+    keys = redis.keys(f'*{prefix}*')
+    if keys:
+        redis.delete(*keys)
+
+
+def put_tasks(
+        files: Redis,
+        envelopes: List[TaskEnvelope],
+        data: bytes = b'data'
+) -> None:
+    for envelope in envelopes:
+        files.set(envelope.file_hash, data)
+    sizes = task_service.__get_file_sizes(
+        {envelope.file_hash for envelope in envelopes}
+    )
+    task_service.__put_tasks(envelopes, [None] * len(envelopes), sizes, False)
+
+
+def test_put_tasks_local(
+        redis: Redis,
+        prefix: str,
+        files: Redis,
+        provider,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    envelopes = create_envelopes(create_envelope, prefix, 2)
+    provider.release.set()
+    put_tasks(files, envelopes)
+
+    task_service.em.drain(10)
+    assert provider.calls == 2
+    for envelope in envelopes:
+        assert get_task(redis, envelope.task_id).status == TaskStatus.finished
+
+
+def test_batch_larger_than_queue(
+        redis: Redis,
+        prefix: str,
+        files: Redis,
+        provider,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    envelopes = create_envelopes(create_envelope, prefix, 3)
+
+    with pytest.raises(InputError):
+        put_tasks(files, envelopes)
+    # nothing is written or submitted
+    for envelope in envelopes:
+        assert get_task(redis, envelope.task_id) is None
+    assert task_service.em.get_executor('fake').pending == 0
+
+
+def test_batch_does_not_fit(
+        redis: Redis,
+        prefix: str,
+        files: Redis,
+        provider,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    running, waiting, *envelopes = create_envelopes(create_envelope, prefix, 4)
+    put_tasks(files, [running])
+    assert provider.started.wait(10)
+    put_tasks(files, [waiting])
+
+    with pytest.raises(QueueFullError):
+        put_tasks(files, envelopes)
+    for envelope in envelopes:
+        assert get_task(redis, envelope.task_id) is None
+
+    provider.release.set()
+    task_service.em.drain(10)
+    assert provider.calls == 2
+
+
+def test_cancel_submitted_on_failure(
+        redis: Redis,
+        prefix: str,
+        files: Redis,
+        provider,
+        create_envelope: Callable[..., TaskEnvelope],
+        monkeypatch
+):
+    running, *envelopes = create_envelopes(create_envelope, prefix, 3)
+    put_tasks(files, [running])
+    assert provider.started.wait(10)
+
+    # another process takes the last slot between the check and the submit
+    submit_task = task_service.em.submit_task
+    calls = []
+
+    def submit_once(**kwargs) -> None:
+        calls.append(kwargs['task'])
+        if len(calls) > 1:
+            raise QueueFullError('Provider fake is overloaded')
+        submit_task(**kwargs)
+
+    monkeypatch.setattr(task_service.em, 'submit_task', submit_once)
+    with pytest.raises(QueueFullError):
+        put_tasks(files, envelopes)
+
+    submitted, rejected = envelopes
+    assert get_task(redis, submitted.task_id).status == TaskStatus.cancelled
+    assert redis.exists(cancel_key(submitted.task_id))
+    assert get_task(redis, rejected.task_id) is None
+
+    # the cancelled task does not reach the provider
+    provider.release.set()
+    task_service.em.drain(10)
+    assert provider.calls == 1
+    assert get_task(redis, submitted.task_id).status == TaskStatus.cancelled
+
+
+@pytest.fixture
+def budget(monkeypatch) -> PayloadBudget:
+    budget = PayloadBudget(limit=10)
+    monkeypatch.setattr(task_service, 'get_payload_budget', lambda: budget)
+    monkeypatch.setattr(manager, 'get_payload_budget', lambda: budget)
+    return budget
+
+
+def test_budget_checked_before_fetch(
+        redis: Redis,
+        prefix: str,
+        files: Redis,
+        provider,
+        budget: PayloadBudget,
+        create_envelope: Callable[..., TaskEnvelope],
+        monkeypatch
+):
+    held = b'x' * 6
+    assert budget.acquire(held)
+
+    def mget(keys: List[str]) -> List[bytes]:
+        raise AssertionError('files are fetched before the budget check')
+
+    monkeypatch.setattr(files, 'mget', mget)
+    envelopes = create_envelopes(create_envelope, prefix, 2)
+    with pytest.raises(PayloadBudgetError):
+        put_tasks(files, envelopes, b'y' * 3)
+    for envelope in envelopes:
+        assert get_task(redis, envelope.task_id) is None
+    assert budget.used == 6
+    assert task_service.em.get_executor('fake').pending == 0
+
+
+def test_budget_released_after_tasks(
+        redis: Redis,
+        prefix: str,
+        files: Redis,
+        provider,
+        budget: PayloadBudget,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    envelopes = create_envelopes(create_envelope, prefix, 2)
+
+    put_tasks(files, envelopes, b'y' * 4)
+    # the submitted payloads are held until the tasks are done
+    assert budget.used == 8
+    provider.release.set()
+    task_service.em.drain(10)
+    assert budget.used == 0
+
+
+@pytest.fixture
+def task_id(redis: Redis) -> Generator[str, Any, None]:
+    """
+    Task IDs of the API are UUIDs, so they do not have the test prefix.
+    """
+    task_id = str(uuid.uuid4())
+    yield task_id
+    redis.delete(task_id, cancel_key(task_id))
+
+
+def test_cancel_task(redis: Redis, task_id: str):
+    set_task(redis, task_id, Task(status=TaskStatus.started))
+
+    cancelled = task_service.cancel_task(task_id)
+
+    assert cancelled.status == TaskStatus.cancelled
+    assert get_task(redis, task_id).status == TaskStatus.cancelled
+    assert redis.exists(cancel_key(task_id))
+    with pytest.raises(InputError):
+        task_service.cancel_task(task_id)
+
+
+def test_cancel_keeps_result(redis: Redis, task_id: str):
+    set_task(redis, task_id, FaceQualityTask(
+        status=TaskStatus.finished, result=FaceQualityResult(score=0.9)
+    ))
+
+    with pytest.raises(InputError):
+        task_service.cancel_task(task_id)
+    assert get_task(redis, task_id).status == TaskStatus.finished
+    assert not redis.exists(cancel_key(task_id))
+
+
+def test_cancel_unknown_task(redis: Redis, task_id: str):
+    with pytest.raises(InputError):
+        task_service.cancel_task(task_id)
+    assert not redis.exists(task_id, cancel_key(task_id))
+
+
+def test_legacy_task_record(redis: Redis, task_id: str):
+    redis.set(task_id, pickle.dumps(Task(status=TaskStatus.queued)))
+
+    with pytest.raises(InputError, match='No such task'):
+        task_service.get_task_result(task_id)
+    _, results = task_service.get_task_results([task_id])
+    assert results == {task_id: None}
+    with pytest.raises(InputError, match='No such task'):
+        task_service.cancel_task(task_id)
+
+
+@pytest.fixture
+def precomputed(
+        redis: Redis,
+        prefix: str,
+        monkeypatch
+) -> Generator[List[List[TaskRequest]], Any, None]:
+    """
+    Tasks created by precompute_results.
+    """
+    created = []
+    cache = ResultCache(redis, prefix, ttl=60, max_size=100)
+    monkeypatch.setattr(task_service, 'result_cache', cache)
+    monkeypatch.setattr(
+        task_service, '__get_providers',
+        lambda sess, tasks: ['fake'] * len(tasks)
+    )
+    monkeypatch.setattr(
+        task_service, '__create_tasks',
+        lambda sess, tasks, count_cache: created.append(tasks)
+    )
+    yield created
+
+
+def test_precompute_results(
+        precomputed: List[List[TaskRequest]],
+        engine_id: uuid.UUID
+):
+    task_service.precompute_results(None, engine_id, 'hash')
+
+    assert [
+        (task.operation, task.priority) for task in precomputed[0]
+    ] == [
+        (TaskOperation.quality, TaskPriority.bulk),
+        (TaskOperation.liveness, TaskPriority.bulk),
+    ]
+
+
+def test_precompute_skips_cached_results(
+        precomputed: List[List[TaskRequest]],
+        engine_id: uuid.UUID
+):
+    cache = task_service.result_cache
+    cache.set('fake', TaskOperation.quality, 'hash', FaceQualityTask(
+        status=TaskStatus.finished, result=FaceQualityResult(score=0.9)
+    ))
+    task_service.precompute_results(None, engine_id, 'hash')
+
+    assert [task.operation for task in precomputed[0]] == [
+        TaskOperation.liveness
+    ]
+
+    cache.set('fake', TaskOperation.liveness, 'hash', FaceAntiSpoofTask(
+        status=TaskStatus.finished, result=FaceAntiSpoofResult(score=0.9)
+    ))
+    task_service.precompute_results(None, engine_id, 'hash')
+    assert len(precomputed) == 1
+
+
+def test_precompute_errors_are_logged(
+        precomputed: List[List[TaskRequest]],
+        engine_id: uuid.UUID,
+        monkeypatch
+):
+    def no_engine(sess, tasks):
+        raise InputError('No such engine')
+
+    monkeypatch.setattr(task_service, '__get_providers', no_engine)
+    task_service.precompute_results(None, engine_id, 'hash')
+
+    assert precomputed == []
+
+
+def test_precompute_is_not_a_cache_lookup(
+        precomputed: List[List[TaskRequest]],
+        engine_id: uuid.UUID
+):
+    task = TaskRequest(
+        operation=TaskOperation.quality,
+        engine_id=engine_id,
+        file_hash='hash',
+    )
+    misses = task_service.cache_misses
+
+    before = misses.value(provider='fake', operation='quality')
+    task_service.__get_cached_results(['fake'], [task], False)
+    assert misses.value(provider='fake', operation='quality') == before
+
+    task_service.__get_cached_results(['fake'], [task])
+    assert misses.value(provider='fake', operation='quality') == before + 1
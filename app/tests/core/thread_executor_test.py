@@ -0,0 +1,90 @@
+import threading
+import time
+
+from core.executors.thread import ThreadExecutor
+
+
+def test_burst_runs_on_max_workers():
+    executor = ThreadExecutor(
+        name='test-burst',
+        max_workers=4,
+        min_workers=1,
+        queue_size=8,
+        scale_up_wait=0.01,
+    )
+    # each job waits until all 4 jobs run at the same time
+    barrier = threading.Barrier(4, timeout=5)
+    passed = []
+    done = threading.Semaphore(0)
+
+    def job():
+        barrier.wait()
+        passed.append(True)
+        done.release()
+
+    for _ in range(4):
+        executor.submit(job)
+    for _ in range(4):
+        assert done.acquire(timeout=10)
+    executor.shutdown()
+
+    assert len(passed) == 4
+    assert executor.workers == 0
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_scale_between_min_and_max_workers():
+    executor = ThreadExecutor(
+        name='test-scale',
+        max_workers=3,
+        min_workers=1,
+        queue_size=8,
+        scale_up_wait=0.01,
+        idle_timeout=0.1,
+    )
+    assert executor.workers == 1
+    release = threading.Event()
+    for _ in range(6):
+        executor.submit(lambda: release.wait(10))
+
+    # grows up to max_workers while jobs wait
+    assert wait_for(lambda: executor.running == 3)
+    assert executor.workers == 3
+    assert executor.pending == 3
+
+    # shrinks back to min_workers once idle
+    release.set()
+    assert wait_for(lambda: executor.pending == 0 and executor.running == 0)
+    assert wait_for(lambda: executor.workers == 1)
+    time.sleep(0.3)
+    assert executor.workers == 1
+    executor.shutdown()
+
+
+def test_no_scale_up_before_wait():
+    executor = ThreadExecutor(
+        name='test-wait',
+        max_workers=2,
+        min_workers=1,
+        queue_size=8,
+        scale_up_wait=10,
+    )
+    release = threading.Event()
+    executor.submit(lambda: release.wait(10))
+    assert wait_for(lambda: executor.running == 1)
+    executor.submit(lambda: release.wait(10))
+
+    # the queued job has not waited scale_up_wait yet
+    time.sleep(0.1)
+    assert executor.workers == 1
+    assert executor.pending == 1
+    release.set()
+    executor.shutdown()
@@ -0,0 +1,280 @@
+import json
+import threading
+import uuid
+from typing import Any, Dict, Generator, List
+
+import pytest
+from redis import Redis
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from core import orchestrator, tracing
+from core.config import get_config
+from core.provider.interfaces import IProvider, IProviderConfig
+from core.provider.models.enums import TaskOperation
+from core.provider.models.tasks import (
+    FaceQualityResult,
+    FaceQualityTask,
+    TaskStatus,
+)
+from core.queue.models import TaskEnvelope
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class Spans:
+    """
+    Exporter that keeps the exported spans.
+    """
+
+    def __init__(self) -> None:
+        self.spans: List[Dict[str, Any]] = []
+
+    def export(self, span: tracing.Span, duration: float) -> None:
+        self.spans.append(span.as_zipkin(duration))
+
+    def named(self, name: str) -> List[Dict[str, Any]]:
+        return [span for span in self.spans if span['name'] == name]
+
+
+@pytest.fixture
+def spans(monkeypatch) -> Spans:
+    spans = Spans()
+    monkeypatch.setattr(tracing, 'get_exporter', lambda: spans)
+    return spans
+
+
+def test_parse_traceparent():
+    assert tracing.parse_traceparent(
+        f'00-{TRACE_ID}-{PARENT_ID}-01'
+    ) == (TRACE_ID, PARENT_ID)
+    # header values are case insensitive and may have spaces around
+    assert tracing.parse_traceparent(
+        f' 00-{TRACE_ID.upper()}-{PARENT_ID}-00 '
+    ) == (TRACE_ID, PARENT_ID)
+
+
+@pytest.mark.parametrize('value', [
+    None,
+    '',
+    'garbage',
+    f'01-{TRACE_ID}-{PARENT_ID}-01',
+    f'00-{TRACE_ID[:-1]}-{PARENT_ID}-01',
+    f'00-{TRACE_ID}-{PARENT_ID}0-01',
+    f'00-{TRACE_ID}-{PARENT_ID}',
+    f'00-{"x" * 32}-{PARENT_ID}-01',
+    f'00-{"0" * 32}-{PARENT_ID}-01',
+], ids=[
+    'none', 'empty', 'garbage', 'version', 'short trace', 'long span',
+    'no flags', 'not hex', 'zero trace',
+])
+def test_parse_malformed_traceparent(value):
+    assert tracing.parse_traceparent(value) is None
+
+
+def test_trace_continues_traceparent(spans: Spans):
+    with tracing.trace(f'00-{TRACE_ID}-{PARENT_ID}-01', 'request') as root:
+        assert tracing.current_span() is root
+        assert tracing.traceparent() == root.traceparent
+        assert tracing.headers() == {'traceparent': root.traceparent}
+
+    assert root.trace_id == TRACE_ID
+    assert root.parent_id == PARENT_ID
+    assert tracing.current_span() is None
+    assert spans.named('request')[0]['parentId'] == PARENT_ID
+
+
+def test_malformed_traceparent_starts_trace(spans: Spans):
+    with tracing.trace('00-bad-header-01', 'request') as root:
+        pass
+
+    assert len(root.trace_id) == 32 and root.trace_id != TRACE_ID
+    assert root.parent_id is None
+    assert 'parentId' not in spans.named('request')[0]
+
+
+def test_no_spans_outside_trace(spans: Spans):
+    with tracing.span('orphan') as orphan:
+        assert orphan is None
+
+    assert tracing.traceparent() is None
+    assert tracing.headers() == {}
+    assert spans.spans == []
+
+
+def test_span_parenting(spans: Spans):
+    with tracing.trace(None, 'request', 'SERVER') as root:
+        with tracing.span('child', 'CLIENT', attempt=1) as child:
+            assert tracing.current_span() is child
+        assert tracing.current_span() is root
+
+    exported_child, exported_root = spans.spans
+    assert exported_child['parentId'] == root.span_id
+    assert exported_child['traceId'] == exported_root['traceId']
+    assert exported_child['tags'] == {'attempt': '1'}
+
+
+def test_span_records_error(spans: Spans):
+    with pytest.raises(ValueError):
+        with tracing.trace(None, 'request'):
+            with tracing.span('child'):
+                raise ValueError('failed')
+
+    assert [span['tags'] for span in spans.spans] == [
+        {'error': 'ValueError'}, {'error': 'ValueError'}
+    ]
+
+
+def test_file_exporter(tmp_path):
+    path = tmp_path / 'spans.json'
+    exporter = tracing.FileExporter(str(path))
+    root = tracing.Span('request', TRACE_ID, None, None, route='/task')
+    child = tracing.Span('child', TRACE_ID, root.span_id, 'CLIENT')
+
+    exporter.export(child, 0.25)
+    exporter.export(root, 0)
+
+    first, second = [
+        json.loads(line) for line in path.read_text().splitlines()
+    ]
+    assert first == {
+        'traceId': TRACE_ID,
+        'id': child.span_id,
+        'parentId': root.span_id,
+        'name': 'child',
+        'kind': 'CLIENT',
+        'timestamp': first['timestamp'],
+        'duration': 250000,
+        'localEndpoint': {'serviceName': get_config().project_name},
+        'tags': {},
+    }
+    assert isinstance(first['timestamp'], int)
+    # zero durations are exported as 1 microsecond
+    assert second['duration'] == 1
+    assert second['tags'] == {'route': '/task'}
+    assert 'parentId' not in second and 'kind' not in second
+
+
+def test_file_exporter_without_file():
+    exporter = tracing.FileExporter(None)
+
+    exporter.export(tracing.Span('request', TRACE_ID), 1)
+
+
+class QualityProvider(IProvider):
+    def __init__(self) -> None:
+        super().__init__(IProviderConfig(
+            engine_type='facenet',
+            version={'major': 1, 'minor': 0, 'path': 0},
+            description='tracing test',
+            quality_threshold=0.5,
+            anti_spoofing_threshold=0.5,
+            build='test',
+            orchestrator={'orchestrator_type': 'thread', 'params': {}},
+        ))
+
+    def quality(self, data: bytes) -> FaceQualityTask:
+        with tracing.span('POST quality', 'CLIENT'):
+            return FaceQualityTask(
+                status=TaskStatus.finished,
+                result=FaceQualityResult(score=0.9),
+            )
+
+
+def test_task_continues_request_trace(
+        redis: Redis,
+        prefix: str,
+        spans: Spans
+):
+    with tracing.trace(None, 'POST /task/quality', 'SERVER') as request:
+        task = TaskEnvelope(
+            task_id=f'{prefix}:task',
+            operation=TaskOperation.quality,
+            engine_id=uuid.uuid4(),
+            provider='fake',
+            file_hash=prefix,
+            traceparent=tracing.traceparent(),
+        )
+
+    # the task runs on an executor thread without the request context
+    thread = threading.Thread(
+        target=orchestrator.run,
+        args=(task, QualityProvider(), b'data', redis),
+    )
+    thread.start()
+    thread.join(10)
+
+    consumer, = spans.named('task quality')
+    assert consumer['traceId'] == request.trace_id
+    assert consumer['parentId'] == request.span_id
+    assert consumer['kind'] == 'CONSUMER'
+    assert consumer['tags']['task_id'] == task.task_id
+    engine, = spans.named('POST quality')
+    assert engine['parentId'] == consumer['id']
+
+
+@pytest.fixture
+def traced_redis() -> Generator[tracing.TracedRedis, Any, None]:
+    redis = tracing.TracedRedis(
+        host=get_config().redis_host,
+        port=get_config().redis_port,
+        db=get_config().redis_queue_db
+    )
+    yield redis
+    redis.close()
+
+
+def test_traced_redis(
+        traced_redis: tracing.TracedRedis,
+        prefix: str,
+        spans: Spans
+):
+    with tracing.trace(None, 'request') as root:
+        traced_redis.set(f'{prefix}:key', b'value')
+        pipe = traced_redis.pipeline()
+        pipe.get(f'{prefix}:key')
+        pipe.delete(f'{prefix}:key')
+        assert pipe.execute() == [b'value', 1]
+
+    assert [span['name'] for span in spans.spans] == [
+        'redis SET', 'redis pipeline', 'request'
+    ]
+    assert spans.named('redis pipeline')[0]['tags'] == {'commands': '2'}
+    for span in spans.spans[:2]:
+        assert span['parentId'] == root.span_id
+        assert span['kind'] == 'CLIENT'
+
+
+def test_traced_redis_outside_trace(
+        traced_redis: tracing.TracedRedis,
+        prefix: str,
+        spans: Spans
+):
+    traced_redis.set(f'{prefix}:key', b'value')
+
+    assert traced_redis.get(f'{prefix}:key') == b'value'
+    assert spans.spans == []
+
+
+def test_traced_engine(spans: Spans):
+    engine = create_engine('sqlite://')
+    tracing.trace_engine(engine)
+
+    with tracing.trace(None, 'request') as root:
+        with engine.connect() as connection:
+            connection.execute(text('select 1'))
+            with pytest.raises(OperationalError):
+                connection.execute(text('select * from missing'))
+
+    select, failed = spans.named('db SELECT')
+    assert select['parentId'] == root.span_id
+    assert select['kind'] == 'CLIENT'
+    assert 'error' not in select['tags']
+    assert failed['tags'] == {'error': 'true'}
+
+    # statements outside a trace are not recorded
+    spans.spans.clear()
+    with engine.connect() as connection:
+        connection.execute(text('select 1'))
+    assert spans.spans == []
@@ -0,0 +1,106 @@
+import threading
+from typing import Callable, List, Optional
+
+from redis import Redis
+
+from core.provider.models.enums import TaskOperation, TaskPriority
+from core.provider.models.tasks import Task, TaskStatus
+from core.queue.models import TaskEnvelope
+from core.queue.redis_queue import RedisTaskQueue
+from core.queue.task_store import get_task, set_task
+from core.queue.worker import Worker
+
+
+class Providers:
+    provider_names = ['fake']
+
+    def get_provider(self, name: str) -> None:
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class StuckExecutors:
+    """
+    Accepts tasks and never finishes them. Tasks in started get the
+    started status, as if their provider call is in progress.
+    """
+
+    def __init__(self, started: List[str], count: int) -> None:
+        self.__started = started
+        self.__count = count
+        self.submitted: List[TaskEnvelope] = []
+        self.all_submitted = threading.Event()
+
+    def submit_task(
+            self,
+            task: TaskEnvelope,
+            redis: Redis,
+            done: Optional[Callable[[], None]] = None,
+            **kwargs
+    ) -> None:
+        if task.task_id in self.__started:
+            set_task(redis, task.task_id, Task(status=TaskStatus.started))
+        self.submitted.append(task)
+        if len(self.submitted) == self.__count:
+            self.all_submitted.set()
+
+    def drain(self, grace_period: float) -> List[TaskEnvelope]:
+        return list(self.submitted)
+
+
+def test_drain_fails_started_register(
+        redis: Redis,
+        prefix: str,
+        create_envelope: Callable[..., TaskEnvelope]
+):
+    queue = RedisTaskQueue(
+        redis=redis,
+        name=prefix,
+        visibility_timeout=60,
+        max_attempts=2,
+        heartbeat_ttl=60,
+        weights={priority: 1 for priority in TaskPriority},
+    )
+    started_register, queued_register, started_quality = [
+        create_envelope(0, operation=TaskOperation.register),
+        create_envelope(1, operation=TaskOperation.register),
+        create_envelope(2, operation=TaskOperation.quality),
+    ]
+    envelopes = [started_register, queued_register, started_quality]
+    for envelope in envelopes:
+        set_task(redis, envelope.task_id, Task(status=TaskStatus.queued))
+        queue.push(envelope)
+    redis.set(f'{prefix}:file', b'data')
+    executors = StuckExecutors(
+        [started_register.task_id, started_quality.task_id], len(envelopes)
+    )
+    worker = Worker(
+        queue=queue,
+        providers=Providers(),
+        executors=executors,
+        redis_tasks=redis,
+        redis_cashe=redis,
+        concurrency=len(envelopes),
+        heartbeat_interval=60,
+        grace_period=0,
+    )
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    assert executors.all_submitted.wait(10)
+    worker.stop()
+    thread.join(10)
+
+    # the engine may have registered the face already
+    failed = get_task(redis, started_register.task_id)
+    assert failed.status == TaskStatus.failed
+    assert failed.result.message == 'Service is shutting down'
+    # the rest run again on another worker
+    for envelope in (queued_register, started_quality):
+        assert get_task(redis, envelope.task_id).status == TaskStatus.queued
+    requeued = [queue.pop('other', timeout=1) for _ in range(3)]
+    assert sorted(
+        item.envelope.task_id for item in requeued if item is not None
+    ) == [queued_register.task_id, started_quality.task_id]
+    assert not redis.llen(queue.processing_key(worker.worker_id))
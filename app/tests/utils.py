@@ -0,0 +1,46 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from core.config import get_config
+from core.executors.manager import get_executor_manager
+from core.provider.manager import get_provider_manager
+
+prefix = get_config().api_prefix
+
+
+def wait_task(client: TestClient, task_id: str, timeout: float = 30.0):
+    """
+    Poll task status until it is finished or failed.
+    """
+    deadline = time.time() + timeout
+    while True:
+        response = client.get(
+            f'{prefix}/task', 
+            params={
+                'uuid': task_id
+            }
+        )
+        if response.status_code != 200:
+            return response
+        if response.json()['status'] in ('finished', 'failed'):
+            return response
+        if time.time() > deadline:
+            return response
+        time.sleep(0.5)
+
+
+def wait_idle(timeout: float = 30.0) -> bool:
+    """
+    Wait until the local executors have no queued or running tasks.
+    """
+    executors = [
+        get_executor_manager().get_executor(name)
+        for name in get_provider_manager().provider_names
+    ]
+    deadline = time.time() + timeout
+    while any(e.pending or e.running for e in executors):
+        if time.time() > deadline:
+            return False
+        time.sleep(0.1)
+    return True